@@ -0,0 +1,348 @@
+"""A compact storage of per-URL request time aggregates."""
+
+from array import array
+from itertools import repeat
+from typing import Any, Dict, List, Union
+
+from constants import MICROSECONDS_PER_SECOND, MINUTES_PER_DAY, OTHER_URL
+from constants import STATUS_CLASSES
+from quantiles import QuantileHistogram
+
+
+class AggregateStore:
+    """
+    Per-URL aggregates kept in parallel typed arrays.
+
+    Every URL is interned to an integer id which is an index in the arrays.
+    Request time sums are kept as integer microseconds, so stores of
+    different log chunks can be merged in any order without float rounding
+    errors. A request time histogram is created only for a URL requested more
+    than once: a single request time equals time_max.
+
+    If a number of URLs reaches max_url_number, requests to new URLs are
+    aggregated into the OTHER_URL bucket, so memory is bounded for any
+    traffic.
+
+    A store with dimensions also keeps per-URL body bytes sums, per-URL
+    counts of status classes in a flat array of STATUS_CLASSES items per URL
+    and request time series in arrays indexed by a minute of day.
+    """
+    __slots__ = (
+        'url_ids',
+        'urls',
+        'counts',
+        'time_sums',
+        'time_maxs',
+        'histograms',
+        'max_url_number',
+        'line_number',
+        'error_number',
+        'total_request_number',
+        'total_request_time',
+        'dimensions',
+        'bytes_sums',
+        'status_counts',
+        'minute_counts',
+        'minute_time_sums',
+        'minute_time_maxs',
+    )
+
+    def __init__(
+            self,
+            max_url_number: Union[int, None] = None,
+            dimensions: bool = False
+    ):
+        self.url_ids = {}
+        self.urls = []
+        self.counts = array('Q')
+        self.time_sums = array('Q')
+        self.time_maxs = array('d')
+        self.histograms = []
+        self.max_url_number = max_url_number
+        self.line_number = 0
+        self.error_number = 0
+        self.total_request_number = 0
+        self.total_request_time = 0
+        self.dimensions = dimensions
+        self.bytes_sums = array('Q')
+        self.status_counts = array('Q')
+        minute_number = MINUTES_PER_DAY if dimensions else 0
+        self.minute_counts = array('Q', repeat(0, minute_number))
+        self.minute_time_sums = array('Q', repeat(0, minute_number))
+        self.minute_time_maxs = array('d', repeat(0, minute_number))
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def add(self, url: str, request_time: float) -> int:
+        """
+        Add a request to the aggregates.
+
+        :param url: a request URL;
+        :param request_time: a request processing time in seconds;
+        :return: an id of the URL which the request is aggregated to.
+        """
+        request_time_us = round(request_time * MICROSECONDS_PER_SECOND)
+        self.total_request_number += 1
+        self.total_request_time += request_time_us
+
+        url_id = self.url_ids.get(url)
+        if url_id is None and self._is_full():
+            url = OTHER_URL
+            url_id = self.url_ids.get(url)
+        if url_id is None:
+            url_id = self.url_ids[url] = len(self.urls)
+            self.urls.append(url)
+            self.counts.append(1)
+            self.time_sums.append(request_time_us)
+            self.time_maxs.append(request_time)
+            self.histograms.append(None)
+            return url_id
+
+        histogram = self.histograms[url_id]
+        if histogram is None:
+            histogram = self.histograms[url_id] = QuantileHistogram()
+            histogram.add(self.time_maxs[url_id])
+        histogram.add(request_time)
+
+        self.counts[url_id] += 1
+        self.time_sums[url_id] += request_time_us
+        if request_time > self.time_maxs[url_id]:
+            self.time_maxs[url_id] = request_time
+        return url_id
+
+    def intern_url(self, url: str) -> int:
+        """
+        Return an id of a URL, add the URL without requests if it is new.
+
+        A batch aggregation interns URLs of a block first and adds their
+        requests later, so ids are assigned in the order of requests as
+        they are by add.
+
+        :param url: a request URL;
+        :return: an id of the URL which requests are aggregated to.
+        """
+        url_id = self.url_ids.get(url)
+        if url_id is None and self._is_full():
+            url = OTHER_URL
+            url_id = self.url_ids.get(url)
+        if url_id is None:
+            url_id = self.url_ids[url] = len(self.urls)
+            self.urls.append(url)
+            self.counts.append(0)
+            self.time_sums.append(0)
+            self.time_maxs.append(0.0)
+            self.histograms.append(None)
+            if self.dimensions:
+                self._pad_dimensions()
+        return url_id
+
+    def add_request(
+            self,
+            url: str,
+            request_time: float,
+            status: int,
+            body_bytes: int,
+            minute: int
+    ):
+        """
+        Add a request with its dimensions to the aggregates.
+
+        :param url: a request URL;
+        :param request_time: a request processing time in seconds;
+        :param status: a response status code;
+        :param body_bytes: a number of sent body bytes;
+        :param minute: a minute of day in the range [0, MINUTES_PER_DAY).
+        """
+        url_id = self.add(url, request_time)
+        if url_id >= len(self.bytes_sums):
+            self._pad_dimensions()
+        self.bytes_sums[url_id] += body_bytes
+        class_number = len(STATUS_CLASSES)
+        status_class = status // 100 - 1
+        if 0 <= status_class < class_number:
+            self.status_counts[url_id * class_number + status_class] += 1
+
+        self.minute_counts[minute] += 1
+        self.minute_time_sums[minute] += round(
+            request_time * MICROSECONDS_PER_SECOND
+        )
+        if request_time > self.minute_time_maxs[minute]:
+            self.minute_time_maxs[minute] = request_time
+
+    def get_status_counts(self, url_id: int) -> List[int]:
+        """
+        Return counts of status classes of a URL.
+
+        :param url_id: a URL id;
+        :return: counts in the order of STATUS_CLASSES.
+        """
+        status_start = url_id * len(STATUS_CLASSES)
+        if status_start >= len(self.status_counts):
+            return [0] * len(STATUS_CLASSES)
+        return self.status_counts[
+            status_start:status_start + len(STATUS_CLASSES)
+        ].tolist()
+
+    def _pad_dimensions(self):
+        missing_url_number = len(self.urls) - len(self.bytes_sums)
+        self.bytes_sums.extend(repeat(0, missing_url_number))
+        self.status_counts.extend(
+            repeat(0, missing_url_number * len(STATUS_CLASSES))
+        )
+
+    def _merge_dimensions(self, other: 'AggregateStore', url_ids: List[int]):
+        class_number = len(STATUS_CLASSES)
+        status_counts = self.status_counts
+        other_status_counts = other.status_counts
+        for other_id, url_id in enumerate(url_ids[:len(other.bytes_sums)]):
+            self.bytes_sums[url_id] += other.bytes_sums[other_id]
+            status_start = url_id * class_number
+            other_status_start = other_id * class_number
+            for status_class in range(class_number):
+                status_counts[status_start + status_class] += (
+                    other_status_counts[other_status_start + status_class]
+                )
+
+        for minute, count in enumerate(other.minute_counts):
+            if not count:
+                continue
+            self.minute_counts[minute] += count
+            self.minute_time_sums[minute] += other.minute_time_sums[minute]
+            if other.minute_time_maxs[minute] > self.minute_time_maxs[minute]:
+                self.minute_time_maxs[minute] = other.minute_time_maxs[minute]
+
+    def _is_full(self) -> bool:
+        max_url_number = self.max_url_number
+        return max_url_number is not None and len(self.urls) >= max_url_number
+
+    def merge(self, other: 'AggregateStore'):
+        """
+        Merge another store into this one.
+
+        Counts, sums, maximums and request time histograms are merged exactly.
+        Dimensions are merged if both stores have them. Histograms of
+        the other store are copied, so it may be changed later.
+
+        :param other: a store to merge.
+        """
+        self.line_number += other.line_number
+        self.error_number += other.error_number
+        self.total_request_number += other.total_request_number
+        self.total_request_time += other.total_request_time
+
+        url_ids = []
+        for other_id, url in enumerate(other.urls):
+            other_histogram = other.histograms[other_id]
+            url_id = self.url_ids.get(url)
+            if url_id is None and self._is_full():
+                url = OTHER_URL
+                url_id = self.url_ids.get(url)
+            if url_id is None:
+                url_ids.append(len(self.urls))
+                self.url_ids[url] = len(self.urls)
+                self.urls.append(url)
+                self.counts.append(other.counts[other_id])
+                self.time_sums.append(other.time_sums[other_id])
+                self.time_maxs.append(other.time_maxs[other_id])
+                histogram = None
+                if other_histogram is not None:
+                    histogram = QuantileHistogram()
+                    histogram.merge(other_histogram)
+                self.histograms.append(histogram)
+                continue
+
+            url_ids.append(url_id)
+            histogram = self.histograms[url_id]
+            if histogram is None:
+                histogram = self.histograms[url_id] = QuantileHistogram()
+                histogram.add(self.time_maxs[url_id])
+            if other_histogram is None:
+                histogram.add(other.time_maxs[other_id])
+            else:
+                histogram.merge(other_histogram)
+
+            self.counts[url_id] += other.counts[other_id]
+            self.time_sums[url_id] += other.time_sums[other_id]
+            if other.time_maxs[other_id] > self.time_maxs[url_id]:
+                self.time_maxs[url_id] = other.time_maxs[other_id]
+
+        if self.dimensions:
+            self._pad_dimensions()
+            if other.dimensions:
+                self._merge_dimensions(other, url_ids)
+
+    def get_quantile(self, url_id: int, quantile: float) -> Union[float, None]:
+        """
+        Return a request time quantile estimation of a URL.
+
+        :param url_id: a URL id;
+        :param quantile: a quantile in the range [0, 1];
+        :return: a quantile estimation.
+        """
+        histogram = self.histograms[url_id]
+        if histogram is None:
+            return self.time_maxs[url_id]
+        return histogram.get_quantile(quantile)
+
+    def to_state(self) -> Dict[str, Any]:
+        """Return the store state of JSON serializable types."""
+        return {
+            'urls': self.urls,
+            'counts': self.counts.tolist(),
+            'time_sums': self.time_sums.tolist(),
+            'time_maxs': self.time_maxs.tolist(),
+            'histograms': [
+                None if histogram is None else histogram.to_state()
+                for histogram in self.histograms
+            ],
+            'line_number': self.line_number,
+            'error_number': self.error_number,
+            'total_request_number': self.total_request_number,
+            'total_request_time': self.total_request_time,
+            'dimensions': self.dimensions,
+            'bytes_sums': self.bytes_sums.tolist(),
+            'status_counts': self.status_counts.tolist(),
+            'minute_counts': self.minute_counts.tolist(),
+            'minute_time_sums': self.minute_time_sums.tolist(),
+            'minute_time_maxs': self.minute_time_maxs.tolist(),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> 'AggregateStore':
+        """
+        Return a store restored from a state.
+
+        :param state: a state returned by to_state;
+        :return: a store.
+        """
+        aggregates = cls(dimensions=state.get('dimensions', False))
+        if aggregates.dimensions:
+            aggregates.bytes_sums = array('Q', state['bytes_sums'])
+            aggregates.status_counts = array('Q', state['status_counts'])
+            aggregates.minute_counts = array('Q', state['minute_counts'])
+            aggregates.minute_time_sums = array(
+                'Q',
+                state['minute_time_sums']
+            )
+            aggregates.minute_time_maxs = array(
+                'd',
+                state['minute_time_maxs']
+            )
+        aggregates.urls = list(state['urls'])
+        aggregates.url_ids = {
+            url: url_id for url_id, url in enumerate(aggregates.urls)
+        }
+        aggregates.counts = array('Q', state['counts'])
+        aggregates.time_sums = array('Q', state['time_sums'])
+        aggregates.time_maxs = array('d', state['time_maxs'])
+        aggregates.histograms = [
+            None if histogram is None
+            else QuantileHistogram.from_state(histogram)
+            for histogram in state['histograms']
+        ]
+        aggregates.line_number = state['line_number']
+        aggregates.error_number = state['error_number']
+        aggregates.total_request_number = state['total_request_number']
+        aggregates.total_request_time = state['total_request_time']
+        return aggregates
@@ -0,0 +1,301 @@
+"""Vectorized aggregation of request blocks by NumPy if it is installed."""
+
+from array import array
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+
+from aggregate_store import AggregateStore
+from constants import MICROSECONDS_PER_SECOND, MINUTES_PER_DAY
+from constants import STATUS_CLASSES
+from quantiles import MIN_TRACKED_VALUE, QuantileHistogram, get_bucket_index
+
+BLOCK_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def import_numpy():
+    """
+    Return the numpy module or None if it is not installed.
+
+    NumPy is imported on the first use only, so runs which do not aggregate
+    by blocks do not pay for its import.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def numpy_available() -> bool:
+    """Return True if NumPy can be imported."""
+    return import_numpy() is not None
+
+
+class RequestBlock:
+    """
+    A block of requests which are added to a store by array operations.
+
+    URLs are interned to store ids as requests come, so the ids are
+    the same as if requests were added one by one. Ids and request times
+    are collected in typed arrays, and the block is reduced when it has
+    block_size requests: counts and sums by np.bincount, maximums by
+    np.maximum.at, histogram buckets by np.unique of (url id, bucket) keys.
+    A bucket is calculated once per distinct request time with the same
+    function as QuantileHistogram.add, so the store equals a store filled
+    by AggregateStore.add.
+    """
+    __slots__ = (
+        'aggregates',
+        'block_size',
+        'url_ids',
+        'request_times',
+        'statuses',
+        'body_bytes',
+        'minutes',
+    )
+
+    def __init__(
+            self,
+            aggregates: AggregateStore,
+            block_size: int = BLOCK_SIZE
+    ):
+        if not numpy_available():
+            raise RuntimeError('NumPy is not installed')
+        self.aggregates = aggregates
+        self.block_size = block_size
+        self._reset()
+
+    def _reset(self):
+        self.url_ids = array('q')
+        self.request_times = array('d')
+        self.statuses = array('q')
+        self.body_bytes = array('q')
+        self.minutes = array('q')
+
+    def add(self, url: str, request_time: float):
+        """
+        Add a request to the block.
+
+        :param url: a request URL;
+        :param request_time: a request processing time in seconds.
+        """
+        url_id = self.aggregates.url_ids.get(url)
+        if url_id is None:
+            url_id = self.aggregates.intern_url(url)
+        self.url_ids.append(url_id)
+        self.request_times.append(request_time)
+        if len(self.url_ids) >= self.block_size:
+            self.flush()
+
+    def add_request(
+            self,
+            url: str,
+            request_time: float,
+            status: int,
+            body_bytes: int,
+            minute: int
+    ):
+        """
+        Add a request with its dimensions to the block.
+
+        :param url: a request URL;
+        :param request_time: a request processing time in seconds;
+        :param status: a response status code;
+        :param body_bytes: a number of sent body bytes;
+        :param minute: a minute of day in the range [0, MINUTES_PER_DAY).
+        """
+        self.statuses.append(status)
+        self.body_bytes.append(body_bytes)
+        self.minutes.append(minute)
+        self.add(url, request_time)
+
+    def flush(self):
+        """Add collected requests to the store and empty the block."""
+        if self.url_ids:
+            self._reduce()
+        self._reset()
+
+    def _reduce(self):
+        np = import_numpy()
+        aggregates = self.aggregates
+        url_number = len(aggregates)
+        url_ids = np.frombuffer(self.url_ids, dtype=np.int64)
+        request_times = np.frombuffer(self.request_times, dtype=np.float64)
+        request_times_us = np.rint(
+            request_times * MICROSECONDS_PER_SECOND
+        ).astype(np.int64)
+
+        previous_counts = np.array(aggregates.counts, dtype=np.int64)
+        block_counts = np.bincount(url_ids, minlength=url_number)
+        block_time_sums = np.bincount(
+            url_ids,
+            weights=request_times_us,
+            minlength=url_number
+        )
+        block_time_maxs = np.full(url_number, -np.inf)
+        np.maximum.at(block_time_maxs, url_ids, request_times)
+
+        self._add_to_histograms(
+            url_ids,
+            request_times,
+            previous_counts + block_counts,
+            block_time_maxs
+        )
+
+        counts = aggregates.counts
+        time_sums = aggregates.time_sums
+        time_maxs = aggregates.time_maxs
+        for url_id in np.flatnonzero(block_counts).tolist():
+            new_url = not counts[url_id]
+            counts[url_id] += int(block_counts[url_id])
+            time_sums[url_id] += int(block_time_sums[url_id])
+            time_max = float(block_time_maxs[url_id])
+            if new_url or time_max > time_maxs[url_id]:
+                time_maxs[url_id] = time_max
+
+        aggregates.total_request_number += len(url_ids)
+        aggregates.total_request_time += int(request_times_us.sum())
+        if aggregates.dimensions:
+            self._reduce_dimensions(url_ids, request_times, request_times_us)
+
+    def _add_to_histograms(
+            self,
+            url_ids,
+            request_times,
+            total_counts,
+            block_time_maxs
+    ):
+        # A histogram is kept for a URL requested more than once. A URL
+        # which had a single request gets a histogram of its time_max first.
+        np = import_numpy()
+        aggregates = self.aggregates
+        histogram_mask = total_counts[url_ids] > 1
+        if not histogram_mask.any():
+            return
+        url_ids = url_ids[histogram_mask]
+        request_times = request_times[histogram_mask]
+
+        distinct_times, time_indexes = np.unique(
+            request_times,
+            return_inverse=True
+        )
+        # Zero times get the bucket below the lowest one.
+        distinct_buckets = [
+            get_bucket_index(request_time)
+            if request_time > MIN_TRACKED_VALUE else None
+            for request_time in distinct_times.tolist()
+        ]
+        lowest_bucket = min(
+            (bucket for bucket in distinct_buckets if bucket is not None),
+            default=0
+        ) - 1
+        distinct_buckets = np.array(
+            [
+                lowest_bucket if bucket is None else bucket
+                for bucket in distinct_buckets
+            ],
+            dtype=np.int64
+        )
+        bucket_span = int(distinct_buckets.max()) - lowest_bucket + 1
+        keys = (
+            url_ids * bucket_span
+            + distinct_buckets[time_indexes.reshape(-1)] - lowest_bucket
+        )
+        distinct_keys, key_counts = np.unique(keys, return_counts=True)
+
+        block_time_mins = np.full(len(aggregates), np.inf)
+        np.minimum.at(block_time_mins, url_ids, request_times)
+
+        url_bucket_counts = groupby(
+            zip(
+                (distinct_keys // bucket_span).tolist(),
+                (distinct_keys % bucket_span + lowest_bucket).tolist(),
+                key_counts.tolist()
+            ),
+            key=itemgetter(0)
+        )
+        for url_id, bucket_counts in url_bucket_counts:
+            histogram = aggregates.histograms[url_id]
+            if histogram is None:
+                histogram = aggregates.histograms[url_id] = (
+                    QuantileHistogram()
+                )
+                if aggregates.counts[url_id]:
+                    histogram.add(aggregates.time_maxs[url_id])
+            zero_count = 0
+            tracked_bucket_counts = []
+            for _, bucket, number in bucket_counts:
+                if bucket == lowest_bucket:
+                    zero_count = number
+                else:
+                    tracked_bucket_counts.append((bucket, number))
+            histogram.add_buckets(
+                tracked_bucket_counts,
+                zero_count,
+                float(block_time_mins[url_id]),
+                float(block_time_maxs[url_id])
+            )
+
+    def _reduce_dimensions(self, url_ids, request_times, request_times_us):
+        np = import_numpy()
+        aggregates = self.aggregates
+        url_number = len(aggregates)
+        class_number = len(STATUS_CLASSES)
+        block_bytes_sums = np.bincount(
+            url_ids,
+            weights=np.frombuffer(self.body_bytes, dtype=np.int64),
+            minlength=url_number
+        )
+        bytes_sums = aggregates.bytes_sums
+        for url_id in np.flatnonzero(block_bytes_sums).tolist():
+            bytes_sums[url_id] += int(block_bytes_sums[url_id])
+
+        status_classes = (
+            np.frombuffer(self.statuses, dtype=np.int64) // 100 - 1
+        )
+        class_mask = (status_classes >= 0) & (status_classes < class_number)
+        block_status_counts = np.bincount(
+            url_ids[class_mask] * class_number + status_classes[class_mask],
+            minlength=url_number * class_number
+        )
+        status_counts = aggregates.status_counts
+        for status_index in np.flatnonzero(block_status_counts).tolist():
+            status_counts[status_index] += int(
+                block_status_counts[status_index]
+            )
+
+        minutes = np.frombuffer(self.minutes, dtype=np.int64)
+        minute_counts = np.bincount(minutes, minlength=MINUTES_PER_DAY)
+        minute_time_sums = np.bincount(
+            minutes,
+            weights=request_times_us,
+            minlength=MINUTES_PER_DAY
+        )
+        minute_time_maxs = np.array(aggregates.minute_time_maxs)
+        np.maximum.at(minute_time_maxs, minutes, request_times)
+        minute_counts += np.array(aggregates.minute_counts, dtype=np.int64)
+        minute_time_sums = (
+            minute_time_sums.astype(np.int64)
+            + np.array(aggregates.minute_time_sums, dtype=np.int64)
+        )
+        aggregates.minute_counts = array('Q', minute_counts.tolist())
+        aggregates.minute_time_sums = array('Q', minute_time_sums.tolist())
+        aggregates.minute_time_maxs = array('d', minute_time_maxs.tolist())
+
+
+def get_request_block(
+        aggregates: AggregateStore,
+        block_size: int = BLOCK_SIZE
+) -> RequestBlock or None:
+    """
+    Return a request block of a store or None if NumPy is not installed.
+
+    :param aggregates: a store to add requests to;
+    :param block_size: a number of requests reduced at once;
+    :return: a request block.
+    """
+    if not numpy_available():
+        return None
+    return RequestBlock(aggregates, block_size)
@@ -0,0 +1,111 @@
+"""
+Compare peak RSS of per-URL dicts and the compact aggregate store.
+
+Each storage is filled in a separate process with synthetic requests to
+unique URLs like /api/v2/banner/<id>.
+
+Usage:
+    $ python3 benchmarks/aggregate_memory.py [--url-number N] [--repeat R]
+"""
+
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPT_DIR)
+
+from aggregate_store import AggregateStore  # noqa: E402
+from constants import MICROSECONDS_PER_SECOND  # noqa: E402
+from quantiles import QuantileHistogram  # noqa: E402
+
+
+def fill_dicts(requests):
+    """Aggregate requests into a dict per URL as calculations did before."""
+    statistics_per_url = {}
+    for url, request_time in requests:
+        request_time_us = round(request_time * MICROSECONDS_PER_SECOND)
+        url_info = statistics_per_url.get(url)
+        if url_info is None:
+            time_histogram = QuantileHistogram()
+            time_histogram.add(request_time)
+            statistics_per_url[url] = {
+                'count': 1,
+                'time_sum': request_time_us,
+                'time_avg': request_time,
+                'time_max': request_time,
+                'time_hist': time_histogram,
+            }
+            continue
+        url_info['count'] += 1
+        url_info['time_sum'] += request_time_us
+        url_info['time_avg'] = url_info['time_sum'] / url_info['count']
+        url_info['time_max'] = max(url_info['time_max'], request_time)
+        url_info['time_hist'].add(request_time)
+    return statistics_per_url
+
+
+def fill_store(requests):
+    """Aggregate requests into the compact store."""
+    aggregates = AggregateStore()
+    for url, request_time in requests:
+        aggregates.add(url, request_time)
+    return aggregates
+
+
+def generate_requests(url_number, repeat):
+    """Yield synthetic requests, most URLs are requested once."""
+    random_generator = random.Random(0)
+    for url_id in range(url_number):
+        url = f'/api/v2/banner/{16000000 + url_id}'
+        request_number = repeat if url_id % 10 == 0 else 1
+        for _ in range(request_number):
+            yield url, round(random_generator.expovariate(5), 3)
+
+
+def measure(storage_name, url_number, repeat):
+    """Fill a storage and print peak RSS in kilobytes."""
+    fill_function = fill_dicts if storage_name == 'dict' else fill_store
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    aggregates = fill_function(generate_requests(url_number, repeat))
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(len(aggregates), baseline_rss, peak_rss)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--url-number', type=int, default=1000000)
+    argument_parser.add_argument('--repeat', type=int, default=5)
+    argument_parser.add_argument('--storage', choices=('dict', 'store'))
+    arguments = argument_parser.parse_args()
+    if arguments.storage:
+        measure(arguments.storage, arguments.url_number, arguments.repeat)
+        return
+
+    print(f'{"storage":<10}{"URLs":>10}{"peak RSS, MB":>14}{"growth, MB":>12}')
+    for storage_name in ('dict', 'store'):
+        output = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                '--storage', storage_name,
+                '--url-number', str(arguments.url_number),
+                '--repeat', str(arguments.repeat),
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        ).stdout
+        url_number, baseline_rss, peak_rss = map(int, output.split())
+        print(
+            f'{storage_name:<10}{url_number:>10}'
+            f'{peak_rss / 1024:>14.1f}'
+            f'{(peak_rss - baseline_rss) / 1024:>12.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare gzip log readers.
+
+The script packs the sample log repeated many times and consumes it with
+the reader based on gzip.open and with the pipelined reader.
+
+Usage:
+    $ python3 benchmarks/gzip_pipeline.py [--repeat N] [<log_path>]
+"""
+
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPT_DIR)
+
+from gzip_pipeline import find_external_gzip  # noqa: E402
+from gzip_pipeline import gzip_pipeline_reader_generator  # noqa: E402
+from log_processing import log_reader_generator  # noqa: E402
+
+DEFAULT_LOG_PATH = os.path.join(
+    SCRIPT_DIR,
+    'tests',
+    'test_data',
+    'nginx-access-ui.log-20190930.gz'
+)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument(
+        'log_path',
+        nargs='?',
+        default=DEFAULT_LOG_PATH
+    )
+    argument_parser.add_argument('--repeat', type=int, default=2000)
+    arguments = argument_parser.parse_args()
+
+    readers = {
+        'gzip.open regex': lambda path: log_reader_generator(
+            path, '.gz', 'regex'
+        ),
+        'gzip.open fast': lambda path: log_reader_generator(
+            path, '.gz', 'fast'
+        ),
+        'pipeline zlib': gzip_pipeline_reader_generator,
+    }
+    if find_external_gzip():
+        readers['pipeline external'] = lambda path: (
+            gzip_pipeline_reader_generator(path, use_external_gzip=True)
+        )
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        log_path = os.path.join(temp_dir, 'nginx-access-ui.log-20000101.gz')
+        with gzip.open(arguments.log_path, 'rb') as sample_file:
+            sample = sample_file.read()
+        # Throughput is measured in decompressed bytes which readers
+        # actually consume.
+        unpacked_size = 0
+        with gzip.open(log_path, 'wb') as log_file:
+            for _ in range(arguments.repeat):
+                unpacked_size += log_file.write(sample)
+        unpacked_size_mb = unpacked_size / 1024 / 1024
+        print(
+            f'Packed size: {os.path.getsize(log_path) / 1024 / 1024:.1f} MB, '
+            f'unpacked size: {unpacked_size_mb:.1f} MB'
+        )
+
+        print(f'{"reader":<20}{"seconds":>10}{"lines/sec":>12}{"MB/sec":>10}')
+        for reader_name, reader in readers.items():
+            started_at = time.perf_counter()
+            line_number = sum(1 for _ in reader(log_path))
+            duration = time.perf_counter() - started_at
+            print(
+                f'{reader_name:<20}{duration:>10.2f}'
+                f'{line_number / duration:>12.0f}'
+                f'{unpacked_size_mb / duration:>10.1f}'
+            )
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
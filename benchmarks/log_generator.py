@@ -0,0 +1,126 @@
+"""
+Generate a deterministic synthetic nginx log of the ui_short format.
+
+Usage:
+    $ python3 benchmarks/log_generator.py <log_path> [--size-mb N]
+        [--url-number N] [--latency exponential|lognormal|pareto]
+        [--malformed-ratio R] [--seed N]
+
+A log is packed by gzip if its path ends with .gz.
+"""
+
+import argparse
+import gzip
+import random
+from typing import Callable
+
+LINE_TEMPLATE = (
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] '
+    '"GET {url} HTTP/1.1" 200 927 "-" '
+    '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+    '"1498697422-2190034393-4708-9752759" "dc7161be3" {request_time:.3f}\n'
+)
+MALFORMED_LINES = (
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "-" 400 0 "-" "-" "-"'
+    ' "-" "-" -\n',
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "GET /api/v2/banner\n',
+    '\x16\x03\x01\x02\x00\x01\x00\x01\xfc\x03\x03\n',
+)
+LATENCY_DISTRIBUTIONS = ('exponential', 'lognormal', 'pareto')
+BLOCK_LINE_NUMBER = 10000
+
+
+def get_latency_generator(
+        random_generator: random.Random,
+        distribution: str
+) -> Callable[[], float]:
+    """
+    Return a function generating request times in seconds.
+
+    :param random_generator: a seeded random generator;
+    :param distribution: 'exponential', 'lognormal' or 'pareto';
+    :return: a function without arguments.
+    """
+    if distribution == 'exponential':
+        return lambda: random_generator.expovariate(5)
+    if distribution == 'lognormal':
+        return lambda: random_generator.lognormvariate(-2.5, 1)
+    if distribution == 'pareto':
+        return lambda: 0.01 * random_generator.paretovariate(1.5)
+    raise ValueError(f'Unsupported latency distribution {distribution}')
+
+
+def generate_log(
+        log_path: str,
+        size_mb: float,
+        url_number: int = 100000,
+        seed: int = 0,
+        latency_distribution: str = 'exponential',
+        malformed_ratio: float = 0.0
+) -> int:
+    """
+    Write a synthetic log and return its line number.
+
+    The same arguments always produce the same log.
+
+    :param log_path: a path of the log to write. A *.gz log is packed;
+    :param size_mb: an approximate uncompressed log size in megabytes;
+    :param url_number: a number of unique URLs;
+    :param seed: a random generator seed;
+    :param latency_distribution: a distribution of request times;
+    :param malformed_ratio: a share of lines which can not be parsed;
+    :return: a number of written lines.
+    """
+    random_generator = random.Random(seed)
+    get_latency = get_latency_generator(random_generator, latency_distribution)
+    size_limit = int(size_mb * 1024 * 1024)
+    written_size, line_number = 0, 0
+    if log_path.endswith('.gz'):
+        log_file = gzip.open(log_path, 'wt', compresslevel=6)
+    else:
+        log_file = open(log_path, 'w')
+    with log_file:
+        while written_size < size_limit:
+            lines = []
+            for _ in range(BLOCK_LINE_NUMBER):
+                if random_generator.random() < malformed_ratio:
+                    lines.append(random_generator.choice(MALFORMED_LINES))
+                    continue
+                url_id = random_generator.randrange(url_number)
+                lines.append(LINE_TEMPLATE.format(
+                    url=f'/api/v2/banner/{url_id}',
+                    request_time=get_latency(),
+                ))
+            block = ''.join(lines)
+            log_file.write(block)
+            written_size += len(block)
+            line_number += len(lines)
+    return line_number
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('log_path')
+    argument_parser.add_argument('--size-mb', type=float, default=100)
+    argument_parser.add_argument('--url-number', type=int, default=100000)
+    argument_parser.add_argument(
+        '--latency',
+        choices=LATENCY_DISTRIBUTIONS,
+        default='exponential'
+    )
+    argument_parser.add_argument('--malformed-ratio', type=float, default=0)
+    argument_parser.add_argument('--seed', type=int, default=0)
+    arguments = argument_parser.parse_args()
+    line_number = generate_log(
+        arguments.log_path,
+        arguments.size_mb,
+        arguments.url_number,
+        arguments.seed,
+        arguments.latency,
+        arguments.malformed_ratio
+    )
+    print(f'Written {line_number} lines to {arguments.log_path}')
+
+
+if __name__ == '__main__':
+    main()
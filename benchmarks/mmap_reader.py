@@ -0,0 +1,90 @@
+"""
+Compare the streaming and the memory-mapped readers of a plain log.
+
+Each reader consumes a synthetic log in a separate process, so peak RSS
+values do not affect each other. The synthetic log is removed at the end.
+
+Usage:
+    $ python3 benchmarks/mmap_reader.py [--size-mb N]
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from log_generator import generate_log  # noqa: E402
+from log_processing import log_reader_generator  # noqa: E402
+from log_processing import mmap_log_reader_generator  # noqa: E402
+
+READERS = ('stream', 'mmap')
+
+
+def measure(reader_name: str, log_path: str):
+    """Consume a log and print a line number, duration and peak RSS."""
+    if reader_name == 'mmap':
+        log_reader = mmap_log_reader_generator(log_path)
+    else:
+        log_reader = log_reader_generator(log_path, '', 'fast')
+
+    started_at = time.perf_counter()
+    line_number = sum(1 for _ in log_reader)
+    duration = time.perf_counter() - started_at
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(line_number, duration, peak_rss)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--size-mb', type=float, default=2048)
+    argument_parser.add_argument('--reader', choices=READERS)
+    argument_parser.add_argument('--log-path')
+    arguments = argument_parser.parse_args()
+    if arguments.reader:
+        measure(arguments.reader, arguments.log_path)
+        return
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        log_path = os.path.join(temp_dir, 'nginx-access-ui.log-20000101')
+        generate_log(log_path, arguments.size_mb)
+        log_size_mb = os.path.getsize(log_path) / 1024 / 1024
+        print(f'Log size: {log_size_mb:.1f} MB')
+        print(
+            f'{"reader":<8}{"lines/sec":>12}{"MB/sec":>10}'
+            f'{"peak RSS, MB":>14}'
+        )
+        for reader_name in READERS:
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    '--reader', reader_name,
+                    '--log-path', log_path,
+                ],
+                stdout=subprocess.PIPE,
+                check=True,
+                universal_newlines=True,
+            ).stdout
+            line_number, duration, peak_rss = output.split()
+            duration = float(duration)
+            print(
+                f'{reader_name:<8}{int(line_number) / duration:>12.0f}'
+                f'{log_size_mb / duration:>10.1f}'
+                f'{int(peak_rss) / 1024:>14.1f}'
+            )
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
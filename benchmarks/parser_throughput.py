@@ -0,0 +1,71 @@
+"""
+Measure log parsing throughput of the regex and the fast byte parsers.
+
+The script writes a temporary log repeating lines of a sample log and
+consumes log_reader_generator with each parser.
+
+Usage:
+    $ python3 benchmarks/parser_throughput.py [--repeat N] [<log_path>]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPT_DIR)
+
+from log_processing import LOG_PARSERS, log_reader_generator  # noqa: E402
+
+DEFAULT_LOG_PATH = os.path.join(
+    SCRIPT_DIR,
+    'tests',
+    'test_data',
+    'nginx-access-ui.log-20190930'
+)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument(
+        'log_path',
+        nargs='?',
+        default=DEFAULT_LOG_PATH
+    )
+    argument_parser.add_argument('--repeat', type=int, default=200)
+    arguments = argument_parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        log_path = os.path.join(temp_dir, 'nginx-access-ui.log-20000101')
+        with open(arguments.log_path, 'rb') as sample_file:
+            sample = sample_file.read()
+        with open(log_path, 'wb') as log_file:
+            for _ in range(arguments.repeat):
+                log_file.write(sample)
+        log_size = os.path.getsize(log_path)
+
+        print(f'{"parser":<10}{"lines":>10}{"seconds":>10}{"lines/sec":>12}')
+        for parser_name in LOG_PARSERS:
+            started_at = time.perf_counter()
+            line_number = 0
+            for line_number, _ in enumerate(
+                    log_reader_generator(log_path, '', parser_name),
+                    start=1
+            ):
+                pass
+            duration = time.perf_counter() - started_at
+            print(
+                f'{parser_name:<10}{line_number:>10}{duration:>10.2f}'
+                f'{line_number / duration:>12.0f}'
+            )
+        print(f'Log size: {log_size / 1024 / 1024:.1f} MB')
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+Measure every stage of a log processing on a synthetic log.
+
+Stages are log reading, aggregation, get_statistics, top URL sorting and
+report rendering. Each stage runs in a separate process, so peak RSS values
+do not affect each other. Results are saved as JSON and can be compared
+with results of a previous run: a stage which became slower than
+the tolerance allows is reported as a regression and the script exits
+with the code 1.
+
+Usage:
+    $ python3 benchmarks/pipeline_stages.py [--size-mb N] [--url-number N]
+        [--latency exponential|lognormal|pareto] [--malformed-ratio R]
+        [--gzip] [--parser fast|regex] [--report-size N]
+        [--output results.json] [--baseline baseline.json] [--tolerance T]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Mapping
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.append(BENCHMARK_DIR)
+
+from calculations import get_log_aggregates, get_report_list  # noqa: E402
+from calculations import get_statistics  # noqa: E402
+from constants import DEFAULT_SORT_KEY, PARSE_ERROR_THRESHOLD  # noqa: E402
+from log_analyzer import render_report  # noqa: E402
+from log_generator import LATENCY_DISTRIBUTIONS, generate_log  # noqa: E402
+from log_processing import LOG_PARSERS, log_reader_generator  # noqa: E402
+
+STAGES = ('read', 'aggregate', 'statistics', 'sort', 'render')
+
+
+def run_stage(
+        stage_name: str,
+        log_path: str,
+        parser_name: str,
+        report_size: int
+) -> float:
+    """
+    Run a stage and return its duration in seconds.
+
+    Stages sort and render need results of previous stages. They are
+    prepared before the time measurement.
+
+    :param stage_name: a name of the stage;
+    :param log_path: a path of the synthetic log;
+    :param parser_name: a name of log line parser;
+    :param report_size: a number of report rows;
+    :return: a stage duration.
+    """
+    _, file_extension = os.path.splitext(log_path)
+    if stage_name == 'read':
+        started_at = time.perf_counter()
+        for _ in log_reader_generator(log_path, file_extension, parser_name):
+            pass
+    elif stage_name == 'aggregate':
+        started_at = time.perf_counter()
+        get_log_aggregates(log_path, file_extension, parser_name=parser_name)
+    elif stage_name == 'statistics':
+        started_at = time.perf_counter()
+        get_statistics(
+            log_path,
+            file_extension,
+            PARSE_ERROR_THRESHOLD,
+            report_size=report_size,
+            parser_name=parser_name
+        )
+    elif stage_name == 'sort':
+        aggregates = get_log_aggregates(
+            log_path,
+            file_extension,
+            parser_name=parser_name
+        )
+        started_at = time.perf_counter()
+        get_report_list(aggregates, report_size, DEFAULT_SORT_KEY)
+    elif stage_name == 'render':
+        aggregates = get_log_aggregates(
+            log_path,
+            file_extension,
+            parser_name=parser_name
+        )
+        statistics = get_report_list(aggregates, report_size)
+        report_dir = tempfile.mkdtemp()
+        started_at = time.perf_counter()
+        render_report(statistics, report_dir, None, report_size, 'report.html')
+        duration = time.perf_counter() - started_at
+        shutil.rmtree(report_dir)
+        return duration
+    else:
+        raise ValueError(f'Unsupported stage {stage_name}')
+    return time.perf_counter() - started_at
+
+
+def measure_stage(
+        stage_name: str,
+        log_path: str,
+        line_number: int,
+        arguments: argparse.Namespace
+) -> Mapping[str, float]:
+    """
+    Run a stage in a separate process and return its metrics.
+
+    :param stage_name: a name of the stage;
+    :param log_path: a path of the synthetic log;
+    :param line_number: a number of log lines;
+    :param arguments: the benchmark arguments;
+    :return: a dict of stage metrics.
+    """
+    output = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            '--stage', stage_name,
+            '--log-path', log_path,
+            '--parser', arguments.parser,
+            '--report-size', str(arguments.report_size),
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+    duration, peak_rss = output.split()
+    duration = float(duration)
+    log_size_mb = os.path.getsize(log_path) / 1024 / 1024
+    return {
+        'seconds': duration,
+        'lines_per_sec': line_number / duration,
+        'mb_per_sec': log_size_mb / duration,
+        'peak_rss_mb': int(peak_rss) / 1024,
+    }
+
+
+def find_regressions(
+        results: Mapping[str, Any],
+        baseline: Mapping[str, Any],
+        tolerance: float
+) -> Mapping[str, float]:
+    """
+    Return stages which became slower than a baseline.
+
+    :param results: results of this run;
+    :param baseline: results of a previous run;
+    :param tolerance: an allowed relative slowdown;
+    :return: a dict {stage_name: slowdown, ...}.
+    """
+    regressions = {}
+    for stage_name, metrics in results['stages'].items():
+        baseline_metrics = baseline['stages'].get(stage_name)
+        if baseline_metrics is None:
+            continue
+        slowdown = metrics['seconds'] / baseline_metrics['seconds'] - 1
+        if slowdown > tolerance:
+            regressions[stage_name] = slowdown
+    return regressions
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--size-mb', type=float, default=100)
+    argument_parser.add_argument('--url-number', type=int, default=100000)
+    argument_parser.add_argument(
+        '--latency',
+        choices=LATENCY_DISTRIBUTIONS,
+        default='exponential'
+    )
+    argument_parser.add_argument('--malformed-ratio', type=float, default=0.01)
+    argument_parser.add_argument('--gzip', action='store_true')
+    argument_parser.add_argument(
+        '--parser',
+        choices=LOG_PARSERS,
+        default='fast'
+    )
+    argument_parser.add_argument('--report-size', type=int, default=1000)
+    argument_parser.add_argument('--output', default='benchmark_results.json')
+    argument_parser.add_argument('--baseline')
+    argument_parser.add_argument('--tolerance', type=float, default=0.1)
+    argument_parser.add_argument('--stage', choices=STAGES)
+    argument_parser.add_argument('--log-path')
+    arguments = argument_parser.parse_args()
+    if arguments.stage:
+        logging.disable(logging.CRITICAL)
+        duration = run_stage(
+            arguments.stage,
+            arguments.log_path,
+            arguments.parser,
+            arguments.report_size
+        )
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(duration, peak_rss)
+        return
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        log_name = 'nginx-access-ui.log-20000101'
+        if arguments.gzip:
+            log_name += '.gz'
+        log_path = os.path.join(temp_dir, log_name)
+        line_number = generate_log(
+            log_path,
+            arguments.size_mb,
+            arguments.url_number,
+            latency_distribution=arguments.latency,
+            malformed_ratio=arguments.malformed_ratio
+        )
+        results = {
+            'parameters': {
+                'size_mb': arguments.size_mb,
+                'url_number': arguments.url_number,
+                'latency': arguments.latency,
+                'malformed_ratio': arguments.malformed_ratio,
+                'gzip': arguments.gzip,
+                'parser': arguments.parser,
+                'report_size': arguments.report_size,
+                'line_number': line_number,
+                'python': platform.python_version(),
+            },
+            'stages': {},
+        }
+        print(f'Log lines: {line_number}')
+        print(
+            f'{"stage":<12}{"seconds":>10}{"lines/sec":>12}{"MB/sec":>10}'
+            f'{"peak RSS, MB":>14}'
+        )
+        for stage_name in STAGES:
+            metrics = measure_stage(
+                stage_name,
+                log_path,
+                line_number,
+                arguments
+            )
+            results['stages'][stage_name] = metrics
+            print(
+                f'{stage_name:<12}{metrics["seconds"]:>10.3f}'
+                f'{metrics["lines_per_sec"]:>12.0f}'
+                f'{metrics["mb_per_sec"]:>10.1f}'
+                f'{metrics["peak_rss_mb"]:>14.1f}'
+            )
+    finally:
+        shutil.rmtree(temp_dir)
+
+    with open(arguments.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f'Results are saved to {arguments.output}')
+
+    if arguments.baseline:
+        with open(arguments.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['parameters'] != results['parameters']:
+            print('Warning: the baseline was measured with other parameters')
+        regressions = find_regressions(results, baseline, arguments.tolerance)
+        for stage_name, slowdown in regressions.items():
+            print(f'Regression: {stage_name} is {slowdown:.0%} slower')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Compare request time quantile estimations with exact values.
+
+The script parses a log and compares the log-scale histogram used in the
+report with the legacy streaming median estimation which was used before.
+
+Usage:
+    $ python3 benchmarks/quantile_accuracy.py [<log_path>]
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+from typing import List
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPT_DIR)
+
+from constants import REPORT_QUANTILES  # noqa: E402
+from log_processing import log_reader_generator  # noqa: E402
+from quantiles import QuantileHistogram  # noqa: E402
+
+DEFAULT_LOG_PATH = os.path.join(
+    SCRIPT_DIR,
+    'tests',
+    'test_data',
+    'nginx-access-ui.log-20190930'
+)
+
+
+def get_legacy_median(sample, median, sample_sum, sample_number):
+    """Return a median estimation updated as calculations did before."""
+    delta = sample_sum / sample_number / sample_number
+    return median + delta if median <= sample else median - delta
+
+
+def get_exact_quantile(sorted_values: List[float], quantile: float) -> float:
+    """Return a quantile with the same rank definition as the histogram."""
+    return sorted_values[int(quantile * (len(sorted_values) - 1))]
+
+
+def get_relative_error(estimation: float, exact_value: float) -> float:
+    """Return a relative error of an estimation."""
+    if not exact_value:
+        return abs(estimation)
+    return abs(estimation - exact_value) / exact_value
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument(
+        'log_path',
+        nargs='?',
+        default=DEFAULT_LOG_PATH
+    )
+    log_path = argument_parser.parse_args().log_path
+    _, file_extension = os.path.splitext(log_path)
+
+    values_per_url = {}
+    for url, request_time in log_reader_generator(log_path, file_extension):
+        if url is not None:
+            values_per_url.setdefault(url, []).append(request_time)
+
+    tracemalloc.start()
+    legacy_medians = {}
+    for url, values in values_per_url.items():
+        median, sample_sum = values[0], values[0]
+        for sample_number, value in enumerate(values[1:], start=2):
+            sample_sum += value
+            median = get_legacy_median(
+                value,
+                median,
+                sample_sum,
+                sample_number
+            )
+        legacy_medians[url] = median
+    legacy_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    histograms = {}
+    for url, values in values_per_url.items():
+        histogram = histograms[url] = QuantileHistogram()
+        for value in values:
+            histogram.add(value)
+    histogram_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    legacy_errors = []
+    histogram_errors = {column_name: [] for column_name in REPORT_QUANTILES}
+    for url, values in values_per_url.items():
+        sorted_values = sorted(values)
+        exact_median = get_exact_quantile(sorted_values, 0.5)
+        legacy_errors.append(
+            get_relative_error(legacy_medians[url], exact_median)
+        )
+        for column_name, quantile in REPORT_QUANTILES.items():
+            histogram_errors[column_name].append(get_relative_error(
+                histograms[url].get_quantile(quantile),
+                get_exact_quantile(sorted_values, quantile)
+            ))
+
+    print(f'Log: {log_path}, unique URLs: {len(values_per_url)}')
+    print(f'{"estimator":<22}{"mean error":>12}{"max error":>12}')
+    print(
+        f'{"legacy time_med":<22}'
+        f'{sum(legacy_errors) / len(legacy_errors):>12.2%}'
+        f'{max(legacy_errors):>12.2%}'
+    )
+    for column_name, errors in histogram_errors.items():
+        print(
+            f'{"histogram " + column_name:<22}'
+            f'{sum(errors) / len(errors):>12.2%}'
+            f'{max(errors):>12.2%}'
+        )
+    print(f'Legacy estimator memory: {legacy_memory} bytes')
+    print(f'Histogram memory: {histogram_memory} bytes')
+    bucket_memory = sum(h.get_memory_size() for h in histograms.values())
+    print(f'Histogram bucket counters: {bucket_memory} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Compare building report rows for all URLs and for top URLs only.
+
+Usage:
+    $ python3 benchmarks/report_build.py [--url-number N] [--report-size K]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPT_DIR)
+
+from aggregate_store import AggregateStore  # noqa: E402
+from calculations import get_report_list  # noqa: E402
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--url-number', type=int, default=1000000)
+    argument_parser.add_argument('--report-size', type=int, default=1000)
+    arguments = argument_parser.parse_args()
+
+    random_generator = random.Random(0)
+    aggregates = AggregateStore()
+    for url_id in range(arguments.url_number):
+        url = f'/api/v2/banner/{url_id}'
+        for _ in range(1 if url_id % 10 else 3):
+            aggregates.add(url, round(random_generator.expovariate(5), 3))
+
+    def build_full_report():
+        statistics = get_report_list(aggregates)
+        statistics.sort(key=lambda x: x['time_sum'], reverse=True)
+        return statistics[:arguments.report_size]
+
+    def build_top_report():
+        return get_report_list(aggregates, arguments.report_size, 'time_sum')
+
+    print(
+        f'URLs: {arguments.url_number}, '
+        f'report size: {arguments.report_size}'
+    )
+    print(f'{"method":<14}{"seconds":>10}{"peak memory, MB":>18}')
+    for method_name, build_report in (
+            ('sort all', build_full_report),
+            ('top-K heap', build_top_report),
+    ):
+        tracemalloc.start()
+        started_at = time.perf_counter()
+        build_report()
+        duration = time.perf_counter() - started_at
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f'{method_name:<14}{duration:>10.2f}'
+            f'{peak_memory / 1024 / 1024:>18.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
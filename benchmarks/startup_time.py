@@ -0,0 +1,209 @@
+"""
+Measure the script startup: module imports and a run without new logs.
+
+Import times are taken from `python -X importtime -c "import log_analyzer"`,
+the best of several runs is kept. A run without new logs is the script run
+on a log directory whose newest log already has a report. Results are saved
+as JSON and can be compared with results of a previous run: a metric which
+became slower than the tolerance allows is reported as a regression and
+the script exits with the code 1.
+
+Usage:
+    $ python3 benchmarks/startup_time.py [--repeat N] [--top-size N]
+        [--output results.json] [--baseline baseline.json] [--tolerance T]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Mapping, Tuple
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_PATH = os.path.join(SCRIPT_DIR, 'log_analyzer.py')
+TEST_LOG_PATH = os.path.join(
+    SCRIPT_DIR,
+    'tests',
+    'test_data',
+    'nginx-access-ui.log-20190930'
+)
+REPORT_NAME = 'report-2019.09.30.html'
+MAIN_MODULE = 'log_analyzer'
+
+
+def measure_imports() -> Dict[str, Tuple[int, int]]:
+    """
+    Import the script module in a new interpreter and return import times.
+
+    :return: a dict {module_name: (self_us, cumulative_us), ...}.
+    """
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {MAIN_MODULE}'],
+        cwd=SCRIPT_DIR,
+        stderr=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stderr
+    import_times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, module_name = line[12:].split('|')
+        import_times[module_name.strip()] = (
+            int(self_time),
+            int(cumulative_time),
+        )
+    return import_times
+
+
+def measure_idle_run(config_path: str) -> float:
+    """
+    Run the script which finds no new logs and return its wall time.
+
+    :param config_path: a path of the script configuration;
+    :return: a duration in seconds.
+    """
+    started_at = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, SCRIPT_PATH, '--config', config_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    duration = time.perf_counter() - started_at
+    if 'Do not find an unprocessed log file' not in result.stderr:
+        raise RuntimeError(f'Unexpected script result: {result.stderr}')
+    return duration
+
+
+def get_top_modules(
+        import_times: Mapping[str, Tuple[int, int]],
+        top_size: int
+) -> List[Tuple[str, int]]:
+    """
+    Return modules with the largest self import time.
+
+    :param import_times: import times returned by measure_imports;
+    :param top_size: a number of modules to return;
+    :return: a list [(module_name, self_us), ...].
+    """
+    return sorted(
+        (
+            (module_name, self_time)
+            for module_name, (self_time, _) in import_times.items()
+        ),
+        key=lambda item: item[1],
+        reverse=True
+    )[:top_size]
+
+
+def find_regressions(
+        results: Mapping[str, Any],
+        baseline: Mapping[str, Any],
+        tolerance: float
+) -> Mapping[str, float]:
+    """
+    Return metrics which became slower than a baseline.
+
+    :param results: results of this run;
+    :param baseline: results of a previous run;
+    :param tolerance: an allowed relative slowdown;
+    :return: a dict {metric_name: slowdown, ...}.
+    """
+    regressions = {}
+    for metric_name, value in results['metrics'].items():
+        baseline_value = baseline['metrics'].get(metric_name)
+        if not baseline_value:
+            continue
+        slowdown = value / baseline_value - 1
+        if slowdown > tolerance:
+            regressions[metric_name] = slowdown
+    return regressions
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--repeat', type=int, default=10)
+    argument_parser.add_argument('--top-size', type=int, default=15)
+    argument_parser.add_argument('--output', default='startup_results.json')
+    argument_parser.add_argument('--baseline')
+    argument_parser.add_argument('--tolerance', type=float, default=0.2)
+    arguments = argument_parser.parse_args()
+
+    best_import_times = None
+    for _ in range(arguments.repeat):
+        import_times = measure_imports()
+        best_import_times = min(
+            best_import_times or import_times,
+            import_times,
+            key=lambda times: times[MAIN_MODULE][1]
+        )
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        log_dir = os.path.join(temp_dir, 'log')
+        report_dir = os.path.join(temp_dir, 'reports')
+        os.mkdir(log_dir)
+        os.mkdir(report_dir)
+        shutil.copy2(TEST_LOG_PATH, log_dir)
+        open(os.path.join(report_dir, REPORT_NAME), 'w').close()
+        config_path = os.path.join(temp_dir, 'config.json')
+        with open(config_path, 'w') as config_file:
+            json.dump(
+                {
+                    'LOG_DIR': log_dir,
+                    'REPORT_DIR': report_dir,
+                    'SCRIPT_LOG_PATH': os.path.join(temp_dir, 'script.log'),
+                },
+                config_file
+            )
+        idle_run_seconds = min(
+            measure_idle_run(config_path) for _ in range(arguments.repeat)
+        )
+    finally:
+        shutil.rmtree(temp_dir)
+
+    top_modules = get_top_modules(best_import_times, arguments.top_size)
+    results = {
+        'parameters': {
+            'repeat': arguments.repeat,
+            'python': platform.python_version(),
+        },
+        'metrics': {
+            'import_seconds': best_import_times[MAIN_MODULE][1] / 1e6,
+            'idle_run_seconds': idle_run_seconds,
+        },
+        'module_count': len(best_import_times),
+        'top_modules_self_us': dict(top_modules),
+    }
+    print(f'Import of {MAIN_MODULE}: '
+          f'{results["metrics"]["import_seconds"] * 1000:.1f} ms, '
+          f'{len(best_import_times)} modules')
+    print(f'Run without new logs: {idle_run_seconds * 1000:.1f} ms')
+    print(f'{"module":<40}{"self, ms":>10}')
+    for module_name, self_time in top_modules:
+        print(f'{module_name:<40}{self_time / 1000:>10.2f}')
+
+    with open(arguments.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f'Results are saved to {arguments.output}')
+
+    if arguments.baseline:
+        with open(arguments.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['parameters'] != results['parameters']:
+            print('Warning: the baseline was measured with other parameters')
+        regressions = find_regressions(results, baseline, arguments.tolerance)
+        for metric_name, slowdown in regressions.items():
+            print(f'Regression: {metric_name} is {slowdown:.0%} slower')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,114 +1,1228 @@
 """Functions to calculate statistics."""
 
+import heapq
+from itertools import repeat
 import logging
-from typing import List, Mapping, Union
+import os
+from typing import Generator, Iterable, Iterator, List, Mapping, Sequence
+from typing import Tuple, Union
 
-from log_processing import log_reader_generator
+from aggregate_store import AggregateStore
+from batch_aggregation import get_request_block
+from checkpoints import get_complete_lines_end, load_checkpoint
+from checkpoints import save_checkpoint
+from constants import DEFAULT_CHUNK_SIZE, MICROSECONDS_PER_SECOND
+from constants import DEFAULT_LOG_PARSER, DEFAULT_SORT_KEY
+from constants import DEFAULT_SOURCE_CONCURRENCY, DEFAULT_SOURCE_QUEUE_SIZE
+from constants import PARSE_ERROR_MIN_LINE_NUMBER
+from constants import PREFLIGHT_HEAD_LINE_NUMBER, PREFLIGHT_SEEK_NUMBER
+from constants import REPORT_QUANTILES, STATUS_CLASSES
+from daily_cache import save_daily_aggregates
+from gzip_pipeline import gzip_pipeline_reader_generator
+from log_formats import get_span_parser
+from log_processing import get_chunk_offsets, log_chunk_reader_generator
+from log_processing import BINARY_LOG_PARSERS, log_reader_generator
+from log_processing import get_line_parser, mmap_log_reader_generator
+from log_processing import parse_log_span
+from log_processing import reset_parse_error_log, sample_log_lines
+from metrics import add_counter, measure_stage, set_gauge
+from report_writer import write_report_file
+from sampling import NoteSampler, SampleOptions, SampleSummary
+from sampling import add_count_errors, get_block_error, get_cluster_error
+from sampling import get_request_error, scale_aggregates
+from sampling import select_sample_blocks
+from url_normalization import UrlRules, get_url_rules_digest
+from url_normalization import normalize_log_notes
 
 
-def get_updated_median(
-        sample: float,
-        median: float,
-        sample_sum: float,
-        sample_number: int
-) -> Union[float, None]:
+class TooManyParseErrors(Exception):
+    """A share of invalid log lines exceeds the threshold."""
+
+
+def aggregate_log_notes(
+        log_reader: Iterable[Tuple],
+        url_rules: Union[UrlRules, None] = None,
+        max_url_number: Union[int, None] = None,
+        parse_error_threshold: Union[float, None] = None,
+        dimensions: bool = False,
+        aggregates: Union[AggregateStore, None] = None,
+        use_numpy: bool = False
+) -> AggregateStore:
     """
-    Update and return median value.
+    Consume parsed log notes and return partial per-URL aggregates.
 
-    Use algorithm suggested here: https://habr.com/ru/post/228575/
+    The error ratio is checked on every invalid line after
+    PARSE_ERROR_MIN_LINE_NUMBER lines, so a log of a wrong format is not
+    read up to the end.
 
-    :param sample: a sample;
-    :param median: a current median estimation;
-    :param sample_sum: current sum of all samples;
-    :param sample_number: current sample number;
-    :return: new median estimation
+    :param log_reader: an iterable yielding url and request time. If
+    dimensions are aggregated, notes also contain a status, body bytes and
+    a minute of day;
+    :param url_rules: rules to normalize URLs before aggregation. None if
+    URLs should be aggregated as is;
+    :param max_url_number: a maximum number of distinct URLs. Requests to
+    other URLs are aggregated into one bucket. None if it is not limited;
+    :param parse_error_threshold: a maximum share of invalid lines. None if
+    reading should not be aborted;
+    :param dimensions: True if status classes, body bytes and request time
+    series should be aggregated;
+    :param aggregates: a store to add the notes to. Its line and error
+    numbers are counted in the error ratio. None if a new store should be
+    created, then the number of errors is logged at the end;
+    :param use_numpy: True if requests should be added to the store by
+    blocks reduced by NumPy. Requests are added one by one if NumPy is not
+    installed;
+    :return: a store of aggregates which can be merged with other stores.
     """
-    logging.debug(f'Begin to update a median estimation {median}.')
-    if sample_number == 0:
-        logging.error('Sample number is 0.')
-        return None
-    delta = sample_sum / sample_number / sample_number
-    if median <= sample:
-        updated_median = median + delta
-    else:
-        updated_median = median - delta
-    return updated_median
+    if url_rules is not None:
+        log_reader = normalize_log_notes(log_reader, url_rules)
+    new_store = aggregates is None
+    if new_store:
+        reset_parse_error_log()
+        aggregates = AggregateStore(max_url_number, dimensions)
+    request_block = get_request_block(aggregates) if use_numpy else None
+    request_adder = aggregates if request_block is None else request_block
+    add_request = (
+        request_adder.add_request if aggregates.dimensions
+        else request_adder.add
+    )
+    error_number = aggregates.error_number
+    log_note_number = aggregates.line_number - 1
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+    for log_note_number, log_note in enumerate(
+            log_reader,
+            start=aggregates.line_number
+    ):
+        if debug_enabled:
+            logging.debug('Begin to process the row %s', log_note_number)
+        if log_note[0] is None or log_note[1] is None:
+            error_number += 1
+            line_number = log_note_number + 1
+            abort_reading = (
+                parse_error_threshold is not None
+                and line_number >= PARSE_ERROR_MIN_LINE_NUMBER
+                and error_number / line_number > parse_error_threshold
+            )
+            if abort_reading:
+                raise TooManyParseErrors(
+                    f'{error_number} of the first {line_number} lines '
+                    f'are invalid'
+                )
+            continue
+
+        add_request(*log_note)
+
+    if request_block is not None:
+        request_block.flush()
+    aggregates.line_number = log_note_number + 1
+    aggregates.error_number = error_number
+    if error_number and new_store:
+        logging.error(
+            'Parsing errors in %s of %s lines.',
+            error_number,
+            aggregates.line_number
+        )
+    return aggregates
+
+
+def get_sample_error_ratio(
+        log_path: str,
+        file_extension: str,
+        parser_name: str = DEFAULT_LOG_PARSER,
+        log_format: Union[str, None] = None
+) -> float:
+    """
+    Estimate a share of invalid lines by first lines and random lines.
+
+    :param log_path: a path of log file;
+    :param file_extension: an extension of log file;
+    :param parser_name: a name of log line parser;
+    :param log_format: an nginx log_format string or a name in LOG_FORMATS.
+    If it is set, parser_name is ignored;
+    :return: a share of invalid lines in the sample.
+    """
+    parse_line, binary_parser = get_line_parser(
+        parser_name,
+        get_span_parser(log_format)
+    )
+    line_number, error_number = 0, 0
+    for line in sample_log_lines(
+            log_path,
+            file_extension,
+            PREFLIGHT_HEAD_LINE_NUMBER,
+            PREFLIGHT_SEEK_NUMBER
+    ):
+        if not binary_parser:
+            line = line.decode('utf_8', errors='ignore')
+        line_number += 1
+        if parse_line(line)[0] is None:
+            error_number += 1
+
+    return error_number / line_number if line_number else 0.0
+
+
+def add_aggregate_counters(aggregates: AggregateStore, byte_number: int):
+    """
+    Add processed lines, bytes and errors to metrics.
+
+    :param aggregates: aggregates of a processed log part;
+    :param byte_number: a number of processed log bytes.
+    """
+    add_counter('lines_total', aggregates.line_number)
+    add_counter('bytes_total', byte_number)
+    add_counter('parse_errors_total', aggregates.error_number)
+    add_counter('requests_total', aggregates.total_request_number)
+
+
+def get_chunk_aggregates(
+        log_path: str,
+        chunk_start: int,
+        chunk_end: int,
+        parser_name: str,
+        use_mmap: bool,
+        url_rules: Union[UrlRules, None] = None,
+        max_url_number: Union[int, None] = None,
+        parse_error_threshold: Union[float, None] = None,
+        log_format: Union[str, None] = None,
+        dimensions: bool = False,
+        use_numpy: bool = False
+) -> AggregateStore:
+    """
+    Return partial aggregates of a log byte range.
+
+    It runs in a worker process.
+
+    :param log_path: a path of uncompressed log file;
+    :param chunk_start: an offset of the first chunk byte;
+    :param chunk_end: an offset after the last chunk byte;
+    :param parser_name: a name of log line parser;
+    :param use_mmap: True if the chunk should be read from a memory-mapped
+    file by the fast parser;
+    :param url_rules: rules to normalize URLs. None if URLs are kept as is;
+    :param max_url_number: a maximum number of distinct URLs;
+    :param parse_error_threshold: a maximum share of invalid lines. None if
+    reading should not be aborted;
+    :param log_format: an nginx log_format string or a name in LOG_FORMATS.
+    If it is set, parser_name is ignored;
+    :param dimensions: True if status classes, body bytes and request time
+    series should be aggregated. A log is parsed by a parser compiled from
+    log_format or DEFAULT_LOG_FORMAT then;
+    :param use_numpy: True if requests should be aggregated by blocks
+    reduced by NumPy;
+    :return: a store of aggregates.
+    """
+    chunk_reader = open_chunk_reader(
+        log_path,
+        chunk_start,
+        chunk_end,
+        parser_name,
+        use_mmap,
+        log_format,
+        dimensions
+    )
+    return aggregate_log_notes(
+        chunk_reader,
+        url_rules,
+        max_url_number,
+        parse_error_threshold,
+        dimensions,
+        use_numpy=use_numpy
+    )
+
+
+def open_chunk_reader(
+        log_path: str,
+        chunk_start: int,
+        chunk_end: int,
+        parser_name: str,
+        use_mmap: bool,
+        log_format: Union[str, None] = None,
+        dimensions: bool = False
+) -> Iterator[Tuple]:
+    """
+    Return a reader of log notes of a byte range of an uncompressed log.
+
+    :param log_path: a path of uncompressed log file;
+    :param chunk_start: an offset of the first chunk byte;
+    :param chunk_end: an offset after the last chunk byte;
+    :param parser_name: a name of log line parser;
+    :param use_mmap: True if the chunk should be read from a memory-mapped
+    file by the fast parser;
+    :param log_format: an nginx log_format string or a name in LOG_FORMATS.
+    If it is set, parser_name is ignored;
+    :param dimensions: True if notes should contain a status, body bytes
+    and a minute of day;
+    :return: an iterator of log notes.
+    """
+    parse_span = get_span_parser(log_format, dimensions)
+    if use_mmap:
+        return mmap_log_reader_generator(
+            log_path,
+            chunk_start,
+            chunk_end,
+            parse_span or parse_log_span
+        )
+    return log_chunk_reader_generator(
+        log_path,
+        chunk_start,
+        chunk_end,
+        parser_name,
+        parse_span
+    )
+
+
+def get_parallel_aggregates(
+        log_path: str,
+        worker_number: int,
+        chunk_size: int,
+        parser_name: str,
+        use_mmap: bool,
+        url_rules: Union[UrlRules, None] = None,
+        max_url_number: Union[int, None] = None,
+        parse_error_threshold: Union[float, None] = None,
+        log_format: Union[str, None] = None,
+        dimensions: bool = False,
+        use_numpy: bool = False
+) -> AggregateStore:
+    """
+    Split an uncompressed log into chunks and aggregate them in processes.
+
+    :param log_path: a path of uncompressed log file;
+    :param worker_number: a number of worker processes;
+    :param chunk_size: an approximate chunk size in bytes;
+    :param parser_name: a name of log line parser;
+    :param use_mmap: True if chunks should be read from a memory-mapped file;
+    :param url_rules: rules to normalize URLs. None if URLs are kept as is;
+    :param max_url_number: a maximum number of distinct URLs;
+    :param parse_error_threshold: a maximum share of invalid lines in
+    a chunk. Chunks which are not started yet are cancelled if it is
+    exceeded;
+    :param log_format: an nginx log_format string or a name in LOG_FORMATS.
+    If it is set, parser_name is ignored;
+    :param dimensions: True if status classes, body bytes and request time
+    series should be aggregated. A log is parsed by a parser compiled from
+    log_format or DEFAULT_LOG_FORMAT then;
+    :param use_numpy: True if requests should be aggregated by blocks
+    reduced by NumPy;
+    :return: a store of merged aggregates.
+    """
+    # Process pools are imported on use: most runs parse in one process.
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunk_offsets = get_chunk_offsets(log_path, chunk_size)
+    logging.info(
+        f'Process {len(chunk_offsets)} chunks of {log_path} '
+        f'in {worker_number} processes.'
+    )
+    aggregates = AggregateStore(max_url_number, dimensions)
+    with ProcessPoolExecutor(max_workers=worker_number) as executor:
+        chunk_aggregates = executor.map(
+            get_chunk_aggregates,
+            repeat(log_path),
+            [chunk_start for chunk_start, _ in chunk_offsets],
+            [chunk_end for _, chunk_end in chunk_offsets],
+            repeat(parser_name),
+            repeat(use_mmap),
+            repeat(url_rules),
+            repeat(max_url_number),
+            repeat(parse_error_threshold),
+            repeat(log_format),
+            repeat(dimensions),
+            repeat(use_numpy),
+        )
+        for partial_aggregates in chunk_aggregates:
+            aggregates.merge(partial_aggregates)
+
+    return aggregates
+
+
+def get_log_aggregates(
+        log_path: str,
+        file_extension: str,
+        worker_number: int = 1,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        parser_name: str = DEFAULT_LOG_PARSER,
+        use_mmap: bool = False,
+        use_gzip_pipeline: bool = True,
+        use_external_gzip: bool = False,
+        url_rules: Union[UrlRules, None] = None,
+        max_url_number: Union[int, None] = None,
+        parse_error_threshold: Union[float, None] = None,
+        log_format: Union[str, None] = None,
+        dimensions: bool = False,
+        use_numpy: bool = False,
+) -> AggregateStore:
+    """
+    Parse a log file and return per-URL aggregates.
+
+    :param log_path: a path of log file;
+    :param file_extension: an extension of log file;
+    :param worker_number: a number of processes parsing an uncompressed log.
+    A packed log is always parsed in a single process;
+    :param chunk_size: a size of log part parsed by one process in bytes;
+    :param parser_name: a name of log line parser: 'fast' or 'regex';
+    :param use_mmap: True if an uncompressed log should be read from
+    a memory-mapped file. It is supported by the fast parser only;
+    :param use_gzip_pipeline: True if a gzip log should be decompressed in
+    a separate thread. It is supported by the fast parser only;
+    :param use_external_gzip: True if the pipeline should decompress a log
+    by pigz or igzip when one of them is found on PATH;
+    :param url_rules: rules to normalize URLs. None if URLs are kept as is;
+    :param max_url_number: a maximum number of distinct URLs. Requests to
+    other URLs are aggregated into one bucket. None if it is not limited;
+    :param parse_error_threshold: a maximum share of invalid lines.
+    TooManyParseErrors is raised as soon as it is exceeded. None if reading
+    should not be aborted;
+    :param log_format: an nginx log_format string or a name in LOG_FORMATS.
+    If it is set, parser_name is ignored;
+    :param dimensions: True if status classes, body bytes and request time
+    series should be aggregated. A log is parsed by a parser compiled from
+    log_format or DEFAULT_LOG_FORMAT then;
+    :param use_numpy: True if requests should be aggregated by blocks of
+    BLOCK_SIZE requests reduced by NumPy. Requests are added one by one if
+    NumPy is not installed;
+    :return: a store of aggregates.
+    """
+    plain_log = file_extension != '.gz'
+    if worker_number > 1 and plain_log:
+        binary_parser = bool(log_format) or dimensions or (
+            parser_name in BINARY_LOG_PARSERS
+        )
+        return get_parallel_aggregates(
+            log_path,
+            worker_number,
+            chunk_size,
+            parser_name,
+            use_mmap and binary_parser,
+            url_rules,
+            max_url_number,
+            parse_error_threshold,
+            log_format,
+            dimensions,
+            use_numpy
+        )
+
+    log_reader = open_log_reader(
+        log_path,
+        file_extension,
+        parser_name,
+        use_mmap,
+        use_gzip_pipeline,
+        use_external_gzip,
+        log_format,
+        dimensions
+    )
+    return aggregate_log_notes(
+        log_reader,
+        url_rules,
+        max_url_number,
+        parse_error_threshold,
+        dimensions,
+        use_numpy=use_numpy
+    )
+
+
+def open_log_reader(
+        log_path: str,
+        file_extension: str,
+        parser_name: str = DEFAULT_LOG_PARSER,
+        use_mmap: bool = False,
+        use_gzip_pipeline: bool = True,
+        use_external_gzip: bool = False,
+        log_format: Union[str, None] = None,
+        dimensions: bool = False,
+) -> Iterator[Tuple]:
+    """
+    Return a reader of log notes of a whole log in the current process.
+
+    :param log_path: a path of log file;
+    :param file_extension: an extension of log file;
+    :param parser_name: a name of log line parser: 'fast' or 'regex';
+    :param use_mmap: True if an uncompressed log should be read from
+    a memory-mapped file. It is supported by binary parsers only;
+    :param use_gzip_pipeline: True if a gzip log should be decompressed in
+    a separate thread. It is supported by binary parsers only;
+    :param use_external_gzip: True if the pipeline should decompress a log
+    by pigz or igzip when one of them is found on PATH;
+    :param log_format: an nginx log_format string or a name in LOG_FORMATS.
+    If it is set, parser_name is ignored;
+    :param dimensions: True if notes should contain a status, body bytes
+    and a minute of day;
+    :return: an iterator of log notes.
+    """
+    plain_log = file_extension != '.gz'
+    parse_span = get_span_parser(log_format, dimensions)
+    binary_parser = (
+        parse_span is not None or parser_name in BINARY_LOG_PARSERS
+    )
+    if use_mmap and plain_log and binary_parser:
+        return mmap_log_reader_generator(
+            log_path,
+            parse_span=parse_span or parse_log_span
+        )
+    if use_gzip_pipeline and not plain_log and binary_parser:
+        return gzip_pipeline_reader_generator(
+            log_path,
+            use_external_gzip,
+            parse_span or parse_log_span
+        )
+    return log_reader_generator(
+        log_path,
+        file_extension,
+        parser_name,
+        parse_span
+    )
 
 
 def get_statistics(
         log_path: str,
         file_extension: str,
         parse_error_threshold: float,
+        aggregates_cache_path: Union[str, None] = None,
+        report_size: Union[int, None] = None,
+        sort_key: str = DEFAULT_SORT_KEY,
+        use_preflight: bool = False,
+        timeline_path: Union[str, None] = None,
+        **reading_options
 ) -> List[Mapping[str, Union[str, float]]] or None:
     """
-    Parse a log file and return statistics for each URL.
+    Parse a log file and return statistics for URLs sorted by a key.
+
+    Reading stops as soon as the parsing error ratio exceeds the threshold.
 
     :param log_path: a path of log file;
     :param file_extension: an extension of log file;
     :param parse_error_threshold: if parsing error ration exceeded this limit
     scripts returns an error;
+    :param aggregates_cache_path: a path to save final aggregates of the log.
+    None if they should not be saved;
+    :param report_size: a number of top URLs to return. None if statistics
+    for all URLs should be returned;
+    :param sort_key: a report column to sort URLs by in descending order;
+    :param use_preflight: True if the error ratio should be estimated by
+    a sample of lines before the whole log is read;
+    :param timeline_path: a path to save per-minute request time series.
+    It is saved if dimensions are aggregated and the log has not too many
+    parsing errors;
+    :param reading_options: keyword arguments of get_log_aggregates;
     """
-    log_reader = log_reader_generator(log_path, file_extension)
-    statistics_per_url = {}
-    error_number, total_request_number, total_request_time = 0, 0, 0
-    log_note_number = 0
+    if use_preflight:
+        with measure_stage('preflight'):
+            sample_error_ratio = get_sample_error_ratio(
+                log_path,
+                file_extension,
+                reading_options.get('parser_name', DEFAULT_LOG_PARSER),
+                reading_options.get('log_format')
+            )
+        if sample_error_ratio > parse_error_threshold:
+            logging.error(
+                f'Too many parsing errors in a sample of {log_path}. '
+                f'Errors per sample lines ratio is {sample_error_ratio}'
+            )
+            return
 
-    for log_note_number, (url, request_time) in enumerate(log_reader):
-        logging.debug(f'Begin to process the row {log_note_number}')
-        if url is None or request_time is None:
-            logging.error(f'Parsing error in the row {log_note_number}.')
-            error_number += 1
-            continue
+    try:
+        with measure_stage('aggregate'):
+            aggregates = get_log_aggregates(
+                log_path,
+                file_extension,
+                parse_error_threshold=parse_error_threshold,
+                **reading_options
+            )
+    except TooManyParseErrors as error:
+        logging.error(f'Too many parsing errors in {log_path}: {error}')
+        return
+    add_aggregate_counters(aggregates, os.path.getsize(log_path))
+    report_list = get_checked_report_list(
+        aggregates,
+        log_path,
+        parse_error_threshold,
+        report_size,
+        sort_key
+    )
+    if report_list is not None and timeline_path and aggregates.dimensions:
+        with measure_stage('render'):
+            write_report_file(timeline_path, get_timeline(aggregates), 'json')
+    # Aggregates of a log having too many errors are not cached, so
+    # a rollup does not reuse them.
+    if report_list is not None and aggregates_cache_path:
+        with measure_stage('cache_save'):
+            save_daily_aggregates(
+                aggregates_cache_path,
+                log_path,
+                aggregates,
+                get_url_rules_digest(reading_options.get('url_rules'))
+            )
+    return report_list
+
+
+def get_block_sample_aggregates(
+        log_path: str,
+        sample_options: SampleOptions,
+        worker_number: int = 1,
+        parser_name: str = DEFAULT_LOG_PARSER,
+        use_mmap: bool = False,
+        url_rules: Union[UrlRules, None] = None,
+        max_url_number: Union[int, None] = None,
+        parse_error_threshold: Union[float, None] = None,
+        log_format: Union[str, None] = None,
+        dimensions: bool = False,
+        use_numpy: bool = False
+) -> Tuple[AggregateStore, SampleSummary]:
+    """
+    Aggregate random blocks of an uncompressed log and scale the results.
+
+    Blocks are aggregated by get_chunk_aggregates like chunks of a parallel
+    run, other blocks are not read. Totals are estimated by a ratio of
+    sampled totals to sampled bytes, errors by the spread of block totals.
+
+    :param log_path: a path of uncompressed log file;
+    :param sample_options: a share of log bytes and a block size;
+    :param worker_number: a number of processes aggregating blocks;
+    :param parser_name: a name of log line parser;
+    :param use_mmap: True if blocks should be read from a memory-mapped
+    file. It is supported by binary parsers only;
+    :param url_rules: rules to normalize URLs. None if URLs are kept as is;
+    :param max_url_number: a maximum number of distinct URLs;
+    :param parse_error_threshold: a maximum share of invalid lines in
+    a block;
+    :param log_format: an nginx log_format string or a name in LOG_FORMATS.
+    If it is set, parser_name is ignored;
+    :param dimensions: True if status classes, body bytes and request time
+    series should be aggregated;
+    :param use_numpy: True if requests should be aggregated by blocks
+    reduced by NumPy;
+    :return: a store of scaled aggregates and a summary of the sample.
+    """
+    block_offsets = get_chunk_offsets(log_path, sample_options.block_size)
+    sampled_offsets = select_sample_blocks(
+        block_offsets,
+        sample_options.rate
+    )
+    binary_parser = bool(log_format) or dimensions or (
+        parser_name in BINARY_LOG_PARSERS
+    )
+    logging.info(
+        f'Sample {len(sampled_offsets)} of {len(block_offsets)} blocks '
+        f'of {log_path}.'
+    )
+    block_arguments = (
+        repeat(log_path),
+        [block_start for block_start, _ in sampled_offsets],
+        [block_end for _, block_end in sampled_offsets],
+        repeat(parser_name),
+        repeat(use_mmap and binary_parser),
+        repeat(url_rules),
+        repeat(max_url_number),
+        repeat(parse_error_threshold),
+        repeat(log_format),
+        repeat(dimensions),
+        repeat(use_numpy),
+    )
+    aggregates = AggregateStore(max_url_number, dimensions)
+    block_totals = []
+
+    def merge_blocks(block_aggregates):
+        for (block_start, block_end), partial_aggregates in zip(
+                sampled_offsets,
+                block_aggregates
+        ):
+            aggregates.merge(partial_aggregates)
+            block_totals.append((
+                block_end - block_start,
+                partial_aggregates.total_request_number,
+                partial_aggregates.total_request_time,
+            ))
+
+    if worker_number > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=worker_number) as executor:
+            merge_blocks(executor.map(get_chunk_aggregates, *block_arguments))
+    else:
+        merge_blocks(map(get_chunk_aggregates, *block_arguments))
+
+    sampled_size = sum(size for size, _, _ in block_totals)
+    rate = sampled_size / os.path.getsize(log_path) if sampled_size else 1.0
+    scale_aggregates(aggregates, 1 / rate)
+    summary = SampleSummary(
+        'block',
+        rate,
+        1 / rate,
+        get_block_error(
+            len(block_offsets),
+            [(size, count) for size, count, _ in block_totals]
+        ),
+        get_block_error(
+            len(block_offsets),
+            [(size, time_sum) for size, _, time_sum in block_totals]
+        ),
+        sampled_size
+    )
+    return aggregates, summary
+
+
+def get_sample_aggregates(
+        log_path: str,
+        file_extension: str,
+        sample_options: SampleOptions,
+        worker_number: int = 1,
+        parser_name: str = DEFAULT_LOG_PARSER,
+        use_mmap: bool = False,
+        use_gzip_pipeline: bool = True,
+        use_external_gzip: bool = False,
+        url_rules: Union[UrlRules, None] = None,
+        max_url_number: Union[int, None] = None,
+        parse_error_threshold: Union[float, None] = None,
+        log_format: Union[str, None] = None,
+        dimensions: bool = False,
+        use_numpy: bool = False,
+) -> Tuple[AggregateStore, SampleSummary]:
+    """
+    Aggregate a sample of a log and scale the results to the whole log.
+
+    In the modes 'request' and 'url' the whole log is read by
+    open_log_reader and notes are selected by NoteSampler before
+    the aggregation. URLs are normalized before sampling, so all requests
+    of a normalized URL are sampled together. In the mode 'block' only
+    sampled blocks of an uncompressed log are read. A packed log is
+    sampled by requests instead: it can not be read from an offset.
+
+    :param log_path: a path of log file;
+    :param file_extension: an extension of log file;
+    :param sample_options: a sampling rate, a mode and a block size;
+    :param worker_number: a number of processes aggregating blocks;
+    :param parser_name: a name of log line parser: 'fast' or 'regex';
+    :param use_mmap: True if an uncompressed log should be read from
+    a memory-mapped file. It is supported by binary parsers only;
+    :param use_gzip_pipeline: True if a gzip log should be decompressed in
+    a separate thread. It is supported by binary parsers only;
+    :param use_external_gzip: True if the pipeline should decompress a log
+    by pigz or igzip when one of them is found on PATH;
+    :param url_rules: rules to normalize URLs. None if URLs are kept as is;
+    :param max_url_number: a maximum number of distinct URLs;
+    :param parse_error_threshold: a maximum share of invalid lines.
+    TooManyParseErrors is raised as soon as it is exceeded. None if reading
+    should not be aborted;
+    :param log_format: an nginx log_format string or a name in LOG_FORMATS.
+    If it is set, parser_name is ignored;
+    :param dimensions: True if status classes, body bytes and request time
+    series should be aggregated;
+    :param use_numpy: True if requests should be aggregated by blocks
+    reduced by NumPy;
+    :return: a store of scaled aggregates and a summary of the sample.
+    """
+    sample_mode = sample_options.mode
+    if sample_mode == 'block' and file_extension == '.gz':
+        logging.warning(
+            f'Can not sample blocks of the packed log {log_path}, '
+            f'sample requests'
+        )
+        sample_mode = 'request'
+    if sample_mode == 'block':
+        return get_block_sample_aggregates(
+            log_path,
+            sample_options,
+            worker_number,
+            parser_name,
+            use_mmap,
+            url_rules,
+            max_url_number,
+            parse_error_threshold,
+            log_format,
+            dimensions,
+            use_numpy
+        )
+
+    log_reader = open_log_reader(
+        log_path,
+        file_extension,
+        parser_name,
+        use_mmap,
+        use_gzip_pipeline,
+        use_external_gzip,
+        log_format,
+        dimensions
+    )
+    if url_rules is not None:
+        log_reader = normalize_log_notes(log_reader, url_rules)
+    rate = sample_options.rate
+    note_sampler = NoteSampler(rate, by_url=sample_mode == 'url')
+    aggregates = aggregate_log_notes(
+        note_sampler.sample(log_reader),
+        max_url_number=max_url_number,
+        parse_error_threshold=parse_error_threshold,
+        dimensions=dimensions,
+        use_numpy=use_numpy
+    )
+    if sample_mode == 'url':
+        count_error = get_cluster_error(rate, aggregates.counts)
+        time_error = get_cluster_error(rate, aggregates.time_sums)
+    else:
+        count_error = get_request_error(
+            rate,
+            aggregates.total_request_number,
+            aggregates.total_request_number
+        )
+        time_error = get_request_error(
+            rate,
+            aggregates.total_request_time / MICROSECONDS_PER_SECOND,
+            note_sampler.time_square_sum
+        )
+    scale_aggregates(aggregates, 1 / rate, scale_urls=sample_mode != 'url')
+    summary = SampleSummary(
+        sample_mode,
+        rate,
+        1 / rate,
+        count_error,
+        time_error,
+        os.path.getsize(log_path)
+    )
+    return aggregates, summary
+
+
+def get_sample_statistics(
+        log_path: str,
+        file_extension: str,
+        parse_error_threshold: float,
+        sample_options: SampleOptions,
+        report_size: Union[int, None] = None,
+        sort_key: str = DEFAULT_SORT_KEY,
+        **reading_options
+) -> Tuple[List[Mapping[str, Union[str, float]]], SampleSummary] or None:
+    """
+    Parse a sample of a log file and return approximate statistics.
+
+    It is get_statistics for a sample: counts and time sums are scaled to
+    the whole log and rows get a relative error of the URL count. Sampled
+    aggregates are not saved to the daily cache.
+
+    :param log_path: a path of log file;
+    :param file_extension: an extension of log file;
+    :param parse_error_threshold: if parsing error ration exceeded this limit
+    scripts returns an error;
+    :param sample_options: a sampling rate, a mode and a block size;
+    :param report_size: a number of top URLs to return. None if statistics
+    for all URLs should be returned;
+    :param sort_key: a report column to sort URLs by in descending order;
+    :param reading_options: keyword arguments of get_sample_aggregates;
+    :return: a list of dicts containing URL statistics and a summary of
+    the sample. None if there are too many parsing errors.
+    """
+    try:
+        with measure_stage('aggregate'):
+            aggregates, summary = get_sample_aggregates(
+                log_path,
+                file_extension,
+                sample_options,
+                parse_error_threshold=parse_error_threshold,
+                **reading_options
+            )
+    except TooManyParseErrors as error:
+        logging.error(f'Too many parsing errors in {log_path}: {error}')
+        return
+    add_aggregate_counters(aggregates, summary.read_size)
+
+    report_list = get_checked_report_list(
+        aggregates,
+        log_path,
+        parse_error_threshold,
+        report_size,
+        sort_key
+    )
+    if report_list is None:
+        return
+    add_count_errors(report_list, summary)
+    return report_list, summary
+
+
+def get_source_aggregates(
+        log_paths: Sequence[str],
+        source_concurrency: int = DEFAULT_SOURCE_CONCURRENCY,
+        source_queue_size: int = DEFAULT_SOURCE_QUEUE_SIZE,
+        url_rules: Union[UrlRules, None] = None,
+        max_url_number: Union[int, None] = None,
+        parse_error_threshold: Union[float, None] = None,
+        **reading_options
+) -> AggregateStore:
+    """
+    Read same-day logs of several sources concurrently into one store.
+
+    Logs are read and parsed in threads of an asyncio ingestion, batches of
+    notes are added to a single store as soon as they are read.
+
+    :param log_paths: paths of log files;
+    :param source_concurrency: a number of logs read at the same time;
+    :param source_queue_size: a maximum number of note batches waiting for
+    the aggregation;
+    :param url_rules: rules to normalize URLs. None if URLs are kept as is;
+    :param max_url_number: a maximum number of distinct URLs;
+    :param parse_error_threshold: a maximum share of invalid lines of all
+    logs. TooManyParseErrors is raised as soon as it is exceeded. None if
+    reading should not be aborted;
+    :param reading_options: keyword arguments of open_log_reader;
+    :return: a store of aggregates.
+    """
+    # asyncio is imported on use: it is not needed for single-source logs.
+    from source_ingestion import ingest_sources
+
+    log_readers = []
+    for log_path in log_paths:
+        _, file_extension = os.path.splitext(log_path)
+        log_reader = open_log_reader(
+            log_path,
+            file_extension,
+            **reading_options
+        )
+        if url_rules is not None:
+            log_reader = normalize_log_notes(log_reader, url_rules)
+        log_readers.append(log_reader)
+
+    reset_parse_error_log()
+    aggregates = AggregateStore(
+        max_url_number,
+        reading_options.get('dimensions', False)
+    )
+
+    def aggregate_batch(note_batch):
+        aggregate_log_notes(
+            note_batch,
+            parse_error_threshold=parse_error_threshold,
+            aggregates=aggregates
+        )
+
+    logging.info(
+        f'Read {len(log_paths)} logs in {source_concurrency} threads.'
+    )
+    ingest_sources(
+        log_readers,
+        aggregate_batch,
+        source_concurrency,
+        source_queue_size
+    )
+    if aggregates.error_number:
+        logging.error(
+            'Parsing errors in %s of %s lines.',
+            aggregates.error_number,
+            aggregates.line_number
+        )
+    return aggregates
+
+
+def get_source_statistics(
+        log_paths: Sequence[str],
+        parse_error_threshold: float,
+        report_size: Union[int, None] = None,
+        sort_key: str = DEFAULT_SORT_KEY,
+        timeline_path: Union[str, None] = None,
+        **source_options
+) -> List[Mapping[str, Union[str, float]]] or None:
+    """
+    Parse same-day logs of several sources and return merged statistics.
+
+    :param log_paths: paths of log files;
+    :param parse_error_threshold: if parsing error ration exceeded this limit
+    scripts returns an error;
+    :param report_size: a number of top URLs to return. None if statistics
+    for all URLs should be returned;
+    :param sort_key: a report column to sort URLs by in descending order;
+    :param timeline_path: a path to save per-minute request time series.
+    It is saved if dimensions are aggregated and the log has not too many
+    parsing errors;
+    :param source_options: keyword arguments of get_source_aggregates;
+    """
+    try:
+        with measure_stage('aggregate'):
+            aggregates = get_source_aggregates(
+                log_paths,
+                parse_error_threshold=parse_error_threshold,
+                **source_options
+            )
+    except TooManyParseErrors as error:
+        logging.error(f'Too many parsing errors in {log_paths}: {error}')
+        return
+    add_aggregate_counters(
+        aggregates,
+        sum(os.path.getsize(log_path) for log_path in log_paths)
+    )
+    report_list = get_checked_report_list(
+        aggregates,
+        ', '.join(log_paths),
+        parse_error_threshold,
+        report_size,
+        sort_key
+    )
+    if report_list is not None and timeline_path and aggregates.dimensions:
+        with measure_stage('render'):
+            write_report_file(timeline_path, get_timeline(aggregates), 'json')
+    return report_list
+
+
+def get_incremental_statistics(
+        log_path: str,
+        checkpoint_path: str,
+        parse_error_threshold: float,
+        parser_name: str = DEFAULT_LOG_PARSER,
+        use_mmap: bool = False,
+        report_size: Union[int, None] = None,
+        sort_key: str = DEFAULT_SORT_KEY,
+        url_rules: Union[UrlRules, None] = None,
+        max_url_number: Union[int, None] = None,
+        log_format: Union[str, None] = None,
+) -> List[Mapping[str, Union[str, float]]] or None:
+    """
+    Parse new lines of a growing log and return statistics for top URLs.
+
+    Aggregates of lines processed by previous runs are loaded from
+    a checkpoint. The checkpoint is updated after parsing unless new lines
+    contain too many errors.
 
-        total_request_number += 1
-        total_request_time += request_time
-
-        if url not in statistics_per_url:
-            statistics_per_url[url] = {
-                'count': 1,
-                'time_sum': request_time,
-                'time_avg': request_time,
-                'time_max': request_time,
-                'time_med': request_time
-            }
-            msg_template = 'Encounter {} for the first time in the row {}.'
-            logging.debug(msg_template.format(url, log_note_number))
-        else:
-            url_info = statistics_per_url[url]
-            url_info['count'] += 1
-            url_info['time_sum'] += request_time
-            url_info['time_avg'] = url_info['time_sum'] / url_info['count']
-
-            if request_time > url_info['time_max']:
-                statistics_per_url[url]['time_max'] = request_time
-
-            updated_median = get_updated_median(
-                request_time,
-                url_info['time_med'],
-                url_info['time_sum'],
-                url_info['count']
+    :param log_path: a path of uncompressed log file;
+    :param checkpoint_path: a path of checkpoint file;
+    :param parse_error_threshold: if parsing error ration exceeded this limit
+    scripts returns an error;
+    :param parser_name: a name of log line parser: 'fast' or 'regex';
+    :param use_mmap: True if the log should be read from a memory-mapped
+    file. It is supported by the fast parser only;
+    :param report_size: a number of top URLs to return. None if statistics
+    for all URLs should be returned;
+    :param sort_key: a report column to sort URLs by in descending order;
+    :param url_rules: rules to normalize URLs. None if URLs are kept as is;
+    :param max_url_number: a maximum number of distinct URLs;
+    :param log_format: an nginx log_format string or a name in LOG_FORMATS.
+    If it is set, parser_name is ignored;
+    :return: a list of dicts containing URL statistics. It is empty if
+    the log has no requests yet, then the checkpoint is not changed. None
+    if there are too many parsing errors.
+    """
+    log_stat = os.stat(log_path)
+    url_rules_digest = get_url_rules_digest(url_rules)
+    aggregates, start_offset = load_checkpoint(
+        checkpoint_path,
+        log_path,
+        log_stat,
+        url_rules_digest
+    )
+    end_offset = get_complete_lines_end(log_path, start_offset)
+    logging.info(f'Parse {end_offset - start_offset} new bytes of {log_path}')
+    try:
+        with measure_stage('aggregate'):
+            new_aggregates = get_chunk_aggregates(
+                log_path,
+                start_offset,
+                end_offset,
+                parser_name,
+                use_mmap and (
+                    bool(log_format) or parser_name in BINARY_LOG_PARSERS
+                ),
+                url_rules,
+                max_url_number,
+                parse_error_threshold,
+                log_format
             )
-            if updated_median is None:
-                logging.error('Can not update a median estimation.')
-            statistics_per_url[url]['time_med'] = updated_median
-            logging.debug(f'Successfully processed the row {log_note_number}')
-
-    error_ratio = error_number / log_note_number
-    too_many_errors = error_ratio > parse_error_threshold
-    if too_many_errors:
+    except TooManyParseErrors as error:
+        logging.error(f'Too many parsing errors in {log_path}: {error}')
+        return
+    add_aggregate_counters(new_aggregates, end_offset - start_offset)
+    aggregates.max_url_number = max_url_number
+    aggregates.merge(new_aggregates)
+    if not aggregates.total_request_number:
+        if new_aggregates.error_number:
+            logging.error(f'Can not parse any request info in {log_path}')
+            return
+        # A log which was just rotated has no complete lines yet.
+        logging.info(f'Do not find new requests in {log_path} yet')
+        return []
+    with measure_stage('checkpoint_save'):
+        save_checkpoint(
+            checkpoint_path,
+            log_path,
+            log_stat,
+            end_offset,
+            aggregates,
+            url_rules_digest
+        )
+    return get_checked_report_list(
+        aggregates,
+        log_path,
+        parse_error_threshold,
+        report_size,
+        sort_key
+    )
+
+
+def is_error_ratio_exceeded(
+        aggregates: AggregateStore,
+        parse_error_threshold: float
+) -> bool:
+    """
+    Return True if a share of invalid lines exceeds the threshold.
+
+    :param aggregates: a store of per-URL aggregates;
+    :param parse_error_threshold: a maximum share of invalid lines;
+    :return: True if the aggregates should not be reported or cached.
+    """
+    if not aggregates.line_number:
+        return False
+    return aggregates.error_number / aggregates.line_number > (
+        parse_error_threshold
+    )
+
+
+def get_checked_report_list(
+        aggregates: AggregateStore,
+        log_path: str,
+        parse_error_threshold: float,
+        report_size: Union[int, None] = None,
+        sort_key: str = DEFAULT_SORT_KEY,
+) -> List[Mapping[str, Union[str, float]]] or None:
+    """
+    Check a parsing error ratio and return statistics for top URLs.
+
+    :param aggregates: a store of per-URL aggregates;
+    :param log_path: a path of log file;
+    :param parse_error_threshold: if parsing error ration exceeded this limit
+    scripts returns an error;
+    :param report_size: a number of top URLs to return. None if statistics
+    for all URLs should be returned;
+    :param sort_key: a report column to sort URLs by in descending order;
+    :return: a list of dicts containing URL statistics. None if there are
+    too many parsing errors.
+    """
+    if not aggregates.total_request_number:
+        raise Exception(f'Can not parse any request info in {log_path}')
+
+    set_gauge('unique_urls', len(aggregates))
+    if is_error_ratio_exceeded(aggregates, parse_error_threshold):
+        error_ratio = aggregates.error_number / aggregates.line_number
         err_ratio_msg = f'Errors per log lines ratio is {error_ratio}'
         logging.error(f'Too many parsing errors. {err_ratio_msg}')
         return
 
+    with measure_stage('report'):
+        return get_report_list(aggregates, report_size, sort_key)
+
+
+def get_top_url_ids(
+        aggregates: AggregateStore,
+        report_size: Union[int, None],
+        sort_key: str
+) -> List[int]:
+    """
+    Return ids of URLs having the largest values of a sort key.
+
+    If a report size is set, a bounded heap selects top URLs, so the whole
+    URL list is not sorted.
+
+    :param aggregates: a store of per-URL aggregates;
+    :param report_size: a number of URLs to return. None if all URLs should
+    be returned;
+    :param sort_key: a report column to sort URLs by in descending order;
+    :return: URL ids sorted by the key in descending order.
+    """
+    counts = aggregates.counts
+    time_sums = aggregates.time_sums
+    if sort_key in REPORT_QUANTILES:
+        quantile = REPORT_QUANTILES[sort_key]
+
+        def get_key(url_id):
+            return aggregates.get_quantile(url_id, quantile)
+    elif sort_key == 'time_sum':
+        get_key = time_sums.__getitem__
+    elif sort_key == 'count':
+        get_key = counts.__getitem__
+    elif sort_key == 'time_max':
+        get_key = aggregates.time_maxs.__getitem__
+    elif sort_key == 'time_avg':
+        def get_key(url_id):
+            return time_sums[url_id] / counts[url_id]
+    else:
+        raise ValueError(f'Unsupported report sort key {sort_key}')
+
+    url_ids = range(len(aggregates))
+    if report_size is None:
+        return sorted(url_ids, key=get_key, reverse=True)
+    return heapq.nlargest(report_size, url_ids, key=get_key)
+
+
+def get_report_list(
+        aggregates: AggregateStore,
+        report_size: Union[int, None] = None,
+        sort_key: str = DEFAULT_SORT_KEY,
+) -> List[Mapping[str, Union[str, float]]]:
+    """
+    Calculate statistics for top URLs from aggregates.
+
+    Report dicts are built only for selected URLs.
+
+    :param aggregates: a store of per-URL aggregates;
+    :param report_size: a number of top URLs to return. None if statistics
+    for all URLs should be returned;
+    :param sort_key: a report column to sort URLs by in descending order;
+    :return: a list of dicts containing URL statistics sorted by the key.
+    """
+    total_request_number = aggregates.total_request_number
+    total_request_time = aggregates.total_request_time
+    urls = aggregates.urls
+    counts = aggregates.counts
+    time_sums = aggregates.time_sums
+    time_maxs = aggregates.time_maxs
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
     report_list = []
-    for url, statistics in statistics_per_url.items():
+    for url_id in get_top_url_ids(aggregates, report_size, sort_key):
+        count = counts[url_id]
+        time_sum = time_sums[url_id] / MICROSECONDS_PER_SECOND
         dict_for_report = {
-            'url': url,
-            'count_perc': statistics['count'] / total_request_number,
-            'time_perc': statistics['time_sum'] / total_request_time,
-            **statistics
+            'url': urls[url_id],
+            'count_perc': count / total_request_number,
+            'time_perc': time_sums[url_id] / total_request_time,
+            'count': count,
+            'time_sum': time_sum,
+            'time_avg': time_sum / count,
+            'time_max': time_maxs[url_id],
         }
-        logging.debug(f'Calculate the statistic set: {dict_for_report}')
+        for column_name, quantile in REPORT_QUANTILES.items():
+            dict_for_report[column_name] = aggregates.get_quantile(
+                url_id,
+                quantile
+            )
+        if aggregates.dimensions:
+            bytes_sum = aggregates.bytes_sums[url_id]
+            dict_for_report['bytes_sum'] = bytes_sum
+            dict_for_report['bytes_avg'] = bytes_sum / count
+            status_counts = aggregates.get_status_counts(url_id)
+            for status_class, status_count in zip(
+                    STATUS_CLASSES,
+                    status_counts
+            ):
+                dict_for_report[f'status_{status_class}'] = status_count
+        if debug_enabled:
+            logging.debug('Calculate the statistic set: %s', dict_for_report)
         report_list.append(dict_for_report)
 
     return report_list
+
+
+def get_timeline(
+        aggregates: AggregateStore
+) -> Generator[Mapping[str, Union[str, float]], None, None]:
+    """
+    Yield request time statistics of minutes having requests.
+
+    :param aggregates: a store of aggregates with dimensions;
+    :return: dicts containing a minute HH:MM and its statistics.
+    """
+    minute_counts = aggregates.minute_counts
+    minute_time_sums = aggregates.minute_time_sums
+    for minute, count in enumerate(minute_counts):
+        if not count:
+            continue
+        time_sum = minute_time_sums[minute] / MICROSECONDS_PER_SECOND
+        yield {
+            'minute': f'{minute // 60:02d}:{minute % 60:02d}',
+            'count': count,
+            'time_sum': time_sum,
+            'time_avg': time_sum / count,
+            'time_max': aggregates.minute_time_maxs[minute],
+        }
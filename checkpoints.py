@@ -0,0 +1,157 @@
+"""Functions to save and load checkpoints of a growing log processing."""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+from typing import Tuple
+
+from aggregate_store import AggregateStore
+
+CHECKPOINT_VERSION = 2
+HEAD_DIGEST_SIZE = 4096
+
+
+def get_head_digest(log_path: str, offset: int) -> str:
+    """
+    Return a digest of the log head to detect a truncated and rewritten log.
+
+    :param log_path: a path of uncompressed log file;
+    :param offset: an offset after the last processed line;
+    :return: a hex digest of the first bytes of the processed log part.
+    """
+    with open(log_path, 'rb') as log_file:
+        head = log_file.read(min(offset, HEAD_DIGEST_SIZE))
+    return hashlib.sha1(head).hexdigest()
+
+
+def get_complete_lines_end(log_path: str, start: int) -> int:
+    """
+    Return an offset after the last complete line of a growing log.
+
+    A line which is being written by a web server has no line end yet,
+    so it is left for the next run.
+
+    :param log_path: a path of uncompressed log file;
+    :param start: an offset to search from;
+    :return: an offset after the last line end. It equals start if there are
+    no complete lines after start.
+    """
+    block_size = 64 * 1024
+    with open(log_path, 'rb') as log_file:
+        block_end = log_file.seek(0, os.SEEK_END)
+        while block_end > start:
+            block_start = max(block_end - block_size, start)
+            log_file.seek(block_start)
+            block = log_file.read(block_end - block_start)
+            line_end = block.rfind(b'\n')
+            if line_end >= 0:
+                return block_start + line_end + 1
+            block_end = block_start
+    return start
+
+
+def load_checkpoint(
+        checkpoint_path: str,
+        log_path: str,
+        log_stat: os.stat_result,
+        url_rules_digest: str = ''
+) -> Tuple[AggregateStore, int]:
+    """
+    Return aggregates and an offset to resume a log processing from.
+
+    If a checkpoint is absent, has another version or digest of URL rules,
+    or the log was rotated or truncated since the checkpoint, the log is
+    processed from the beginning.
+
+    :param checkpoint_path: a path of checkpoint file;
+    :param log_path: a path of uncompressed log file;
+    :param log_stat: a current status of the log file;
+    :param url_rules_digest: a digest of current URL normalization rules;
+    :return: aggregates of the processed log part and an offset after it.
+    """
+    if not os.path.exists(checkpoint_path):
+        logging.info(f'Checkpoint {checkpoint_path} is not found.')
+        return AggregateStore(), 0
+
+    try:
+        with gzip.open(checkpoint_path, 'rt', encoding='utf_8') as file:
+            checkpoint = json.load(file)
+    except (OSError, EOFError, ValueError):
+        logging.exception(f'Can not read the checkpoint {checkpoint_path}')
+        return AggregateStore(), 0
+
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        err_msg = 'Checkpoint {} has unsupported version {}.'
+        version = checkpoint.get('version')
+        logging.warning(err_msg.format(checkpoint_path, version))
+        return AggregateStore(), 0
+
+    if checkpoint.get('url_rules_digest') != url_rules_digest:
+        logging.info(
+            f'URL rules were changed since the checkpoint {checkpoint_path}.'
+        )
+        return AggregateStore(), 0
+
+    log_is_same = (
+        checkpoint['log_path'] == os.path.abspath(log_path)
+        and checkpoint['device'] == log_stat.st_dev
+        and checkpoint['inode'] == log_stat.st_ino
+    )
+    if not log_is_same:
+        logging.info(f'Log {log_path} was rotated since the last checkpoint.')
+        return AggregateStore(), 0
+
+    offset = checkpoint['offset']
+    log_is_truncated = (
+        log_stat.st_size < offset
+        or get_head_digest(log_path, offset) != checkpoint['head_digest']
+    )
+    if log_is_truncated:
+        logging.info(
+            f'Log {log_path} was truncated since the last checkpoint.'
+        )
+        return AggregateStore(), 0
+
+    aggregates = AggregateStore.from_state(checkpoint['aggregates'])
+    logging.info(f'Resume processing {log_path} from the offset {offset}')
+    return aggregates, offset
+
+
+def save_checkpoint(
+        checkpoint_path: str,
+        log_path: str,
+        log_stat: os.stat_result,
+        offset: int,
+        aggregates: AggregateStore,
+        url_rules_digest: str = ''
+):
+    """
+    Save a checkpoint of a log processing.
+
+    The checkpoint is written to a temporary file and then renamed,
+    so an interrupted run does not corrupt a previous checkpoint.
+
+    :param checkpoint_path: a path of checkpoint file;
+    :param log_path: a path of uncompressed log file;
+    :param log_stat: a status of the log file taken before processing;
+    :param offset: an offset after the last processed line;
+    :param aggregates: aggregates of the processed log part;
+    :param url_rules_digest: a digest of URL normalization rules.
+    """
+    checkpoint = {
+        'version': CHECKPOINT_VERSION,
+        'log_path': os.path.abspath(log_path),
+        'device': log_stat.st_dev,
+        'inode': log_stat.st_ino,
+        'offset': offset,
+        'head_digest': get_head_digest(log_path, offset),
+        'url_rules_digest': url_rules_digest,
+        'aggregates': aggregates.to_state(),
+    }
+    temp_checkpoint_path = f'{checkpoint_path}.tmp'
+    with gzip.open(temp_checkpoint_path, 'wt', encoding='utf_8') as file:
+        json.dump(checkpoint, file)
+    os.replace(temp_checkpoint_path, checkpoint_path)
+    logging.debug(f'Saved the checkpoint {checkpoint_path}')
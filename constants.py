@@ -1,5 +1,37 @@
 """Script constants."""
 
 PARSE_ERROR_THRESHOLD = 0.5
+PARSE_ERROR_MIN_LINE_NUMBER = 1000
+PREFLIGHT_HEAD_LINE_NUMBER = 1000
+PREFLIGHT_SEEK_NUMBER = 1000
 DEFAULT_CONFIG_PATH = 'log_analyzer_config.json'
 REPORT_NAME_TEMPLATE = 'report-{}.html'
+LIVE_REPORT_NAME = 'report-live.html'
+CHECKPOINT_NAME_TEMPLATE = '.checkpoint-{}.json.gz'
+AGGREGATES_NAME_TEMPLATE = '.aggregates-{}.json.gz'
+ROLLUP_REPORT_NAME_TEMPLATE = 'report-rollup-{}-{}.html'
+SAMPLE_REPORT_NAME_TEMPLATE = 'report-{}.sample.html'
+TIMELINE_NAME_TEMPLATE = 'timeline-{}.json'
+DAEMON_STATUS_NAME = 'daemon-status.json'
+REPORT_INDEX_NAME = '.report-index.json'
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_SAMPLE_BLOCK_SIZE = 1024 * 1024
+MICROSECONDS_PER_SECOND = 1000000
+DEFAULT_LOG_PARSER = 'fast'
+DEFAULT_LOG_NAME_PREFIX = 'nginx-access-ui.log-'
+DEFAULT_LOG_FORMAT = 'ui_short'
+DEFAULT_SORT_KEY = 'time_sum'
+DEFAULT_SOURCE_CONCURRENCY = 8
+DEFAULT_SOURCE_QUEUE_SIZE = 16
+OTHER_URL = 'other'
+STATUS_CLASSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+MINUTES_PER_DAY = 24 * 60
+REPORT_QUANTILES = {
+    'time_med': 0.5,
+    'time_p90': 0.9,
+    'time_p95': 0.95,
+    'time_p99': 0.99,
+}
+REPORT_SORT_KEYS = (
+    'time_sum', 'count', 'time_avg', 'time_max', *REPORT_QUANTILES
+)
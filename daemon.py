@@ -0,0 +1,339 @@
+"""A resident mode which processes rotated logs as soon as they appear."""
+
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, Tuple, Union
+
+from constants import DAEMON_STATUS_NAME
+from log_formats import get_span_parser
+from log_processing import get_unprocessed_logs
+from report_index import get_index_arguments, get_unindexed_logs
+from report_index import read_report_index
+from report_writer import REPORT_TEMPLATE_PATH, get_report_template
+
+# Flags of inotify events: a file was closed after writing or moved into
+# the directory. Half-written files do not wake the daemon up.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+INOTIFY_READ_SIZE = 64 * 1024
+# The longest time the daemon does not check a stop request and finished
+# workers.
+WAKEUP_INTERVAL = 1.0
+
+
+class PollingWatcher:
+    """Report a possible directory change once per poll interval."""
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self.last_poll_time = time.monotonic()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait for a directory change.
+
+        :param timeout: a maximum waiting time in seconds;
+        :return: True if the directory should be scanned.
+        """
+        poll_time = self.last_poll_time + self.poll_interval
+        time.sleep(max(min(timeout, poll_time - time.monotonic()), 0))
+        if time.monotonic() < poll_time:
+            return False
+        self.last_poll_time = time.monotonic()
+        return True
+
+    def close(self):
+        """Release watcher resources."""
+
+
+class InotifyWatcher:
+    """Wait for files written or moved into a directory by Linux inotify."""
+    def __init__(self, directory_path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.inotify_fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.inotify_fd < 0:
+            raise OSError(ctypes.get_errno(), 'Can not initialize inotify')
+        watch_descriptor = libc.inotify_add_watch(
+            self.inotify_fd,
+            os.fsencode(directory_path),
+            IN_CLOSE_WRITE | IN_MOVED_TO
+        )
+        if watch_descriptor < 0:
+            os.close(self.inotify_fd)
+            raise OSError(
+                ctypes.get_errno(),
+                f'Can not watch {directory_path}'
+            )
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait for a directory change.
+
+        Events are drained, but not parsed: the directory is scanned anyway.
+
+        :param timeout: a maximum waiting time in seconds;
+        :return: True if some file was written or moved into the directory.
+        """
+        ready_fds, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if not ready_fds:
+            return False
+        try:
+            while os.read(self.inotify_fd, INOTIFY_READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        """Release watcher resources."""
+        os.close(self.inotify_fd)
+
+
+def get_directory_watcher(
+        directory_path: str,
+        use_inotify: bool,
+        poll_interval: float
+) -> Union[InotifyWatcher, PollingWatcher]:
+    """
+    Return an inotify watcher if it is available or a polling watcher.
+
+    :param directory_path: a directory to watch;
+    :param use_inotify: False if the directory should be polled anyway;
+    :param poll_interval: an interval of directory scans in seconds;
+    :return: a watcher.
+    """
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory_path)
+        except (AttributeError, OSError, TypeError) as error:
+            logging.warning(f'Can not use inotify, poll directory: {error}')
+    return PollingWatcher(poll_interval)
+
+
+def warm_up_worker(log_format: Union[str, None], dimensions: bool):
+    """
+    Load a report template and compile a log parser in a worker process.
+
+    :param log_format: a log format of the configuration;
+    :param dimensions: True if dimensions are aggregated.
+    """
+    get_report_template(REPORT_TEMPLATE_PATH)
+    get_span_parser(log_format, dimensions)
+
+
+def write_status(status_path: str, status: Mapping[str, Any]):
+    """
+    Save a daemon status to a JSON file.
+
+    :param status_path: a path of status file;
+    :param status: a dict of JSON serializable values.
+    """
+    temp_status_path = f'{status_path}.tmp'
+    with open(temp_status_path, 'w') as status_file:
+        json.dump(status, status_file, indent=2)
+    os.replace(temp_status_path, status_path)
+
+
+def is_settled(log_path: str, settle_time: float) -> bool:
+    """
+    Return True if a log was not modified for a settle time.
+
+    :param log_path: a path of log file;
+    :param settle_time: a time in seconds;
+    :return: True if the log is probably written completely.
+    """
+    try:
+        return time.time() - os.path.getmtime(log_path) >= settle_time
+    except OSError:
+        return False
+
+
+def run_daemon(
+        configuration: Mapping[str, Any],
+        process_log: Callable[..., Union[str, None]]
+):
+    """
+    Process new logs until SIGTERM or SIGINT is received.
+
+    Logs are processed in a pool of BATCH_WORKER_NUMBER resident processes,
+    which keep a report template and compiled parsers loaded. The number of
+    submitted logs does not exceed the number of workers, other logs wait
+    in the backlog. A log which failed is not retried until a restart.
+    If a worker dies, logs in progress are recorded as failed and the pool
+    is created again. On a stop request, the daemon waits for logs in
+    progress.
+
+    :param configuration: the script configuration;
+    :param process_log: a function (log_path, log_date, configuration)
+    returning an error message or None. It runs in worker processes.
+    """
+    stop_event = threading.Event()
+
+    def request_stop(signal_number, _):
+        logging.info(f'Receive the signal {signal_number}, stop the daemon')
+        stop_event.set()
+
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, request_stop)
+
+    log_dir_path = configuration['LOG_DIR']
+    report_dir_path = configuration['REPORT_DIR']
+    worker_number = configuration['BATCH_WORKER_NUMBER']
+    settle_time = configuration['DAEMON_SETTLE_TIME']
+    status_path = (
+        configuration['DAEMON_STATUS_PATH']
+        or os.path.join(report_dir_path, DAEMON_STATUS_NAME)
+    )
+    file_configuration = {**configuration, 'WORKER_NUMBER': 1}
+    warm_up_worker(
+        configuration['LOG_FORMAT'],
+        configuration['REPORT_DIMENSIONS']
+    )
+    watcher = get_directory_watcher(
+        log_dir_path,
+        configuration['DAEMON_USE_INOTIFY'],
+        configuration['DAEMON_POLL_INTERVAL']
+    )
+    futures: Dict[Future, Tuple[str, date]] = {}
+    detection_times = {}
+    failed_logs = set()
+    backlog = []
+    status = {
+        'pid': os.getpid(),
+        'state': 'running',
+        'watcher': type(watcher).__name__,
+        'backlog': 0,
+        'in_progress': [],
+        'processed': 0,
+        'failed': 0,
+        'last_log': None,
+        'last_latency_seconds': None,
+    }
+    saved_status = None
+    scan_directory = True
+    unsettled_logs = False
+    pool_is_broken = False
+
+    def create_executor() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=worker_number,
+            initializer=warm_up_worker,
+            initargs=(
+                configuration['LOG_FORMAT'],
+                configuration['REPORT_DIMENSIONS']
+            )
+        )
+
+    def record_results(finished_futures):
+        nonlocal pool_is_broken
+        for future in finished_futures:
+            log_path, _ = futures.pop(future)
+            latency = time.time() - detection_times.pop(log_path)
+            try:
+                error_message = future.result()
+            except BrokenProcessPool:
+                pool_is_broken = True
+                error_message = (
+                    f'A worker process died while processing {log_path}'
+                )
+            if error_message:
+                failed_logs.add(log_path)
+                status['failed'] += 1
+                logging.error(error_message)
+            else:
+                status['processed'] += 1
+                logging.info(f'Processed {log_path} in {latency:.3f}s')
+            status['last_log'] = log_path
+            status['last_latency_seconds'] = latency
+
+    logging.info(f'Start the daemon watching {log_dir_path}')
+    executor = create_executor()
+    try:
+        while not stop_event.is_set():
+            finished_futures = [
+                future for future in futures if future.done()
+            ]
+            record_results(finished_futures)
+            if pool_is_broken:
+                logging.warning('Create the worker pool again')
+                executor.shutdown(wait=False)
+                executor = create_executor()
+                pool_is_broken = False
+
+            if scan_directory or finished_futures:
+                submitted_logs = {
+                    log_path for log_path, _ in futures.values()
+                }
+                backlog, unsettled_logs = [], False
+                if configuration['REPORT_INDEX']:
+                    index_arguments = get_index_arguments(configuration)
+                    unprocessed_logs = get_unindexed_logs(
+                        read_report_index(*index_arguments),
+                        *index_arguments
+                    )
+                else:
+                    unprocessed_logs = get_unprocessed_logs(
+                        log_dir_path,
+                        report_dir_path,
+                        configuration['LOG_NAME_PREFIX'],
+                        configuration['MULTI_SOURCE_LOGS']
+                    )
+                for log_path, log_date in unprocessed_logs:
+                    if log_path in submitted_logs | failed_logs:
+                        continue
+                    detection_times.setdefault(log_path, time.time())
+                    if is_settled(log_path, settle_time):
+                        backlog.append((log_path, log_date))
+                    else:
+                        unsettled_logs = True
+
+            while backlog and len(futures) < worker_number:
+                log_path, log_date = backlog[0]
+                try:
+                    future = executor.submit(
+                        process_log,
+                        log_path,
+                        log_date,
+                        file_configuration
+                    )
+                except BrokenProcessPool:
+                    # A worker died after results were recorded. The log
+                    # is submitted to a new pool on the next iteration.
+                    pool_is_broken = True
+                    break
+                backlog.pop(0)
+                futures[future] = (log_path, log_date)
+
+            status['backlog'] = len(backlog)
+            status['in_progress'] = sorted(
+                log_path for log_path, _ in futures.values()
+            )
+            if status != saved_status:
+                write_status(
+                    status_path,
+                    {**status, 'updated_at': time.time()}
+                )
+                saved_status = dict(status)
+            scan_directory = (
+                watcher.wait(WAKEUP_INTERVAL) or unsettled_logs
+            )
+
+        logging.info(f'Wait for {len(futures)} logs in progress')
+        record_results(wait(list(futures)).done)
+    finally:
+        executor.shutdown()
+        watcher.close()
+
+    status['state'] = 'stopped'
+    status['in_progress'] = []
+    write_status(status_path, {**status, 'updated_at': time.time()})
+    logging.info('The daemon is stopped')
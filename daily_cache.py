@@ -0,0 +1,147 @@
+"""Functions to cache per-day aggregates next to reports."""
+
+from datetime import date
+import gzip
+import json
+import logging
+import os
+from typing import Union
+
+from aggregate_store import AggregateStore
+from constants import AGGREGATES_NAME_TEMPLATE
+
+DAILY_CACHE_VERSION = 2
+
+
+def get_cache_path(report_dir_path: str, log_date: date) -> str:
+    """
+    Return a path of cached aggregates of a day.
+
+    :param report_dir_path: directory containing script results;
+    :param log_date: a log date;
+    :return: a path of cache file.
+    """
+    cache_name = AGGREGATES_NAME_TEMPLATE.format(
+        str(log_date).replace("-", ".")
+    )
+    return os.path.join(report_dir_path, cache_name)
+
+
+def save_daily_aggregates(
+        cache_path: str,
+        log_path: str,
+        aggregates: AggregateStore,
+        url_rules_digest: str = ''
+):
+    """
+    Save final aggregates of a daily log.
+
+    The log size and modification time are saved to invalidate the cache
+    if the log changes, the digest of URL rules to invalidate it if URLs
+    are normalized in another way.
+
+    :param cache_path: a path of cache file;
+    :param log_path: a path of the log;
+    :param aggregates: aggregates of the whole log;
+    :param url_rules_digest: a digest of URL normalization rules.
+    """
+    log_stat = os.stat(log_path)
+    cache = {
+        'version': DAILY_CACHE_VERSION,
+        'log_path': os.path.abspath(log_path),
+        'log_size': log_stat.st_size,
+        'log_mtime': log_stat.st_mtime,
+        'url_rules_digest': url_rules_digest,
+        'aggregates': aggregates.to_state(),
+    }
+    temp_cache_path = f'{cache_path}.tmp'
+    with gzip.open(temp_cache_path, 'wt', encoding='utf_8') as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(temp_cache_path, cache_path)
+    logging.info(f'Saved daily aggregates {cache_path}')
+
+
+def load_daily_aggregates(
+        cache_path: str,
+        url_rules_digest: str = ''
+) -> Union[AggregateStore, None]:
+    """
+    Return cached aggregates of a day if they are valid.
+
+    A cache is invalid if it has another version or digest of URL rules,
+    or its log still exists but has another size or modification time.
+    An invalid cache is removed. A used cache is touched to keep it during
+    eviction.
+
+    :param cache_path: a path of cache file;
+    :param url_rules_digest: a digest of current URL normalization rules;
+    :return: aggregates. None if the cache is absent or invalid.
+    """
+    if not os.path.exists(cache_path):
+        return None
+
+    try:
+        with gzip.open(cache_path, 'rt', encoding='utf_8') as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, EOFError, ValueError):
+        logging.exception(f'Can not read daily aggregates {cache_path}')
+        return None
+
+    cache_is_valid = (
+        cache.get('version') == DAILY_CACHE_VERSION
+        and cache.get('url_rules_digest') == url_rules_digest
+    )
+    log_path = cache.get('log_path')
+    if cache_is_valid and os.path.exists(log_path):
+        log_stat = os.stat(log_path)
+        cache_is_valid = (
+            log_stat.st_size == cache['log_size']
+            and log_stat.st_mtime == cache['log_mtime']
+        )
+    if not cache_is_valid:
+        logging.info(f'Remove outdated daily aggregates {cache_path}')
+        os.remove(cache_path)
+        return None
+
+    os.utime(cache_path)
+    return AggregateStore.from_state(cache['aggregates'])
+
+
+def evict_daily_aggregates(report_dir_path: str, max_cache_size: int):
+    """
+    Remove least recently used daily aggregates exceeding the size limit.
+
+    :param report_dir_path: directory containing script results;
+    :param max_cache_size: a maximum total size of cache files in bytes.
+    """
+    cache_prefix, cache_suffix = AGGREGATES_NAME_TEMPLATE.split('{}')
+    cache_entries = []
+    with os.scandir(report_dir_path) as entries:
+        for entry in entries:
+            is_cache = (
+                entry.name.startswith(cache_prefix)
+                and entry.name.endswith(cache_suffix)
+            )
+            if not is_cache:
+                continue
+            # Another process may evict the same files at the same time.
+            try:
+                if not entry.is_file():
+                    continue
+                entry_stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            cache_entries.append(
+                (entry_stat.st_mtime, entry_stat.st_size, entry.path)
+            )
+
+    cache_size = sum(size for _, size, _ in cache_entries)
+    for _, size, cache_path in sorted(cache_entries):
+        if cache_size <= max_cache_size:
+            break
+        logging.info(f'Evict daily aggregates {cache_path}')
+        try:
+            os.remove(cache_path)
+        except FileNotFoundError:
+            pass
+        cache_size -= size
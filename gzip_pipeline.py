@@ -0,0 +1,220 @@
+"""A gzip log reader which decompresses and parses in parallel stages."""
+
+import logging
+import queue
+import shutil
+import subprocess
+import threading
+from typing import Generator, Tuple, Union
+import zlib
+
+from log_processing import SpanParser, parse_buffer_lines, parse_log_span
+from metrics import measure_stage
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+GZIP_READ_SIZE = 1024 * 1024
+GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+GZIP_QUEUE_SIZE = 8
+EXTERNAL_GZIP_COMMANDS = ('pigz', 'igzip')
+QUEUE_TIMEOUT = 0.1
+
+
+def find_external_gzip() -> Union[str, None]:
+    """Return a path of pigz or igzip binary. None if they are not found."""
+    for command in EXTERNAL_GZIP_COMMANDS:
+        command_path = shutil.which(command)
+        if command_path:
+            return command_path
+    return None
+
+
+def put_block(
+        block_queue: queue.Queue,
+        block: Union[bytes, Exception, None],
+        stop_event: threading.Event
+) -> bool:
+    """
+    Put a block into the queue waiting for a free place.
+
+    :param block_queue: a queue between the decompressor and the parser;
+    :param block: decompressed bytes, an exception or None at the end;
+    :param stop_event: an event set when the parser stops reading;
+    :return: False if the parser has stopped reading.
+    """
+    while not stop_event.is_set():
+        try:
+            block_queue.put(block, timeout=QUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def decompress_with_zlib(
+        log_path: str,
+        block_queue: queue.Queue,
+        stop_event: threading.Event
+):
+    """
+    Inflate a gzip file and put decompressed blocks into the queue.
+
+    zlib releases the GIL, so inflating in a thread overlaps with parsing.
+    Multi-member gzip files are supported.
+
+    :param log_path: a path of gzip file;
+    :param block_queue: a queue between the decompressor and the parser;
+    :param stop_event: an event set when the parser stops reading.
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    member_started = False
+    with open(log_path, 'rb') as log_file:
+        while True:
+            compressed_data = log_file.read(GZIP_READ_SIZE)
+            if not compressed_data:
+                break
+            while compressed_data:
+                member_started = True
+                block = decompressor.decompress(
+                    compressed_data,
+                    GZIP_BLOCK_SIZE
+                )
+                if block and not put_block(block_queue, block, stop_event):
+                    return
+                compressed_data = decompressor.unconsumed_tail
+                if decompressor.eof:
+                    compressed_data = decompressor.unused_data.lstrip(b'\0')
+                    decompressor = zlib.decompressobj(GZIP_WBITS)
+                    member_started = False
+
+    if member_started:
+        raise EOFError(f'Compressed file {log_path} ended before the end')
+
+
+def decompress_with_command(
+        log_path: str,
+        block_queue: queue.Queue,
+        stop_event: threading.Event,
+        command_path: str
+):
+    """
+    Inflate a gzip file by an external binary and put blocks into the queue.
+
+    :param log_path: a path of gzip file;
+    :param block_queue: a queue between the decompressor and the parser;
+    :param stop_event: an event set when the parser stops reading;
+    :param command_path: a path of pigz or igzip binary.
+    """
+    with subprocess.Popen(
+            [command_path, '-dc', log_path],
+            stdout=subprocess.PIPE
+    ) as process:
+        while True:
+            block = process.stdout.read(GZIP_BLOCK_SIZE)
+            if not block:
+                break
+            if not put_block(block_queue, block, stop_event):
+                process.kill()
+                return
+    if process.returncode:
+        raise OSError(
+            f'{command_path} exited with the code {process.returncode}'
+        )
+
+
+def run_decompressor(
+        log_path: str,
+        block_queue: queue.Queue,
+        stop_event: threading.Event,
+        command_path: Union[str, None]
+):
+    """
+    Decompress a log and pass the end marker or an error to the parser.
+
+    :param log_path: a path of gzip file;
+    :param block_queue: a queue between the decompressor and the parser;
+    :param stop_event: an event set when the parser stops reading;
+    :param command_path: a path of external gzip binary. None if zlib
+    should be used.
+    """
+    try:
+        with measure_stage('decompress', in_thread=True):
+            if command_path:
+                decompress_with_command(
+                    log_path,
+                    block_queue,
+                    stop_event,
+                    command_path
+                )
+            else:
+                decompress_with_zlib(log_path, block_queue, stop_event)
+    except Exception as error:
+        put_block(block_queue, error, stop_event)
+        return
+    put_block(block_queue, None, stop_event)
+
+
+def gzip_pipeline_reader_generator(
+        log_path: str,
+        use_external_gzip: bool = False,
+        parse_span: SpanParser = parse_log_span,
+) -> Generator[Tuple[str, float], None, None]:
+    """
+    Parse and yield url and request time from a gzip log.
+
+    A decompressor thread inflates the log and passes blocks of bytes to
+    the parser through a bounded queue. Lines are parsed in place in blocks
+    by the fast parser. Unlike log_reader_generator, it does not raise
+    an exception if the log contains no valid lines: a caller checks it.
+
+    :param log_path: a path of gzip file;
+    :param use_external_gzip: True if pigz or igzip should decompress the
+    log when one of them is found on PATH;
+    :param parse_span: a parser of a line span;
+    :return: url and request processing duration.
+    """
+    command_path = find_external_gzip() if use_external_gzip else None
+    if command_path:
+        logging.info(f'Decompress {log_path} with {command_path}')
+
+    block_queue = queue.Queue(maxsize=GZIP_QUEUE_SIZE)
+    stop_event = threading.Event()
+    decompressor_thread = threading.Thread(
+        target=run_decompressor,
+        args=(log_path, block_queue, stop_event, command_path),
+        daemon=True
+    )
+    decompressor_thread.start()
+
+    remainder = b''
+    remainder_offset = 0
+    try:
+        while True:
+            block = block_queue.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise block
+
+            data = remainder + block if remainder else block
+            lines_end = data.rfind(b'\n') + 1
+            yield from parse_buffer_lines(
+                data,
+                0,
+                lines_end,
+                remainder_offset,
+                parse_span
+            )
+            remainder = data[lines_end:]
+            remainder_offset += lines_end
+
+        if remainder:
+            yield from parse_buffer_lines(
+                remainder,
+                0,
+                len(remainder),
+                remainder_offset,
+                parse_span
+            )
+    finally:
+        stop_event.set()
+        decompressor_thread.join()
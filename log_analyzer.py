@@ -9,26 +9,93 @@
 
 import argparse
 from collections import namedtuple
+from datetime import date, timedelta
+from itertools import islice
 import json
-from inspect import getsourcefile
 import logging
 from logging import FileHandler, StreamHandler
 import os
-from string import Template
 import sys
-from typing import Any, Mapping, Union
+import time
+from typing import Any, Iterable, Mapping, Tuple, Union
 
+from aggregate_store import AggregateStore
+from batch_aggregation import numpy_available
+from calculations import get_checked_report_list, get_incremental_statistics
+from calculations import get_log_aggregates, get_sample_statistics
 from calculations import get_statistics
-from constants import DEFAULT_CONFIG_PATH, PARSE_ERROR_THRESHOLD
-from constants import REPORT_NAME_TEMPLATE
-from log_processing import get_new_log_path_and_date, search_in_reports
+from calculations import get_source_aggregates, get_source_statistics
+from calculations import is_error_ratio_exceeded
+from constants import CHECKPOINT_NAME_TEMPLATE, DEFAULT_CHUNK_SIZE
+from constants import DEFAULT_CONFIG_PATH, DEFAULT_LOG_NAME_PREFIX
+from constants import DEFAULT_LOG_PARSER, DEFAULT_SAMPLE_BLOCK_SIZE
+from constants import DEFAULT_SORT_KEY
+from constants import PARSE_ERROR_THRESHOLD
+from constants import LIVE_REPORT_NAME, REPORT_NAME_TEMPLATE
+from constants import REPORT_SORT_KEYS, ROLLUP_REPORT_NAME_TEMPLATE
+from constants import SAMPLE_REPORT_NAME_TEMPLATE, TIMELINE_NAME_TEMPLATE
+from daily_cache import evict_daily_aggregates, get_cache_path
+from daily_cache import load_daily_aggregates, save_daily_aggregates
+from log_formats import compile_span_parser
+from log_processing import get_new_log_path_and_date, get_unprocessed_logs
+from log_processing import get_source_log_paths, iter_log_files
+from log_processing import remove_packed_copies, search_in_reports
+from metrics import enable_metrics, get_collected_metrics, measure_stage
+from metrics import merge_metrics, metrics_enabled, reset_metrics
+from metrics import set_gauge, write_metrics
+from report_index import find_newest_log, get_index_arguments
+from report_index import get_unindexed_logs, is_report_indexed
+from report_index import read_report_index, record_report
+from report_index import update_report_index
+from report_writer import GZIP_SUFFIX, TABLE_FORMATS, write_report_file
+from sampling import SAMPLE_MODES, SampleOptions, get_sample_note
+from url_normalization import UrlRules, check_custom_rules
+from url_normalization import get_url_rules_digest
 
 default_config = {
     'REPORT_SIZE': 1000,
+    'REPORT_SORT_KEY': DEFAULT_SORT_KEY,
     'REPORT_DIR': './reports',
     'LOG_DIR': './log',
-    'SCRIPT_LOG_PATH': 'script.log'
+    'SCRIPT_LOG_PATH': 'script.log',
+    'WORKER_NUMBER': 1,
+    'CHUNK_SIZE': DEFAULT_CHUNK_SIZE,
+    'LOG_PARSER': DEFAULT_LOG_PARSER,
+    'LOG_FORMAT': None,
+    'LOG_NAME_PREFIX': DEFAULT_LOG_NAME_PREFIX,
+    'USE_MMAP': False,
+    'GZIP_PIPELINE': True,
+    'EXTERNAL_GZIP': False,
+    'INCREMENTAL': False,
+    'LIVE_LOG_NAME': 'nginx-access-ui.log',
+    'BATCH_WORKER_NUMBER': 4,
+    'AGGREGATE_CACHE': True,
+    'AGGREGATE_CACHE_SIZE': 1024 * 1024 * 1024,
+    'URL_STRIP_QUERY': False,
+    'URL_COLLAPSE_IDS': False,
+    'URL_RULES': [],
+    'URL_CACHE_SIZE': 100000,
+    'MAX_URL_NUMBER': None,
+    'REPORT_GZIP': False,
+    'REPORT_TABLE_FORMATS': [],
+    'METRICS_JSON_PATH': None,
+    'METRICS_PROMETHEUS_PATH': None,
+    'PREFLIGHT_SAMPLE': True,
+    'REPORT_DIMENSIONS': False,
+    'DAEMON_USE_INOTIFY': True,
+    'DAEMON_POLL_INTERVAL': 10,
+    'DAEMON_SETTLE_TIME': 2,
+    'DAEMON_STATUS_PATH': None,
+    'MULTI_SOURCE_LOGS': False,
+    'SOURCE_CONCURRENCY': 8,
+    'SOURCE_QUEUE_SIZE': 16,
+    'NUMPY_AGGREGATION': False,
+    'REPORT_INDEX': True,
+    'SAMPLE_MODE': 'request',
+    'SAMPLE_BLOCK_SIZE': DEFAULT_SAMPLE_BLOCK_SIZE,
 }
+PROFILE_PATH = 'log_analyzer.prof'
+PROFILE_TOP_SIZE = 20
 
 LogProperties = namedtuple(
     'LogProperties',
@@ -47,6 +114,52 @@ def get_console_arguments() -> argparse.Namespace:
         help=f'A path to a script configuration file. {default_config_help}',
         type=str
     )
+    argument_parser.add_argument(
+        '--batch',
+        action='store_true',
+        help='Process all logs which have no reports yet.'
+    )
+    argument_parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Stay resident and process new logs until SIGTERM.'
+    )
+    argument_parser.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        help='Rebuild the report index from the report and log directories.'
+    )
+    argument_parser.add_argument(
+        '--sample',
+        metavar='RATE',
+        help='Render an approximate report of a share of the newest log, '
+             'e.g. 0.01.',
+        type=float
+    )
+    argument_parser.add_argument(
+        '--sample-mode',
+        choices=SAMPLE_MODES,
+        help='Sample requests, URLs or log blocks. Default: SAMPLE_MODE of '
+             'the configuration.'
+    )
+    argument_parser.add_argument(
+        '--rollup',
+        nargs=2,
+        metavar=('START_DATE', 'END_DATE'),
+        help='Render a report for a range of days in the format YYYY-MM-DD.',
+        type=date.fromisoformat
+    )
+    argument_parser.add_argument(
+        '--profile',
+        nargs='?',
+        const=PROFILE_PATH,
+        metavar='PROFILE_PATH',
+        help=(
+            'Profile the run and save cProfile stats. '
+            f'Default: {PROFILE_PATH}'
+        ),
+        type=str
+    )
     return argument_parser.parse_args()
 
 
@@ -88,30 +201,53 @@ def render_report(
         report_dir,
         log_date,
         report_size: int,
-):
+        report_file_name: Union[str, None] = None,
+        compress_report: bool = False,
+        table_formats: Iterable[str] = (),
+        report_note: Union[str, None] = None,
+) -> str:
     """
     Render the script report.
 
+    The report is streamed to a file row by row, so a large report does not
+    have to fit in memory as a string. Table files contain all rows of
+    statistics, the HTML report contains the first report_size rows.
+
     :param statistics: a list containing statistics;
     :param report_dir: a directory path to report saving;
     :param log_date: a report date;
     :param report_size: a number of rows which report should contain;
+    :param report_file_name: a report file name. If it is None, the name
+    contains the report date;
+    :param compress_report: True if the HTML report should be packed by gzip;
+    :param table_formats: formats of table files to save next to the report:
+    'json' and 'csv';
+    :param report_note: a text shown above the table of the HTML report.
+    None if there is no note;
+    :return: a path of the HTML report.
     """
-    dict_to_report = {'table_json': statistics[:report_size]}
-    script_dir = os.path.dirname(os.path.abspath(getsourcefile(lambda: 0)))
-    report_template_path = os.path.join(script_dir, 'data', 'report.html')
-    with open(report_template_path, 'r') as report_template_file:
-        report_template_str = report_template_file.read()
+    if report_file_name is None:
+        report_file_name = REPORT_NAME_TEMPLATE.format(
+            str(log_date).replace("-", ".")
+        )
+    report_name_base, _ = os.path.splitext(report_file_name)
+    with measure_stage('render'):
+        for table_format in table_formats:
+            table_file_path = os.path.join(
+                report_dir,
+                f'{report_name_base}.{table_format}'
+            )
+            write_report_file(table_file_path, statistics, table_format)
 
-    template = Template(report_template_str)
-    report = template.safe_substitute(dict_to_report)
-    report_file_name = REPORT_NAME_TEMPLATE.format(
-        str(log_date).replace("-", ".")
-    )
-    report_file_path = os.path.join(report_dir, report_file_name)
-    with open(report_file_path, 'w') as report_file:
-        report_file.write(report)
-    logging.info(f'Successfully render the report: {report_file_path}')
+        if compress_report:
+            report_file_name += GZIP_SUFFIX
+        report_file_path = os.path.join(report_dir, report_file_name)
+        write_report_file(
+            report_file_path,
+            islice(statistics, report_size),
+            report_note=report_note
+        )
+    return report_file_path
 
 
 def configure_logger(log_path: Union[str, None]):
@@ -134,51 +270,785 @@ def configure_logger(log_path: Union[str, None]):
     logger.addHandler(log_handler)
 
 
-def main():
-    console_arguments = get_console_arguments()
-    config_file_path = console_arguments.config
-    configuration = get_configuration(config_file_path, default_config)
-    if not configuration:
-        sys.exit(f'Invalid configuration file {config_file_path}')
+def get_url_rules(
+        configuration: Mapping[str, Any]
+) -> Union[UrlRules, None]:
+    """
+    Return URL normalization rules set in the configuration.
 
-    configure_logger(configuration.get('SCRIPT_LOG_PATH'))
+    :param configuration: the script configuration;
+    :return: URL rules. None if URLs should not be normalized.
+    """
+    url_rules = UrlRules(
+        configuration['URL_STRIP_QUERY'],
+        configuration['URL_COLLAPSE_IDS'],
+        configuration['URL_RULES'],
+        configuration['URL_CACHE_SIZE'],
+    )
+    normalization_enabled = (
+        url_rules.strip_query
+        or url_rules.collapse_ids
+        or url_rules.custom_rules
+    )
+    return url_rules if normalization_enabled else None
 
-    report_dir_path = configuration['REPORT_DIR']
-    if not os.path.isdir(report_dir_path):
-        logging.debug(f'Create the directory {report_dir_path}')
-        try:
-            os.mkdir(report_dir_path)
-        except OSError:
-            sys.exit(f'Can not create the report directory {report_dir_path}')
 
-    log_dir_path = configuration["LOG_DIR"]
-    newest_log_path, log_date = get_new_log_path_and_date(log_dir_path)
-    if not newest_log_path:
-        sys.exit(f'Do not find a log file in {log_dir_path}')
+def get_statistics_size(
+        configuration: Mapping[str, Any]
+) -> Union[int, None]:
+    """
+    Return a number of top URLs to calculate statistics for.
 
-    report_is_ready = search_in_reports(report_dir_path, log_date)
-    if report_is_ready:
-        sys.exit(f'Do not find an unprocessed log file in {report_dir_path}')
+    Table files contain all URLs, so statistics of all URLs are calculated
+    if table formats are set. The HTML report is limited by REPORT_SIZE
+    anyway.
 
-    logging.info(f'Find the log to process {newest_log_path}')
-    _, log_ext = os.path.splitext(newest_log_path)
-    log_properties = LogProperties(newest_log_path, log_date, log_ext)
+    :param configuration: the script configuration;
+    :return: a number of URLs. None if statistics for all URLs are needed.
+    """
+    if configuration['REPORT_TABLE_FORMATS']:
+        return None
+    return configuration['REPORT_SIZE']
+
+
+def get_reading_options(
+        configuration: Mapping[str, Any]
+) -> Mapping[str, Any]:
+    """
+    Return keyword arguments of calculations.get_log_aggregates.
+
+    :param configuration: the script configuration;
+    :return: a dict of log reading options.
+    """
+    return {
+        'worker_number': configuration['WORKER_NUMBER'],
+        'chunk_size': configuration['CHUNK_SIZE'],
+        'parser_name': configuration['LOG_PARSER'],
+        'use_mmap': configuration['USE_MMAP'],
+        'use_gzip_pipeline': configuration['GZIP_PIPELINE'],
+        'use_external_gzip': configuration['EXTERNAL_GZIP'],
+        'url_rules': get_url_rules(configuration),
+        'max_url_number': configuration['MAX_URL_NUMBER'],
+        'log_format': configuration['LOG_FORMAT'],
+        'dimensions': configuration['REPORT_DIMENSIONS'],
+        'use_numpy': configuration['NUMPY_AGGREGATION'],
+    }
+
+
+def get_source_options(
+        configuration: Mapping[str, Any]
+) -> Mapping[str, Any]:
+    """
+    Return keyword arguments of calculations.get_source_aggregates.
+
+    :param configuration: the script configuration;
+    :return: a dict of options of concurrent reading of source logs.
+    """
+    return {
+        'source_concurrency': configuration['SOURCE_CONCURRENCY'],
+        'source_queue_size': configuration['SOURCE_QUEUE_SIZE'],
+        'url_rules': get_url_rules(configuration),
+        'max_url_number': configuration['MAX_URL_NUMBER'],
+        'parser_name': configuration['LOG_PARSER'],
+        'use_mmap': configuration['USE_MMAP'],
+        'use_gzip_pipeline': configuration['GZIP_PIPELINE'],
+        'use_external_gzip': configuration['EXTERNAL_GZIP'],
+        'log_format': configuration['LOG_FORMAT'],
+        'dimensions': configuration['REPORT_DIMENSIONS'],
+    }
+
+
+def process_log(
+        log_path: str,
+        log_date: date,
+        configuration: Mapping[str, Any]
+) -> Union[str, None]:
+    """
+    Calculate statistics of a log and render its report.
+
+    If MULTI_SOURCE_LOGS is set, logs of all sources of the date are read
+    concurrently into one report. They are not saved to the daily cache.
+    If REPORT_INDEX is set, the report and its logs are added to the report
+    index after rendering.
+
+    :param log_path: a path of log file;
+    :param log_date: a log date;
+    :param configuration: the script configuration;
+    :return: an error message. None if the report is rendered.
+    """
+    started_at = time.perf_counter()
+    _, log_ext = os.path.splitext(log_path)
+    log_properties = LogProperties(log_path, log_date, log_ext)
+
+    report_dir_path = configuration['REPORT_DIR']
+    aggregates_cache_path = None
+    if configuration['AGGREGATE_CACHE']:
+        aggregates_cache_path = get_cache_path(report_dir_path, log_date)
+    timeline_path = None
+    if configuration['REPORT_DIMENSIONS']:
+        timeline_path = os.path.join(
+            report_dir_path,
+            TIMELINE_NAME_TEMPLATE.format(str(log_date).replace('-', '.'))
+        )
+
+    if configuration['MULTI_SOURCE_LOGS']:
+        source_log_paths = get_source_log_paths(
+            configuration['LOG_DIR'],
+            log_date,
+            configuration['LOG_NAME_PREFIX']
+        )
+        statistics = get_source_statistics(
+            source_log_paths,
+            PARSE_ERROR_THRESHOLD,
+            get_statistics_size(configuration),
+            configuration['REPORT_SORT_KEY'],
+            timeline_path,
+            **get_source_options(configuration)
+        )
+        if statistics is None:
+            return f'Can not parse the log files {source_log_paths}.'
+        report_path = render_report(
+            statistics,
+            report_dir_path,
+            log_date,
+            configuration['REPORT_SIZE'],
+            compress_report=configuration['REPORT_GZIP'],
+            table_formats=configuration['REPORT_TABLE_FORMATS'],
+        )
+        if configuration['REPORT_INDEX']:
+            record_report(
+                *get_index_arguments(configuration),
+                source_log_paths,
+                log_date,
+                report_path,
+                time.perf_counter() - started_at
+            )
+        return None
 
     statistics = get_statistics(
         log_properties.log_path,
         log_properties.file_extension,
         PARSE_ERROR_THRESHOLD,
+        aggregates_cache_path,
+        get_statistics_size(configuration),
+        configuration['REPORT_SORT_KEY'],
+        configuration['PREFLIGHT_SAMPLE'],
+        timeline_path,
+        **get_reading_options(configuration)
     )
     if statistics is None:
-        sys.exit(f'Can not parse the log file {log_properties.log_path}.')
+        return f'Can not parse the log file {log_properties.log_path}.'
 
-    statistics.sort(key=lambda x: x['time_sum'], reverse=True)
+    report_path = render_report(
+        statistics,
+        report_dir_path,
+        log_properties.log_date,
+        configuration['REPORT_SIZE'],
+        compress_report=configuration['REPORT_GZIP'],
+        table_formats=configuration['REPORT_TABLE_FORMATS'],
+    )
+    if aggregates_cache_path:
+        evict_daily_aggregates(
+            report_dir_path,
+            configuration['AGGREGATE_CACHE_SIZE']
+        )
+    if configuration['REPORT_INDEX']:
+        record_report(
+            *get_index_arguments(configuration),
+            [log_path],
+            log_date,
+            report_path,
+            time.perf_counter() - started_at
+        )
+    return None
+
+
+def get_sample_options(
+        configuration: Mapping[str, Any],
+        rate: float
+) -> SampleOptions:
+    """
+    Return sampling options set in the configuration.
+
+    :param configuration: the script configuration;
+    :param rate: a share of requests, URLs or log bytes to sample;
+    :return: sampling options.
+    """
+    return SampleOptions(
+        rate,
+        configuration['SAMPLE_MODE'],
+        configuration['SAMPLE_BLOCK_SIZE']
+    )
+
+
+def process_log_sample(
+        log_path: str,
+        log_date: date,
+        configuration: Mapping[str, Any],
+        sample_options: SampleOptions
+) -> Union[str, None]:
+    """
+    Calculate approximate statistics of a log sample and render its report.
+
+    The report has its own name, so the log is still processed by the next
+    run. It is not added to the report index, and sampled aggregates are
+    not cached.
+
+    :param log_path: a path of log file;
+    :param log_date: a log date;
+    :param configuration: the script configuration;
+    :param sample_options: a sampling rate, a mode and a block size;
+    :return: an error message. None if the report is rendered.
+    """
+    _, log_ext = os.path.splitext(log_path)
+    # A sample is not split into chunks.
+    reading_options = {
+        option_name: value
+        for option_name, value in get_reading_options(configuration).items()
+        if option_name != 'chunk_size'
+    }
+    sample_result = get_sample_statistics(
+        log_path,
+        log_ext,
+        PARSE_ERROR_THRESHOLD,
+        sample_options,
+        get_statistics_size(configuration),
+        configuration['REPORT_SORT_KEY'],
+        **reading_options
+    )
+    if sample_result is None:
+        return f'Can not parse the log file {log_path}.'
+    statistics, sample_summary = sample_result
+    report_note = get_sample_note(sample_summary)
+    logging.info(report_note)
     render_report(
         statistics,
         configuration['REPORT_DIR'],
-        log_properties.log_date,
+        log_date,
         configuration['REPORT_SIZE'],
+        SAMPLE_REPORT_NAME_TEMPLATE.format(str(log_date).replace('-', '.')),
+        configuration['REPORT_GZIP'],
+        configuration['REPORT_TABLE_FORMATS'],
+        report_note
+    )
+    return None
+
+
+def process_log_safely(
+        log_path: str,
+        log_date: date,
+        configuration: Mapping[str, Any]
+) -> Union[str, None]:
+    """
+    Process a log in a batch worker and return an error message.
+
+    :param log_path: a path of log file;
+    :param log_date: a log date;
+    :param configuration: the script configuration;
+    :return: an error message. None if the report is rendered.
+    """
+    try:
+        return process_log(log_path, log_date, configuration)
+    except Exception as error:
+        logging.exception(f'Can not process the log {log_path}')
+        return f'Can not process the log {log_path}: {error}'
+
+
+def process_log_in_worker(
+        log_path: str,
+        log_date: date,
+        configuration: Mapping[str, Any],
+        collect_metrics: bool
+) -> Tuple[Union[str, None], Mapping[str, Any]]:
+    """
+    Process a log in a batch worker and return metrics collected by it.
+
+    Metrics of a worker process are not exported by the worker, so they
+    are returned to the parent process with the result.
+
+    :param log_path: a path of log file;
+    :param log_date: a log date;
+    :param configuration: the script configuration;
+    :param collect_metrics: True if metrics of the run are collected;
+    :return: an error message or None and metrics collected by the worker.
+    """
+    reset_metrics(collect_metrics)
+    error_message = process_log_safely(log_path, log_date, configuration)
+    return error_message, get_collected_metrics()
+
+
+def process_unprocessed_logs(configuration: Mapping[str, Any]):
+    """
+    Process all logs without reports in a process pool.
+
+    A failure of one log does not stop processing of others.
+
+    :param configuration: the script configuration.
+    """
+    log_dir_path = configuration['LOG_DIR']
+    report_dir_path = configuration['REPORT_DIR']
+    if configuration['REPORT_INDEX']:
+        index_arguments = get_index_arguments(configuration)
+        unprocessed_logs = get_unindexed_logs(
+            read_report_index(*index_arguments),
+            *index_arguments
+        )
+    else:
+        unprocessed_logs = get_unprocessed_logs(
+            log_dir_path,
+            report_dir_path,
+            configuration['LOG_NAME_PREFIX'],
+            configuration['MULTI_SOURCE_LOGS']
+        )
+    if not unprocessed_logs:
+        sys.exit(f'Do not find an unprocessed log file in {log_dir_path}')
+
+    log_number = len(unprocessed_logs)
+    worker_number = configuration['BATCH_WORKER_NUMBER']
+    logging.info(
+        f'Find {log_number} unprocessed logs, '
+        f'process them in {worker_number} processes.'
+    )
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    file_configuration = {**configuration, 'WORKER_NUMBER': 1}
+    failed_logs = []
+    with ProcessPoolExecutor(max_workers=worker_number) as executor:
+        futures = {
+            executor.submit(
+                process_log_in_worker,
+                log_path,
+                log_date,
+                file_configuration,
+                metrics_enabled()
+            ): log_path
+            for log_path, log_date in unprocessed_logs
+        }
+        for processed_number, future in enumerate(
+                as_completed(futures),
+                start=1
+        ):
+            log_path = futures[future]
+            error_message, worker_metrics = future.result()
+            merge_metrics(worker_metrics)
+            if error_message:
+                failed_logs.append(log_path)
+                logging.error(
+                    f'[{processed_number}/{log_number}] {error_message}'
+                )
+            else:
+                logging.info(
+                    f'[{processed_number}/{log_number}] Processed {log_path}'
+                )
+
+    if failed_logs:
+        sys.exit(
+            f'Can not process {len(failed_logs)} of {log_number} logs: '
+            f'{", ".join(failed_logs)}'
+        )
+
+
+def process_rollup(
+        configuration: Mapping[str, Any],
+        start_date: date,
+        end_date: date
+):
+    """
+    Render a report merging per-day aggregates of a date range.
+
+    Aggregates are taken from the daily cache. A day without valid cached
+    aggregates is parsed from its log and cached. Logs of several sources
+    of a day are read concurrently and are not cached. A day with too many
+    parsing errors is skipped.
+
+    :param configuration: the script configuration;
+    :param start_date: the first day of the range;
+    :param end_date: the last day of the range.
+    """
+    report_dir_path = configuration['REPORT_DIR']
+    log_paths = {}
+    for log_path, log_date in iter_log_files(
+            configuration['LOG_DIR'],
+            configuration['LOG_NAME_PREFIX'],
+            configuration['MULTI_SOURCE_LOGS']
+    ):
+        if start_date <= log_date <= end_date:
+            log_paths.setdefault(log_date, []).append(log_path)
+    aggregates = AggregateStore(configuration['MAX_URL_NUMBER'])
+    url_rules_digest = get_url_rules_digest(get_url_rules(configuration))
+    day_number = (end_date - start_date).days + 1
+    for day_index in range(day_number):
+        log_date = start_date + timedelta(days=day_index)
+        cache_path = get_cache_path(report_dir_path, log_date)
+        with measure_stage('cache_load'):
+            day_aggregates = load_daily_aggregates(
+                cache_path,
+                url_rules_digest
+            )
+        day_log_paths = remove_packed_copies(log_paths.get(log_date, []))
+        if day_aggregates is None and len(day_log_paths) > 1:
+            logging.info(f'Parse {len(day_log_paths)} logs of {log_date}')
+            day_aggregates = get_source_aggregates(
+                day_log_paths,
+                **get_source_options(configuration)
+            )
+        elif day_aggregates is None and day_log_paths:
+            log_path, = day_log_paths
+            logging.info(f'Parse {log_path} to cache its aggregates')
+            _, log_ext = os.path.splitext(log_path)
+            day_aggregates = get_log_aggregates(
+                log_path,
+                log_ext,
+                **get_reading_options(configuration)
+            )
+            if not is_error_ratio_exceeded(
+                    day_aggregates,
+                    PARSE_ERROR_THRESHOLD
+            ):
+                save_daily_aggregates(
+                    cache_path,
+                    log_path,
+                    day_aggregates,
+                    url_rules_digest
+                )
+        if day_aggregates is None:
+            logging.warning(f'Do not find aggregates or a log of {log_date}')
+            continue
+        if is_error_ratio_exceeded(day_aggregates, PARSE_ERROR_THRESHOLD):
+            logging.warning(
+                f'Skip logs of {log_date}: too many parsing errors'
+            )
+            continue
+        aggregates.merge(day_aggregates)
+
+    if not aggregates.total_request_number:
+        sys.exit(f'Do not find logs from {start_date} to {end_date}')
+
+    statistics = get_checked_report_list(
+        aggregates,
+        f'logs from {start_date} to {end_date}',
+        PARSE_ERROR_THRESHOLD,
+        get_statistics_size(configuration),
+        configuration['REPORT_SORT_KEY'],
+    )
+    if statistics is None:
+        sys.exit(f'Can not parse logs from {start_date} to {end_date}.')
+
+    report_file_name = ROLLUP_REPORT_NAME_TEMPLATE.format(
+        str(start_date).replace("-", "."),
+        str(end_date).replace("-", ".")
+    )
+    render_report(
+        statistics,
+        report_dir_path,
+        None,
+        configuration['REPORT_SIZE'],
+        report_file_name,
+        configuration['REPORT_GZIP'],
+        configuration['REPORT_TABLE_FORMATS'],
+    )
+    evict_daily_aggregates(
+        report_dir_path,
+        configuration['AGGREGATE_CACHE_SIZE']
+    )
+
+
+def process_live_log(configuration: Mapping[str, Any]):
+    """
+    Parse new lines of the live log and render the live report.
+
+    :param configuration: the script configuration.
+    """
+    live_log_path = os.path.join(
+        configuration['LOG_DIR'],
+        configuration['LIVE_LOG_NAME']
+    )
+    if not os.path.isfile(live_log_path):
+        sys.exit(f'Do not find the live log {live_log_path}')
+
+    checkpoint_path = os.path.join(
+        configuration['REPORT_DIR'],
+        CHECKPOINT_NAME_TEMPLATE.format(configuration['LIVE_LOG_NAME'])
+    )
+    statistics = get_incremental_statistics(
+        live_log_path,
+        checkpoint_path,
+        PARSE_ERROR_THRESHOLD,
+        configuration['LOG_PARSER'],
+        configuration['USE_MMAP'],
+        get_statistics_size(configuration),
+        configuration['REPORT_SORT_KEY'],
+        get_url_rules(configuration),
+        configuration['MAX_URL_NUMBER'],
+        configuration['LOG_FORMAT'],
+    )
+    if statistics is None:
+        sys.exit(f'Can not parse the log file {live_log_path}.')
+    if not statistics:
+        return
+
+    render_report(
+        statistics,
+        configuration['REPORT_DIR'],
+        None,
+        configuration['REPORT_SIZE'],
+        LIVE_REPORT_NAME,
+        configuration['REPORT_GZIP'],
+        configuration['REPORT_TABLE_FORMATS'],
+    )
+
+
+def rebuild_report_index(configuration: Mapping[str, Any]):
+    """
+    Replace the report index by an index built from directory listings.
+
+    :param configuration: the script configuration.
+    """
+    with update_report_index(
+            *get_index_arguments(configuration),
+            rebuild=True
+    ) as report_index:
+        logging.info(
+            f'Rebuilt the report index: {len(report_index["reports"])} '
+            f'reports, {len(report_index["logs"])} logs'
+        )
+
+
+def run_with_profiler(profile_path: str, function, *args):
+    """
+    Run a function under cProfile and tracemalloc.
+
+    cProfile stats are saved to profile_path. Top functions by cumulative
+    time and top memory allocations are saved to a text file next to it.
+
+    :param profile_path: a path to save cProfile stats;
+    :param function: a function to run;
+    :param args: function arguments.
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        profiler.runcall(function, *args)
+    finally:
+        memory_snapshot = tracemalloc.take_snapshot()
+        _, traced_peak_size = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        set_gauge('traced_peak_bytes', traced_peak_size)
+        profiler.dump_stats(profile_path)
+
+        with open(f'{profile_path}.txt', 'w') as summary_file:
+            profile_stats = pstats.Stats(profiler, stream=summary_file)
+            profile_stats.sort_stats('cumulative')
+            profile_stats.print_stats(PROFILE_TOP_SIZE)
+            summary_file.write('Top memory allocations:\n')
+            top_allocations = memory_snapshot.statistics('lineno')
+            for allocation in top_allocations[:PROFILE_TOP_SIZE]:
+                summary_file.write(f'{allocation}\n')
+        logging.info(f'Saved the profile {profile_path}')
+
+
+def is_single_run(
+        configuration: Mapping[str, Any],
+        console_arguments: argparse.Namespace
+) -> bool:
+    """
+    Return True if the script should process only the newest log.
+
+    :param configuration: the script configuration;
+    :param console_arguments: the script arguments.
+    """
+    return not (
+        configuration['INCREMENTAL']
+        or console_arguments.rebuild_index
+        or console_arguments.rollup
+        or console_arguments.batch
+        or console_arguments.daemon
+    )
+
+
+def get_newest_unprocessed_log(
+        configuration: Mapping[str, Any]
+) -> Tuple[str, date]:
+    """
+    Return the newest log and its date or exit if it has a report already.
+
+    It needs only directory listings, so a run without new logs exits
+    before the logger, the report directory and metrics are set up.
+    If REPORT_INDEX is set, the log directory is listed only if it changed
+    since the last listing and reports are looked up in the index.
+
+    :param configuration: the script configuration;
+    :return: a log path and a log date.
+    """
+    log_dir_path = configuration['LOG_DIR']
+    report_dir_path = configuration['REPORT_DIR']
+    if configuration['REPORT_INDEX']:
+        index_arguments = get_index_arguments(configuration)
+        report_index = read_report_index(*index_arguments)
+        newest_log_path, log_date = find_newest_log(
+            report_index,
+            *index_arguments
+        )
+    else:
+        newest_log_path, log_date = get_new_log_path_and_date(
+            log_dir_path,
+            configuration['LOG_NAME_PREFIX'],
+            configuration['MULTI_SOURCE_LOGS']
+        )
+    if not newest_log_path:
+        sys.exit(f'Do not find a log file in {log_dir_path}')
+
+    if configuration['REPORT_INDEX']:
+        report_is_ready = is_report_indexed(report_index, log_date)
+    else:
+        report_is_ready = search_in_reports(report_dir_path, log_date)
+    if report_is_ready:
+        sys.exit(f'Do not find an unprocessed log file in {report_dir_path}')
+    return newest_log_path, log_date
+
+
+def process_logs(
+        configuration: Mapping[str, Any],
+        console_arguments: argparse.Namespace,
+        newest_log: Union[Tuple[str, date], None] = None
+):
+    """
+    Process logs in the mode selected by the configuration and arguments.
+
+    :param configuration: the script configuration;
+    :param console_arguments: the script arguments;
+    :param newest_log: the newest unprocessed log path and date if they are
+    already found. None if the log should be searched in a single run.
+    """
+    if console_arguments.rebuild_index:
+        rebuild_report_index(configuration)
+        return
+
+    if configuration['INCREMENTAL']:
+        process_live_log(configuration)
+        return
+
+    if console_arguments.rollup:
+        process_rollup(configuration, *console_arguments.rollup)
+        return
+
+    if console_arguments.batch:
+        process_unprocessed_logs(configuration)
+        return
+
+    if console_arguments.daemon:
+        from daemon import run_daemon
+
+        run_daemon(configuration, process_log_safely)
+        return
+
+    if newest_log is None:
+        newest_log = get_newest_unprocessed_log(configuration)
+    newest_log_path, log_date = newest_log
+    logging.info(f'Find the log to process {newest_log_path}')
+    if console_arguments.sample is None:
+        error_message = process_log(newest_log_path, log_date, configuration)
+    else:
+        error_message = process_log_sample(
+            newest_log_path,
+            log_date,
+            configuration,
+            get_sample_options(configuration, console_arguments.sample)
+        )
+    if error_message:
+        sys.exit(error_message)
+
+
+def main():
+    console_arguments = get_console_arguments()
+    config_file_path = console_arguments.config
+    configuration = get_configuration(config_file_path, default_config)
+    if not configuration:
+        sys.exit(f'Invalid configuration file {config_file_path}')
+
+    if console_arguments.sample is not None:
+        if not is_single_run(configuration, console_arguments):
+            sys.exit('A sample can be taken only of the newest log')
+        if configuration['MULTI_SOURCE_LOGS']:
+            sys.exit('Logs of several sources can not be sampled')
+        if not 0 < console_arguments.sample <= 1:
+            sys.exit('A sampling rate should be in the range (0, 1]')
+        if console_arguments.sample_mode:
+            configuration['SAMPLE_MODE'] = console_arguments.sample_mode
+        if configuration['SAMPLE_MODE'] not in SAMPLE_MODES:
+            sys.exit(
+                f'Invalid sampling mode {configuration["SAMPLE_MODE"]}. '
+                f'Valid modes: {", ".join(SAMPLE_MODES)}'
+            )
+
+    newest_log = None
+    if is_single_run(configuration, console_arguments):
+        newest_log = get_newest_unprocessed_log(configuration)
+
+    configure_logger(configuration.get('SCRIPT_LOG_PATH'))
+
+    sort_key = configuration['REPORT_SORT_KEY']
+    if sort_key not in REPORT_SORT_KEYS:
+        sys.exit(
+            f'Invalid report sort key {sort_key}. '
+            f'Valid keys: {", ".join(REPORT_SORT_KEYS)}'
+        )
+    for table_format in configuration['REPORT_TABLE_FORMATS']:
+        if table_format not in TABLE_FORMATS:
+            sys.exit(
+                f'Invalid report table format {table_format}. '
+                f'Valid formats: {", ".join(TABLE_FORMATS)}'
+            )
+    try:
+        check_custom_rules(configuration['URL_RULES'])
+    except ValueError as error:
+        sys.exit(f'Invalid URL rule {error}')
+    if configuration['LOG_FORMAT']:
+        try:
+            compile_span_parser(configuration['LOG_FORMAT'])
+        except ValueError as error:
+            sys.exit(f'Invalid log format: {error}')
+    if configuration['NUMPY_AGGREGATION'] and not numpy_available():
+        logging.warning('NumPy is not installed, aggregate requests in Python')
+        configuration['NUMPY_AGGREGATION'] = False
+
+    report_dir_path = configuration['REPORT_DIR']
+    if not os.path.isdir(report_dir_path):
+        logging.debug(f'Create the directory {report_dir_path}')
+        try:
+            os.mkdir(report_dir_path)
+        except OSError:
+            sys.exit(f'Can not create the report directory {report_dir_path}')
+
+    metrics_requested = (
+        console_arguments.profile
+        or configuration['METRICS_JSON_PATH']
+        or configuration['METRICS_PROMETHEUS_PATH']
     )
+    if metrics_requested:
+        enable_metrics()
+    try:
+        with measure_stage('total'):
+            if console_arguments.profile:
+                run_with_profiler(
+                    console_arguments.profile,
+                    process_logs,
+                    configuration,
+                    console_arguments,
+                    newest_log
+                )
+            else:
+                process_logs(configuration, console_arguments, newest_log)
+    finally:
+        if metrics_enabled():
+            write_metrics(
+                configuration['METRICS_JSON_PATH'],
+                configuration['METRICS_PROMETHEUS_PATH']
+            )
 
 
 if __name__ == '__main__':
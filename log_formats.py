@@ -0,0 +1,337 @@
+"""Log line parsers compiled from nginx log_format strings."""
+
+from functools import lru_cache
+import mmap
+import re
+from typing import Callable, List, Sequence, Tuple, Union
+
+from constants import DEFAULT_LOG_FORMAT, MINUTES_PER_DAY
+from log_processing import PROTOCOL_PREFIX, SpanParser
+
+LOG_FORMATS = {
+    'ui_short': (
+        '$remote_addr $remote_user  $http_x_real_ip [$time_local] '
+        '"$request" $status $body_bytes_sent "$http_referer" '
+        '"$http_user_agent" "$http_x_forwarded_for" "$http_X_REQUEST_ID" '
+        '"$http_X_RB_USER" $request_time'
+    ),
+    'combined_time': (
+        '$remote_addr - $remote_user [$time_local] "$request" $status '
+        '$body_bytes_sent "$http_referer" "$http_user_agent" $request_time'
+    ),
+}
+VARIABLE_PATTERN = re.compile(r'\$(?:(\w+)|\{(\w+)\})')
+URL_VARIABLES = ('request', 'request_uri', 'uri')
+# Offsets of an hour and a minute in values of time variables:
+# 29/Jun/2017:03:50:23 +0300 and 2017-06-29T03:50:23+03:00.
+TIME_FIELD_OFFSETS = {
+    'time_local': (12, 15),
+    'time_iso8601': (11, 14),
+}
+INVALID_DIMENSION_NOTE = (None, None, None, None, None)
+
+Buffer = Union[bytes, mmap.mmap]
+FieldSpans = Union[List[Tuple[int, int]], None]
+
+
+def resolve_log_format(log_format: str) -> str:
+    """
+    Return a log_format string by a registered format name.
+
+    :param log_format: a name in LOG_FORMATS or a log_format string;
+    :return: a log_format string.
+    """
+    return LOG_FORMATS.get(log_format, log_format)
+
+
+def split_log_format(log_format: str) -> Tuple[List[bytes], List[str]]:
+    """
+    Split a log_format string into literals and variable names.
+
+    A literal i precedes a variable i, the last literal follows the last
+    variable, so there is one literal more than variables.
+
+    :param log_format: an nginx log_format string;
+    :return: literals and variable names.
+    """
+    literals, variable_names = [], []
+    position = 0
+    for match in VARIABLE_PATTERN.finditer(log_format):
+        literals.append(log_format[position:match.start()].encode('utf_8'))
+        variable_names.append(match.group(1) or match.group(2))
+        position = match.end()
+    literals.append(log_format[position:].encode('utf_8'))
+    return literals, variable_names
+
+
+def compile_field_extractor(
+        log_format: str,
+        field_names: Sequence[str]
+) -> Callable[[Buffer, int, int], FieldSpans]:
+    """
+    Return a function which finds fields of a log line.
+
+    A field is found by searching literals around it: fields in the first
+    half of the format are found from the line start, others from the line
+    end. So the cost depends on the number of fields passed on the way to
+    the needed ones, not on the line length or the total field number.
+
+    :param log_format: an nginx log_format string;
+    :param field_names: names of variables to extract without '$';
+    :return: a function (buffer, line_start, line_end) returning a list of
+    field spans (start, end) in the order of field_names. It returns None
+    if the line does not match the format.
+    """
+    literals, variable_names = split_log_format(log_format)
+    variable_number = len(variable_names)
+    field_indexes = []
+    for field_name in field_names:
+        if field_name not in variable_names:
+            raise ValueError(f'Log format has no variable ${field_name}')
+        field_indexes.append(variable_names.index(field_name))
+
+    forward_indexes = [i for i in field_indexes if 2 * i < variable_number]
+    backward_indexes = [i for i in field_indexes if 2 * i >= variable_number]
+    forward_end = max(forward_indexes, default=-1)
+    backward_start = min(backward_indexes, default=variable_number)
+    separator_indexes = [
+        *range(1, min(forward_end + 2, variable_number)),
+        *range(max(backward_start, 1), variable_number),
+    ]
+    if not all(literals[i] for i in separator_indexes):
+        raise ValueError(f'Variables of {log_format!r} are not separated')
+
+    # None means that a field ends at the line end or begins at its start.
+    forward_literals = [
+        literal or None for literal in literals[1:forward_end + 2]
+    ]
+    backward_literals = [
+        literal or None
+        for literal in reversed(literals[backward_start:variable_number])
+    ]
+    first_literal_size = len(literals[0])
+    last_literal_size = len(literals[-1])
+    field_positions = [
+        (True, i) if i <= forward_end else (False, variable_number - 1 - i)
+        for i in field_indexes
+    ]
+
+    def extract_fields(
+            buffer: Buffer,
+            line_start: int,
+            line_end: int
+    ) -> FieldSpans:
+        forward_spans = []
+        field_start = line_start + first_literal_size
+        for literal in forward_literals:
+            if literal is None:
+                forward_spans.append((field_start, line_end))
+                break
+            field_end = buffer.find(literal, field_start, line_end)
+            if field_end < 0:
+                return None
+            forward_spans.append((field_start, field_end))
+            field_start = field_end + len(literal)
+
+        backward_spans = []
+        field_end = line_end - last_literal_size
+        for literal in backward_literals:
+            if literal is None:
+                backward_spans.append((line_start, field_end))
+                break
+            literal_start = buffer.rfind(literal, line_start, field_end)
+            if literal_start < 0:
+                return None
+            backward_spans.append((literal_start + len(literal), field_end))
+            field_end = literal_start
+
+        return [
+            forward_spans[position] if forward else backward_spans[position]
+            for forward, position in field_positions
+        ]
+
+    return extract_fields
+
+
+def get_url_variable(variable_names: Sequence[str]) -> str:
+    """
+    Return a name of a variable containing a URL.
+
+    :param variable_names: variable names of a log format;
+    :return: a name from URL_VARIABLES.
+    """
+    return next(
+        (name for name in URL_VARIABLES if name in variable_names),
+        URL_VARIABLES[0]
+    )
+
+
+def find_request_url(
+        buffer: Buffer,
+        request_start: int,
+        request_end: int
+) -> Union[Tuple[int, int], None]:
+    """
+    Return a URL span of a $request field "METHOD URL PROTOCOL".
+
+    :param buffer: bytes or a memory-mapped file;
+    :param request_start: an offset of the field;
+    :param request_end: an offset after the field;
+    :return: a URL span (start, end). None if the request is invalid.
+    """
+    protocol_start = buffer.rfind(b' ', request_start, request_end)
+    protocol_prefix_end = protocol_start + len(PROTOCOL_PREFIX)
+    if buffer[protocol_start:protocol_prefix_end] != PROTOCOL_PREFIX:
+        return None
+    url_start = buffer.rfind(b' ', request_start, protocol_start) + 1
+    if not url_start or url_start == protocol_start:
+        return None
+    return url_start, protocol_start
+
+
+@lru_cache(maxsize=None)
+def compile_span_parser(log_format: str) -> SpanParser:
+    """
+    Return a parser of url and request time for a log format.
+
+    The url is taken from $request, $request_uri or $uri. A parser is
+    compiled once per process and format.
+
+    :param log_format: a name in LOG_FORMATS or a log_format string;
+    :return: a function with the signature of log_processing.parse_log_span.
+    """
+    log_format = resolve_log_format(log_format)
+    _, variable_names = split_log_format(log_format)
+    url_variable = get_url_variable(variable_names)
+    extract_fields = compile_field_extractor(
+        log_format,
+        (url_variable, 'request_time')
+    )
+    url_in_request = url_variable == 'request'
+
+    def parse_span(
+            buffer: Buffer,
+            line_start: int,
+            line_end: int
+    ) -> Tuple[str, float] or Tuple[None, None]:
+        if buffer[line_end - 1:line_end] == b'\n':
+            line_end -= 1
+        field_spans = extract_fields(buffer, line_start, line_end)
+        if field_spans is None:
+            return None, None
+        (url_start, url_end), (time_start, time_end) = field_spans
+
+        if url_in_request:
+            url_span = find_request_url(buffer, url_start, url_end)
+            if url_span is None:
+                return None, None
+            url_start, url_end = url_span
+        elif url_start == url_end:
+            return None, None
+
+        try:
+            req_time = float(buffer[time_start:time_end])
+        except ValueError:
+            return None, None
+
+        url = buffer[url_start:url_end].decode('utf_8', errors='ignore')
+        return url, req_time
+
+    return parse_span
+
+
+@lru_cache(maxsize=None)
+def compile_dimension_parser(log_format: str) -> SpanParser:
+    """
+    Return a parser of url, request time, status, body bytes and minute.
+
+    A minute of day is taken from $time_local or $time_iso8601 by fixed
+    offsets of the hour and the minute, the time is not parsed as a date.
+
+    :param log_format: a name in LOG_FORMATS or a log_format string;
+    :return: a function (buffer, line_start, line_end) returning a tuple
+    (url, request_time, status, body_bytes, minute). All items are None if
+    the line is invalid.
+    """
+    log_format = resolve_log_format(log_format)
+    _, variable_names = split_log_format(log_format)
+    url_variable = get_url_variable(variable_names)
+    time_variable = next(
+        (name for name in TIME_FIELD_OFFSETS if name in variable_names),
+        None
+    )
+    if time_variable is None:
+        raise ValueError('Log format has no variable $time_local')
+    hour_offset, minute_offset = TIME_FIELD_OFFSETS[time_variable]
+    extract_fields = compile_field_extractor(
+        log_format,
+        (url_variable, 'request_time', 'status', 'body_bytes_sent',
+         time_variable)
+    )
+    url_in_request = url_variable == 'request'
+
+    def parse_span(
+            buffer: Buffer,
+            line_start: int,
+            line_end: int
+    ) -> Tuple[Union[str, None], ...]:
+        if buffer[line_end - 1:line_end] == b'\n':
+            line_end -= 1
+        field_spans = extract_fields(buffer, line_start, line_end)
+        if field_spans is None:
+            return INVALID_DIMENSION_NOTE
+        (
+            (url_start, url_end),
+            (time_start, time_end),
+            (status_start, status_end),
+            (bytes_start, bytes_end),
+            (local_time_start, _),
+        ) = field_spans
+
+        if url_in_request:
+            url_span = find_request_url(buffer, url_start, url_end)
+            if url_span is None:
+                return INVALID_DIMENSION_NOTE
+            url_start, url_end = url_span
+        elif url_start == url_end:
+            return INVALID_DIMENSION_NOTE
+
+        hour_start = local_time_start + hour_offset
+        minute_start = local_time_start + minute_offset
+        try:
+            req_time = float(buffer[time_start:time_end])
+            status = int(buffer[status_start:status_end])
+            body_bytes = int(buffer[bytes_start:bytes_end])
+            minute = (
+                int(buffer[hour_start:hour_start + 2]) * 60
+                + int(buffer[minute_start:minute_start + 2])
+            )
+        except ValueError:
+            return INVALID_DIMENSION_NOTE
+        if not 0 <= minute < MINUTES_PER_DAY or body_bytes < 0:
+            return INVALID_DIMENSION_NOTE
+
+        url = buffer[url_start:url_end].decode('utf_8', errors='ignore')
+        return url, req_time, status, body_bytes, minute
+
+    return parse_span
+
+
+def get_span_parser(
+        log_format: Union[str, None],
+        dimensions: bool = False
+) -> Union[SpanParser, None]:
+    """
+    Return a compiled parser of a log format or None if it is not needed.
+
+    :param log_format: a name in LOG_FORMATS, a log_format string or None;
+    :param dimensions: True if the parser should also return a status,
+    body bytes and a minute of day. DEFAULT_LOG_FORMAT is used if a log
+    format is not set;
+    :return: a span parser or None.
+    """
+    if dimensions:
+        return compile_dimension_parser(log_format or DEFAULT_LOG_FORMAT)
+    if not log_format:
+        return None
+    return compile_span_parser(log_format)
@@ -1,50 +1,241 @@
 """Functions to find and process a log file."""
 
 from datetime import datetime, date
+from functools import lru_cache
 import gzip
 import logging
+import mmap
 import os.path
+import random
 import re
-from typing import Generator, Tuple
+from typing import Callable, Generator, Iterable, List, Set, Tuple, Union
 
+from constants import DEFAULT_LOG_NAME_PREFIX, DEFAULT_LOG_PARSER
 from constants import REPORT_NAME_TEMPLATE
+from metrics import measure_stage
+
+PROTOCOL_PREFIX = b' HTTP/1.'
+MMAP_RELEASE_SIZE = 64 * 1024 * 1024
+MAX_LOGGED_PARSE_ERRORS = 10
+MAX_LOGGED_LINE_LENGTH = 300
+URL_PATTERN = re.compile(r'(?<=\s)(\S+)(?= HTTP/1.)')
+REQUEST_TIME_PATTERN = re.compile(r'\S+$')
+
+parse_error_log = {'error_number': 0}
+
+
+@lru_cache(maxsize=None)
+def get_log_name_pattern(
+        log_name_prefix: str,
+        multi_source: bool = False
+) -> re.Pattern:
+    """
+    Return a pattern of a log date in names of log files.
+
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if names of same-day logs of several sources
+    end with a source name: <prefix>YYYYMMDD-<source>[.gz];
+    :return: a compiled regular expression.
+    """
+    suffix_pattern = r'(?:-[\w.]+?)?' if multi_source else ''
+    return re.compile(
+        rf'(?<=^{re.escape(log_name_prefix)})\d{{8}}'
+        rf'(?={suffix_pattern}(?:\.gz)?$)'
+    )
+
+
+def iter_log_files(
+        directory_path: str,
+        log_name_prefix: str = DEFAULT_LOG_NAME_PREFIX,
+        multi_source: bool = False
+) -> Generator[Tuple[str, date], None, None]:
+    """
+    Yield paths and dates of log files in a directory.
+
+    The directory is listed by a single os.scandir pass, entry types are
+    taken from directory entries without extra stat calls on most systems.
+
+    :param directory_path: a directory containing log files;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if names of same-day logs of several sources
+    end with a source name: <prefix>YYYYMMDD-<source>[.gz];
+    :return: log path and log date.
+    """
+    log_name_pattern = get_log_name_pattern(log_name_prefix, multi_source)
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            log_date_match = log_name_pattern.search(entry.name)
+            if not log_date_match or not entry.is_file():
+                continue
+
+            try:
+                log_datetime = datetime.strptime(
+                    log_date_match.group(),
+                    '%Y%m%d'
+                )
+            except ValueError:
+                continue
+
+            yield entry.path, log_datetime.date()
+
+
+def get_log_preference(log_path: str) -> Tuple[bool, str]:
+    """
+    Return a key to choose one of logs of the same date.
+
+    A plain log is preferred to its packed copy, other logs are chosen by
+    the path, so the choice does not depend on the directory order.
+
+    :param log_path: a path of log file;
+    :return: a key whose smallest value marks the preferred log.
+    """
+    return log_path.endswith('.gz'), log_path
+
+
+def remove_packed_copies(log_paths: Iterable[str]) -> List[str]:
+    """
+    Return log paths without packed logs whose plain copies are present.
+
+    :param log_paths: paths of log files;
+    :return: a sorted list of log paths.
+    """
+    log_paths = set(log_paths)
+    return sorted(
+        log_path for log_path in log_paths
+        if not (log_path.endswith('.gz') and log_path[:-3] in log_paths)
+    )
 
 
 def get_new_log_path_and_date(
-        directory_path: str
+        directory_path: str,
+        log_name_prefix: str = DEFAULT_LOG_NAME_PREFIX,
+        multi_source: bool = False
 ) -> Tuple[str, date] or Tuple[None, None]:
     """
     Return log file path and its date if new log was found.
 
     :param directory_path: a directory containing log files.
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if names of same-day logs of several sources
+    end with a source name: <prefix>YYYYMMDD-<source>[.gz];
     :return: log path and log date. If no new log path and date found -
     (None, None).
     """
-    log_pattern = re.compile(
-        '(?<=^nginx-access-ui\.log-)\d{8}(?=$|\.gz)'
+    newest_log_path, newest_log_date = None, None
+    with measure_stage('log_search'):
+        for log_path, log_date in iter_log_files(
+                directory_path,
+                log_name_prefix,
+                multi_source
+        ):
+            newer_log = (
+                newest_log_date is None
+                or log_date > newest_log_date
+                or log_date == newest_log_date and (
+                    get_log_preference(log_path)
+                    < get_log_preference(newest_log_path)
+                )
+            )
+            if newer_log:
+                newest_log_path, newest_log_date = log_path, log_date
+
+    return newest_log_path, newest_log_date
+
+
+def get_source_log_paths(
+        directory_path: str,
+        log_date: date,
+        log_name_prefix: str = DEFAULT_LOG_NAME_PREFIX
+) -> List[str]:
+    """
+    Return paths of logs of all sources for a date.
+
+    :param directory_path: a directory containing log files;
+    :param log_date: a log date;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :return: a sorted list of log paths. A packed log is skipped if its
+    plain copy is present.
+    """
+    return remove_packed_copies(
+        log_path
+        for log_path, source_log_date in iter_log_files(
+            directory_path,
+            log_name_prefix,
+            multi_source=True
+        )
+        if source_log_date == log_date
     )
-    newest_log_path = None
-    log_datetime = datetime(1, 1, 1)
-    for entry_name in os.listdir(directory_path):
-        entry_path = os.path.join(directory_path, entry_name)
-        entry_is_file = os.path.isfile(entry_path)
-        if entry_is_file:
-            log_date_match = log_pattern.search(entry_name)
-            if not log_date_match:
-                continue
 
-            log_date_string = log_date_match.group()
-            try:
-                file_log_date = datetime.strptime(log_date_string, '%Y%m%d')
-            except ValueError:
-                continue
 
-            if file_log_date > log_datetime:
-                log_datetime = file_log_date
-                newest_log_path = entry_path
+def get_report_name(log_date: date) -> str:
+    """
+    Return a report file name for a log date.
+
+    :param log_date: a log date;
+    :return: a report file name.
+    """
+    return REPORT_NAME_TEMPLATE.format(str(log_date).replace("-", "."))
+
+
+def get_report_names(log_date: date) -> Tuple[str, str]:
+    """
+    Return names of a plain and a compressed report for a log date.
+
+    :param log_date: a log date;
+    :return: report file names.
+    """
+    report_name = get_report_name(log_date)
+    return report_name, f'{report_name}.gz'
+
+
+def get_unprocessed_logs(
+        log_dir_path: str,
+        report_dir_path: str,
+        log_name_prefix: str = DEFAULT_LOG_NAME_PREFIX,
+        multi_source: bool = False,
+        report_names: Union[Set[str], None] = None
+) -> List[Tuple[str, date]]:
+    """
+    Return all logs which have no reports yet.
+
+    Both directories are listed once, so the function is fast even if they
+    contain thousands of files. One log is returned for each date, a plain
+    log is preferred to its packed copy.
+
+    :param log_dir_path: a directory containing log files;
+    :param report_dir_path: a directory containing script results;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if names of same-day logs of several sources
+    end with a source name: <prefix>YYYYMMDD-<source>[.gz];
+    :param report_names: names of rendered reports, for example taken from
+    the report index. None if the report directory should be listed;
+    :return: a list [(log_path, log_date), ...] sorted by log date.
+    """
+    with measure_stage('log_search'):
+        if report_names is None:
+            with os.scandir(report_dir_path) as entries:
+                report_names = {entry.name for entry in entries}
+
+        unprocessed_logs = {}
+        for log_path, log_date in iter_log_files(
+                log_dir_path,
+                log_name_prefix,
+                multi_source
+        ):
+            if not report_names.isdisjoint(get_report_names(log_date)):
+                continue
+            other_log_path = unprocessed_logs.get(log_date)
+            preferred_log = other_log_path is None or (
+                get_log_preference(log_path)
+                < get_log_preference(other_log_path)
+            )
+            if preferred_log:
+                unprocessed_logs[log_date] = log_path
 
-    log_date = log_datetime.date() if newest_log_path else None
-    return newest_log_path, log_date
+    return [
+        (log_path, log_date)
+        for log_date, log_path in sorted(unprocessed_logs.items())
+    ]
 
 
 def search_in_reports(report_dir_path: str, log_date: date) -> bool:
@@ -56,17 +247,155 @@ def search_in_reports(report_dir_path: str, log_date: date) -> bool:
     :return: True if searched report is found in report directory.
     """
     logging.info(f'Search for reports in {report_dir_path}.')
-    expected_report_name = REPORT_NAME_TEMPLATE.format(
-        str(log_date).replace("-", ".")
+    report_is_ready = any(
+        os.path.exists(os.path.join(report_dir_path, report_name))
+        for report_name in get_report_names(log_date)
     )
-    expected_report_path = os.path.join(report_dir_path, expected_report_name)
-    report_is_ready = os.path.exists(expected_report_path)
     return report_is_ready
 
 
+def reset_parse_error_log():
+    """Start counting logged parsing errors of a new log part."""
+    parse_error_log['error_number'] = 0
+
+
+def log_parse_error(err_msg: str, position: int, line: Union[str, bytes]):
+    """
+    Log an invalid line if the limit of logged errors is not reached.
+
+    Only the first MAX_LOGGED_PARSE_ERRORS lines of a log part are logged,
+    so a log of a wrong format does not produce a log record per line.
+    The total number of errors is logged by a caller.
+
+    :param err_msg: a message template with a position and a line;
+    :param position: a line number or an offset of the line;
+    :param line: the invalid line.
+    """
+    error_number = parse_error_log['error_number'] + 1
+    parse_error_log['error_number'] = error_number
+    if error_number > MAX_LOGGED_PARSE_ERRORS:
+        return
+    logging.error(err_msg, position, line[:MAX_LOGGED_LINE_LENGTH])
+    if error_number == MAX_LOGGED_PARSE_ERRORS:
+        logging.error('Next parsing errors are counted but not logged.')
+
+
+def parse_log_line(line: str) -> Tuple[str, float] or Tuple[None, None]:
+    """
+    Parse a log line and return its url and request time.
+
+    :param line: a log line;
+    :return: url and request processing duration. If the line is invalid -
+    (None, None).
+    """
+    url_match = URL_PATTERN.search(line)
+    req_time_match = REQUEST_TIME_PATTERN.search(line)
+    url = None if url_match is None else url_match.group()
+    req_time = None if req_time_match is None else req_time_match.group()
+    try:
+        req_time = float(req_time)
+    except (TypeError, ValueError):
+        req_time = None
+
+    if url is None or req_time is None:
+        return None, None
+
+    return url, req_time
+
+
+def parse_log_span(
+        buffer: Union[bytes, mmap.mmap],
+        line_start: int,
+        line_end: int
+) -> Tuple[str, float] or Tuple[None, None]:
+    """
+    Parse a ui_short log line located in a buffer without regular expressions.
+
+    The url is the last but one token of the first quoted field ($request),
+    the request time is the last token of the line. Only the url and the
+    request time are copied from the buffer.
+
+    :param buffer: bytes or a memory-mapped file containing the line;
+    :param line_start: an offset of the first line byte;
+    :param line_end: an offset after the last line byte;
+    :return: url and request processing duration. If the line is invalid -
+    (None, None).
+    """
+    request_start = buffer.find(b'"', line_start, line_end)
+    if request_start < 0:
+        return None, None
+    request_end = buffer.find(b'"', request_start + 1, line_end)
+    if request_end < 0:
+        return None, None
+
+    protocol_start = buffer.rfind(b' ', request_start, request_end)
+    protocol_prefix_end = protocol_start + len(PROTOCOL_PREFIX)
+    if buffer[protocol_start:protocol_prefix_end] != PROTOCOL_PREFIX:
+        return None, None
+
+    url_start = buffer.rfind(b' ', request_start, protocol_start) + 1
+    if not url_start or url_start == protocol_start:
+        return None, None
+
+    try:
+        req_time = float(
+            buffer[buffer.rfind(b' ', line_start, line_end) + 1:line_end]
+        )
+    except ValueError:
+        return None, None
+
+    url = buffer[url_start:protocol_start].decode('utf_8', errors='ignore')
+    return url, req_time
+
+
+def parse_log_line_bytes(
+        line: bytes
+) -> Tuple[str, float] or Tuple[None, None]:
+    """
+    Parse a raw log line of the ui_short format without regular expressions.
+
+    :param line: a raw log line;
+    :return: url and request processing duration. If the line is invalid -
+    (None, None).
+    """
+    return parse_log_span(line, 0, len(line))
+
+
+LOG_PARSERS = {
+    'regex': parse_log_line,
+    'fast': parse_log_line_bytes,
+}
+BINARY_LOG_PARSERS = {'fast'}
+# A span parser returns a log note starting with url and request time.
+# The url is None if a line is invalid.
+SpanParser = Callable[[Union[bytes, mmap.mmap], int, int], Tuple]
+
+
+def get_line_parser(
+        parser_name: str,
+        parse_span: Union[SpanParser, None] = None
+) -> Tuple[Callable, bool]:
+    """
+    Return a log line parser and True if it parses raw bytes.
+
+    :param parser_name: a key of LOG_PARSERS;
+    :param parse_span: a parser of a line span compiled from a log format.
+    If it is set, parser_name is ignored;
+    :return: a line parser and a flag of a binary parser.
+    """
+    if parse_span is None:
+        return LOG_PARSERS[parser_name], parser_name in BINARY_LOG_PARSERS
+
+    def parse_line(line: bytes) -> Tuple[str, float] or Tuple[None, None]:
+        return parse_span(line, 0, len(line))
+    return parse_line, True
+
+
 def log_reader_generator(
         log_path: str,
         file_extension: str,
+        parser_name: str = DEFAULT_LOG_PARSER,
+        parse_span: Union[SpanParser, None] = None,
 ) -> Generator[Tuple[str, float], None, None]:
     """
     Open log file, parse and yield url and request time from each file line.
@@ -74,39 +403,250 @@ def log_reader_generator(
     :param log_path: the path of log file;
     :param file_extension: extension of log file;
     Valid values: empty string or 'gz';
+    :param parser_name: a key of LOG_PARSERS;
+    :param parse_span: a parser compiled from a log format. If it is set,
+    parser_name is ignored;
     :return: url and request processing duration.
     """
     read_line_number = 0
-    url_pattern = re.compile('(?<=\s)(\S+)(?= HTTP/1.)')
-    request_time_pattern = re.compile('\S+$')
+    parse_line, binary_parser = get_line_parser(parser_name, parse_span)
     log_file_reader = gzip.open if file_extension == '.gz' else open
-    read_param = 'rt' if file_extension == '.gz' else 'r'
-    with log_file_reader(
+    if binary_parser:
+        log_file = log_file_reader(log_path, 'rb')
+    else:
+        read_param = 'rt' if file_extension == '.gz' else 'r'
+        log_file = log_file_reader(
             log_path,
             read_param,
             encoding='utf_8',
             errors='ignore'
-    ) as log_file:
+        )
+    with log_file:
         successful_parsing = False
         for line in log_file:
             read_line_number += 1
-            url_match = url_pattern.search(line)
-            req_time_match = request_time_pattern.search(line)
-            url = None if url_match is None else url_match.group()
-            req_time = None if req_time_match is None else req_time_match.group()
-            try:
-                req_time = float(req_time)
-            except ValueError:
-                req_time = None
-
-            if url is None or req_time is None:
-                err_msg = 'Parsing error. Invalid line number {}: {}'
-                logging.error(err_msg.format(read_line_number, line))
-                url = req_time = None
+            log_note = parse_line(line)
+            if log_note[0] is None:
+                err_msg = 'Parsing error. Invalid line number %s: %r'
+                log_parse_error(err_msg, read_line_number, line)
             else:
                 successful_parsing = True
 
-            yield url, req_time
+            yield log_note
 
         if not successful_parsing:
             raise Exception(f'Can not parse any request info in {log_path}')
+
+
+def sample_log_lines(
+        log_path: str,
+        file_extension: str,
+        head_line_number: int,
+        seek_number: int,
+        seed: int = 0
+) -> Generator[bytes, None, None]:
+    """
+    Yield first lines of a log and lines at random offsets.
+
+    Random lines are read from an uncompressed log only: a gzip log can not
+    be read from an offset without decompressing the data before it.
+
+    :param log_path: the path of log file;
+    :param file_extension: extension of log file;
+    :param head_line_number: a number of first lines to yield;
+    :param seek_number: a number of random offsets to read a line from;
+    :param seed: a random generator seed;
+    :return: raw log lines.
+    """
+    log_file_reader = gzip.open if file_extension == '.gz' else open
+    with log_file_reader(log_path, 'rb') as log_file:
+        for _ in range(head_line_number):
+            line = log_file.readline()
+            if not line:
+                return
+            yield line
+
+        if file_extension == '.gz':
+            return
+        head_end = log_file.tell()
+        file_size = os.path.getsize(log_path)
+        if head_end >= file_size:
+            return
+        random_generator = random.Random(seed)
+        offsets = sorted(
+            random_generator.randrange(head_end, file_size)
+            for _ in range(seek_number)
+        )
+        for offset in offsets:
+            log_file.seek(offset)
+            log_file.readline()
+            line = log_file.readline()
+            if line:
+                yield line
+
+
+def get_chunk_offsets(
+        log_path: str,
+        chunk_size: int
+) -> List[Tuple[int, int]]:
+    """
+    Split an uncompressed log file into byte ranges aligned to line ends.
+
+    :param log_path: the path of log file;
+    :param chunk_size: an approximate chunk size in bytes;
+    :return: a list [(chunk_start, chunk_end), ...].
+    """
+    file_size = os.path.getsize(log_path)
+    chunk_offsets = []
+    with open(log_path, 'rb') as log_file:
+        chunk_start = 0
+        while chunk_start < file_size:
+            log_file.seek(chunk_start + max(chunk_size, 1) - 1)
+            log_file.readline()
+            chunk_end = min(log_file.tell(), file_size)
+            chunk_offsets.append((chunk_start, chunk_end))
+            chunk_start = chunk_end
+
+    return chunk_offsets
+
+
+def log_chunk_reader_generator(
+        log_path: str,
+        chunk_start: int,
+        chunk_end: int,
+        parser_name: str = DEFAULT_LOG_PARSER,
+        parse_span: Union[SpanParser, None] = None,
+) -> Generator[Tuple[str, float], None, None]:
+    """
+    Parse and yield url and request time from a byte range of a plain log.
+
+    Unlike log_reader_generator, it does not raise an exception if the chunk
+    contains no valid lines: a caller checks the whole log.
+
+    :param log_path: the path of uncompressed log file;
+    :param chunk_start: an offset of the first chunk byte;
+    :param chunk_end: an offset after the last chunk byte;
+    :param parser_name: a key of LOG_PARSERS;
+    :param parse_span: a parser compiled from a log format. If it is set,
+    parser_name is ignored;
+    :return: url and request processing duration.
+    """
+    parse_line, binary_parser = get_line_parser(parser_name, parse_span)
+    with open(log_path, 'rb') as log_file:
+        log_file.seek(chunk_start)
+        position = chunk_start
+        while position < chunk_end:
+            line = log_file.readline()
+            if not line:
+                break
+            position += len(line)
+            if binary_parser:
+                log_note = parse_line(line)
+            else:
+                log_note = parse_line(line.decode('utf_8', errors='ignore'))
+            if log_note[0] is None:
+                err_msg = 'Parsing error. Invalid line at the offset %s: %r'
+                log_parse_error(err_msg, position - len(line), line)
+
+            yield log_note
+
+
+def parse_buffer_lines(
+        buffer: Union[bytes, mmap.mmap],
+        start: int,
+        end: int,
+        buffer_offset: int = 0,
+        parse_span: SpanParser = parse_log_span,
+) -> Generator[Tuple[str, float], None, None]:
+    """
+    Parse and yield url and request time from lines located in a buffer.
+
+    :param buffer: bytes or a memory-mapped file containing whole lines;
+    :param start: an offset of the first line;
+    :param end: an offset after the last line;
+    :param buffer_offset: an offset of the buffer in a log, it is used in
+    error messages only;
+    :param parse_span: a parser of a line span;
+    :return: url and request processing duration.
+    """
+    find_line_end = buffer.find
+    line_start = start
+    while line_start < end:
+        line_end = find_line_end(b'\n', line_start, end)
+        if line_end < 0:
+            line_end = end
+        log_note = parse_span(buffer, line_start, line_end)
+        if log_note[0] is None:
+            err_msg = 'Parsing error. Invalid line at the offset %s: %r'
+            log_parse_error(
+                err_msg,
+                buffer_offset + line_start,
+                buffer[line_start:line_end]
+            )
+
+        yield log_note
+        line_start = line_end + 1
+
+
+def mmap_log_reader_generator(
+        log_path: str,
+        chunk_start: int = 0,
+        chunk_end: Union[int, None] = None,
+        parse_span: SpanParser = parse_log_span,
+) -> Generator[Tuple[str, float], None, None]:
+    """
+    Parse and yield url and request time from a memory-mapped plain log.
+
+    Lines are located in the mapped buffer by bytes.find and parsed in place,
+    so whole lines are never copied. Already parsed pages are released from
+    the process memory every MMAP_RELEASE_SIZE bytes where madvise is
+    available (Python 3.8+). Unlike log_reader_generator, it does not
+    raise an exception if the range contains no valid lines: a caller checks
+    the whole log.
+
+    :param log_path: the path of uncompressed log file;
+    :param chunk_start: an offset of the first byte to read;
+    :param chunk_end: an offset after the last byte to read. None if the
+    file should be read up to the end;
+    :param parse_span: a parser of a line span;
+    :return: url and request processing duration.
+    """
+    if not os.path.getsize(log_path):
+        return
+
+    with open(log_path, 'rb') as log_file, mmap.mmap(
+            log_file.fileno(),
+            0,
+            access=mmap.ACCESS_READ
+    ) as buffer:
+        if chunk_end is None or chunk_end > len(buffer):
+            chunk_end = len(buffer)
+        can_release_pages = hasattr(buffer, 'madvise')
+        if can_release_pages:
+            buffer.madvise(mmap.MADV_SEQUENTIAL)
+        released_end = chunk_start - chunk_start % mmap.PAGESIZE
+        window_start = chunk_start
+        while window_start < chunk_end:
+            window_end = buffer.find(
+                b'\n',
+                window_start + MMAP_RELEASE_SIZE,
+                chunk_end
+            ) + 1
+            if not window_end:
+                window_end = chunk_end
+            yield from parse_buffer_lines(
+                buffer,
+                window_start,
+                window_end,
+                parse_span=parse_span
+            )
+
+            window_start = window_end
+            release_end = window_end - window_end % mmap.PAGESIZE
+            if can_release_pages and release_end > released_end:
+                buffer.madvise(
+                    mmap.MADV_DONTNEED,
+                    released_end,
+                    release_end - released_end
+                )
+                released_end = release_end
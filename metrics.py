@@ -0,0 +1,233 @@
+"""Opt-in metrics of the script stages and their export."""
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from typing import Any, Dict, Iterator, Mapping, Union
+
+METRIC_PREFIX = 'log_analyzer'
+
+metrics_lock = threading.Lock()
+metrics_state = {
+    'enabled': False,
+    'stages': {},
+    'counters': {},
+    'gauges': {},
+}
+
+
+def enable_metrics():
+    """Start collecting metrics in this process."""
+    metrics_state['enabled'] = True
+
+
+def metrics_enabled() -> bool:
+    """Return True if metrics are collected."""
+    return metrics_state['enabled']
+
+
+def reset_metrics(enabled: bool):
+    """
+    Clear collected metrics and enable or disable collecting them.
+
+    A forked worker process inherits metrics of its parent, so it clears
+    them before a task.
+
+    :param enabled: True if metrics should be collected.
+    """
+    with metrics_lock:
+        metrics_state['enabled'] = enabled
+        for metric_group in ('stages', 'counters', 'gauges'):
+            metrics_state[metric_group] = {}
+
+
+def get_collected_metrics() -> Dict[str, Dict[str, Any]]:
+    """Return copies of collected stages, counters and gauges."""
+    with metrics_lock:
+        return {
+            'stages': {
+                stage_name: dict(stage)
+                for stage_name, stage in metrics_state['stages'].items()
+            },
+            'counters': dict(metrics_state['counters']),
+            'gauges': dict(metrics_state['gauges']),
+        }
+
+
+def merge_metrics(collected_metrics: Mapping[str, Mapping[str, Any]]):
+    """
+    Add metrics collected by a worker process to metrics of this process.
+
+    Stage times and counters are summed, gauges are replaced.
+
+    :param collected_metrics: metrics returned by get_collected_metrics.
+    """
+    if not metrics_state['enabled']:
+        return
+    with metrics_lock:
+        for stage_name, worker_stage in collected_metrics['stages'].items():
+            stage = metrics_state['stages'].setdefault(
+                stage_name,
+                {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0}
+            )
+            for field_name, value in worker_stage.items():
+                stage[field_name] += value
+        counters = metrics_state['counters']
+        for counter_name, value in collected_metrics['counters'].items():
+            counters[counter_name] = counters.get(counter_name, 0) + value
+        metrics_state['gauges'].update(collected_metrics['gauges'])
+
+
+def get_cpu_time() -> float:
+    """Return CPU time of the process and its finished children in seconds."""
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (
+        self_usage.ru_utime + self_usage.ru_stime
+        + children_usage.ru_utime + children_usage.ru_stime
+    )
+
+
+@contextmanager
+def measure_stage(stage_name: str, in_thread: bool = False) -> Iterator[None]:
+    """
+    Record wall and CPU time of a code block if metrics are enabled.
+
+    A stage which runs several times accumulates its time. CPU time of
+    the process would include stages running at the same time, so a stage
+    running in a thread records CPU time of its thread only.
+
+    :param stage_name: a name of the stage;
+    :param in_thread: True if the stage runs in parallel with others in
+    a thread of this process.
+    """
+    if not metrics_state['enabled']:
+        yield
+        return
+
+    get_stage_cpu_time = time.thread_time if in_thread else get_cpu_time
+    wall_started_at = time.perf_counter()
+    cpu_started_at = get_stage_cpu_time()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - wall_started_at
+        cpu_time = get_stage_cpu_time() - cpu_started_at
+        with metrics_lock:
+            stage = metrics_state['stages'].setdefault(
+                stage_name,
+                {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0}
+            )
+            stage['wall_seconds'] += wall_time
+            stage['cpu_seconds'] += cpu_time
+            stage['calls'] += 1
+
+
+def add_counter(counter_name: str, value: Union[int, float]):
+    """
+    Add a value to a counter if metrics are enabled.
+
+    :param counter_name: a name of the counter;
+    :param value: a value to add.
+    """
+    if not metrics_state['enabled']:
+        return
+    with metrics_lock:
+        counters = metrics_state['counters']
+        counters[counter_name] = counters.get(counter_name, 0) + value
+
+
+def set_gauge(gauge_name: str, value: Union[int, float]):
+    """
+    Set a current value of a gauge if metrics are enabled.
+
+    :param gauge_name: a name of the gauge;
+    :param value: a value of the gauge.
+    """
+    if not metrics_state['enabled']:
+        return
+    with metrics_lock:
+        metrics_state['gauges'][gauge_name] = value
+
+
+def get_metrics_summary() -> Dict[str, Any]:
+    """Return collected metrics and peak memory of the process."""
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        **get_collected_metrics(),
+        'peak_rss_bytes': self_usage.ru_maxrss * 1024,
+        'children_peak_rss_bytes': children_usage.ru_maxrss * 1024,
+    }
+
+
+def format_prometheus_metrics(summary: Mapping[str, Any]) -> str:
+    """
+    Return metrics in the Prometheus text exposition format.
+
+    :param summary: metrics returned by get_metrics_summary;
+    :return: a text of the metrics.
+    """
+    lines = []
+    for field_name, help_text in (
+            ('wall_seconds', 'Wall time of a script stage.'),
+            ('cpu_seconds', 'CPU time of a script stage.'),
+    ):
+        metric_name = f'{METRIC_PREFIX}_stage_{field_name}'
+        lines.append(f'# HELP {metric_name} {help_text}')
+        lines.append(f'# TYPE {metric_name} gauge')
+        for stage_name, stage in sorted(summary['stages'].items()):
+            lines.append(
+                f'{metric_name}{{stage="{stage_name}"}} {stage[field_name]}'
+            )
+
+    for metric_group, metric_type in (
+            ('counters', 'counter'),
+            ('gauges', 'gauge'),
+    ):
+        for value_name, value in sorted(summary[metric_group].items()):
+            metric_name = f'{METRIC_PREFIX}_{value_name}'
+            lines.append(f'# TYPE {metric_name} {metric_type}')
+            lines.append(f'{metric_name} {value}')
+
+    for field_name in ('peak_rss_bytes', 'children_peak_rss_bytes'):
+        metric_name = f'{METRIC_PREFIX}_{field_name}'
+        lines.append(f'# TYPE {metric_name} gauge')
+        lines.append(f'{metric_name} {summary[field_name]}')
+
+    metric_name = f'{METRIC_PREFIX}_last_run_timestamp_seconds'
+    lines.append(f'# TYPE {metric_name} gauge')
+    lines.append(f'{metric_name} {time.time()}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(
+        json_path: Union[str, None],
+        prometheus_path: Union[str, None]
+):
+    """
+    Save collected metrics.
+
+    Files are written to temporary files and then renamed, so a textfile
+    collector of node_exporter never reads a partial file.
+
+    :param json_path: a path of JSON summary. None if it is not needed;
+    :param prometheus_path: a path of Prometheus textfile. None if it is
+    not needed.
+    """
+    summary = get_metrics_summary()
+    for metrics_path, metrics_text in (
+            (json_path, lambda: json.dumps(summary, indent=2)),
+            (prometheus_path, lambda: format_prometheus_metrics(summary)),
+    ):
+        if not metrics_path:
+            continue
+        temp_metrics_path = f'{metrics_path}.tmp'
+        with open(temp_metrics_path, 'w') as metrics_file:
+            metrics_file.write(metrics_text())
+        os.replace(temp_metrics_path, metrics_path)
+        logging.info(f'Saved metrics {metrics_path}')
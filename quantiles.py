@@ -0,0 +1,203 @@
+"""A mergeable histogram to estimate quantiles of request time."""
+
+from array import array
+import math
+from typing import Iterable, List, Tuple, Union
+
+RELATIVE_ACCURACY = 0.01
+MAX_BUCKET_NUMBER = 2048
+MIN_TRACKED_VALUE = 1e-6
+
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+
+def get_bucket_index(value: float) -> int:
+    """
+    Return an index of a bucket containing a value.
+
+    :param value: a value greater than MIN_TRACKED_VALUE;
+    :return: a bucket index.
+    """
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+
+class QuantileHistogram:
+    """
+    A histogram with log-scale buckets of request time.
+
+    A bucket i contains values in (GAMMA ** (i - 1), GAMMA ** i], so any
+    quantile estimation has a relative error less than RELATIVE_ACCURACY.
+    Bucket counters are kept in a contiguous array covering the range from
+    the lowest to the highest used bucket. The array length is limited by
+    MAX_BUCKET_NUMBER: if it is exceeded, the lowest buckets are collapsed.
+    Histograms of different log chunks or files can be merged.
+    """
+    __slots__ = (
+        'count',
+        'zero_count',
+        'min_value',
+        'max_value',
+        'offset',
+        'buckets',
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.zero_count = 0
+        self.min_value = math.inf
+        self.max_value = -math.inf
+        self.offset = 0
+        self.buckets = array('I')
+
+    def add(self, value: float, number: int = 1):
+        """
+        Add a value to the histogram.
+
+        :param value: a request time;
+        :param number: how many times the value should be added.
+        """
+        self.count += number
+        if value < self.min_value:
+            self.min_value = value
+        if value > self.max_value:
+            self.max_value = value
+
+        if value <= MIN_TRACKED_VALUE:
+            self.zero_count += number
+            return
+
+        bucket_index = math.ceil(math.log(value) / LOG_GAMMA)
+        self._add_to_bucket(bucket_index, number)
+
+    def add_buckets(
+            self,
+            bucket_counts: Iterable[Tuple[int, int]],
+            zero_count: int,
+            min_value: float,
+            max_value: float
+    ):
+        """
+        Add counts of values grouped by buckets.
+
+        The result equals adding the values one by one.
+
+        :param bucket_counts: pairs (bucket_index, number) of values greater
+        than MIN_TRACKED_VALUE in ascending order of bucket indexes;
+        :param zero_count: a number of values not greater than
+        MIN_TRACKED_VALUE;
+        :param min_value: the least of the values;
+        :param max_value: the greatest of the values.
+        """
+        self.count += zero_count
+        self.zero_count += zero_count
+        self.min_value = min(self.min_value, min_value)
+        self.max_value = max(self.max_value, max_value)
+        for bucket_index, number in bucket_counts:
+            self.count += number
+            self._add_to_bucket(bucket_index, number)
+
+    def _add_to_bucket(self, bucket_index: int, number: int):
+        buckets = self.buckets
+        if not buckets:
+            self.offset = bucket_index
+            buckets.append(number)
+            return
+
+        position = bucket_index - self.offset
+        if position < 0:
+            buckets[0:0] = array('I', [0]) * -position
+            self.offset = bucket_index
+            position = 0
+        elif position >= len(buckets):
+            buckets.extend(array('I', [0]) * (position - len(buckets) + 1))
+
+        buckets[position] += number
+        if len(buckets) > MAX_BUCKET_NUMBER:
+            self._collapse_lowest_buckets()
+
+    def _collapse_lowest_buckets(self):
+        buckets = self.buckets
+        extra_number = len(buckets) - MAX_BUCKET_NUMBER
+        collapsed_count = sum(buckets[:extra_number + 1])
+        del buckets[:extra_number]
+        buckets[0] = collapsed_count
+        self.offset += extra_number
+
+    def merge(self, other: 'QuantileHistogram'):
+        """
+        Merge another histogram into this one.
+
+        :param other: a histogram to merge.
+        """
+        if not other.count:
+            return
+
+        self.count += other.count
+        self.zero_count += other.zero_count
+        self.min_value = min(self.min_value, other.min_value)
+        self.max_value = max(self.max_value, other.max_value)
+        for position, bucket_count in enumerate(other.buckets):
+            if bucket_count:
+                self._add_to_bucket(other.offset + position, bucket_count)
+
+    def get_quantile(self, quantile: float) -> Union[float, None]:
+        """
+        Return a quantile estimation.
+
+        :param quantile: a quantile in the range [0, 1];
+        :return: a quantile estimation. None if the histogram is empty.
+        """
+        if not self.count:
+            return None
+
+        rank = quantile * (self.count - 1)
+        value = 0.0
+        cumulative_count = self.zero_count
+        if cumulative_count <= rank:
+            for position, bucket_count in enumerate(self.buckets):
+                cumulative_count += bucket_count
+                if cumulative_count > rank:
+                    bucket_index = self.offset + position
+                    value = 2 * GAMMA ** bucket_index / (GAMMA + 1)
+                    break
+
+        return min(max(value, self.min_value), self.max_value)
+
+    def get_memory_size(self) -> int:
+        """Return an approximate number of bytes used by bucket counters."""
+        return self.buckets.itemsize * len(self.buckets)
+
+    def to_state(self) -> List[Union[int, float, List[int]]]:
+        """Return the histogram state of JSON serializable types."""
+        return [
+            self.count,
+            self.zero_count,
+            self.min_value,
+            self.max_value,
+            self.offset,
+            self.buckets.tolist(),
+        ]
+
+    @classmethod
+    def from_state(
+            cls,
+            state: List[Union[int, float, List[int]]]
+    ) -> 'QuantileHistogram':
+        """
+        Return a histogram restored from a state.
+
+        :param state: a state returned by to_state;
+        :return: a histogram.
+        """
+        histogram = cls()
+        (
+            histogram.count,
+            histogram.zero_count,
+            histogram.min_value,
+            histogram.max_value,
+            histogram.offset,
+            buckets,
+        ) = state
+        histogram.buckets = array('I', buckets)
+        return histogram
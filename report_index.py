@@ -0,0 +1,450 @@
+"""A persistent index of rendered reports and processed logs."""
+
+from contextlib import contextmanager
+from datetime import date, datetime
+import fcntl
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, List, Mapping, Sequence, Tuple
+from typing import Union
+
+from checkpoints import HEAD_DIGEST_SIZE, get_head_digest
+from constants import REPORT_INDEX_NAME
+from log_processing import get_new_log_path_and_date, get_unprocessed_logs
+from log_processing import iter_log_files
+
+REPORT_INDEX_VERSION = 1
+REPORT_NAME_PATTERN = re.compile(
+    r'^report-(\d{4}\.\d{2}\.\d{2})\.html(?:\.gz)?$'
+)
+# A cached listing of a log directory is saved only if the directory was
+# not modified for this time: a file system with coarse timestamps does not
+# change the directory mtime for a file created in the same tick.
+LISTING_SETTLE_TIME = 2.0
+
+ReportIndex = Dict[str, Any]
+
+
+def new_report_index() -> ReportIndex:
+    """Return an empty index."""
+    return {
+        'version': REPORT_INDEX_VERSION,
+        'reports': {},
+        'logs': {},
+        'log_listings': {},
+    }
+
+
+def get_index_arguments(
+        configuration: Mapping[str, Any]
+) -> Tuple[str, str, str, bool]:
+    """
+    Return the first arguments of index functions set in the configuration.
+
+    :param configuration: the script configuration;
+    :return: a report directory, a log directory, a log name prefix and
+    a flag of multi-source logs.
+    """
+    return (
+        configuration['REPORT_DIR'],
+        configuration['LOG_DIR'],
+        configuration['LOG_NAME_PREFIX'],
+        configuration['MULTI_SOURCE_LOGS'],
+    )
+
+
+def get_index_path(report_dir_path: str) -> str:
+    """
+    Return a path of the report index.
+
+    :param report_dir_path: directory containing script results;
+    :return: a path of index file.
+    """
+    return os.path.join(report_dir_path, REPORT_INDEX_NAME)
+
+
+def get_listing_key(
+        log_dir_path: str,
+        log_name_prefix: str,
+        multi_source: bool
+) -> str:
+    """
+    Return a key of a cached log directory listing.
+
+    :param log_dir_path: a directory containing log files;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if logs of several sources are merged;
+    :return: a key of the listing in the index.
+    """
+    return (
+        f'{os.path.abspath(log_dir_path)}|{log_name_prefix}|'
+        f'{int(multi_source)}'
+    )
+
+
+def get_log_properties(log_path: str, log_date: date) -> Dict[str, Any]:
+    """
+    Return properties of a processed log to detect its change.
+
+    :param log_path: a path of log file;
+    :param log_date: a log date;
+    :return: a dict of a log size, mtime, a digest of its first
+    HEAD_DIGEST_SIZE bytes and a date.
+    """
+    log_stat = os.stat(log_path)
+    return {
+        'size': log_stat.st_size,
+        'mtime': log_stat.st_mtime,
+        'checksum': get_head_digest(log_path, HEAD_DIGEST_SIZE),
+        'log_date': str(log_date),
+    }
+
+
+def build_report_index(
+        report_dir_path: str,
+        log_dir_path: str,
+        log_name_prefix: str,
+        multi_source: bool
+) -> ReportIndex:
+    """
+    Return an index built from directory listings.
+
+    Daily reports are found by names, logs of their dates are recorded
+    as processed. Render timings of found reports are unknown.
+
+    :param report_dir_path: directory containing script results;
+    :param log_dir_path: a directory containing log files;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if logs of several sources are merged;
+    :return: a report index.
+    """
+    index = new_report_index()
+    with os.scandir(report_dir_path) as entries:
+        for entry in entries:
+            report_name_match = REPORT_NAME_PATTERN.match(entry.name)
+            if not report_name_match:
+                continue
+            try:
+                log_date = datetime.strptime(
+                    report_name_match.group(1),
+                    '%Y.%m.%d'
+                ).date()
+            except ValueError:
+                continue
+            index['reports'][str(log_date)] = {
+                'report_path': entry.path,
+                'log_paths': [],
+                'rendered_at': entry.stat().st_mtime,
+                'seconds': None,
+            }
+
+    if os.path.isdir(log_dir_path):
+        for log_path, log_date in iter_log_files(
+                log_dir_path,
+                log_name_prefix,
+                multi_source
+        ):
+            report = index['reports'].get(str(log_date))
+            if report is None:
+                continue
+            report['log_paths'].append(log_path)
+            index['logs'][log_path] = get_log_properties(log_path, log_date)
+    return index
+
+
+def load_report_index(report_dir_path: str) -> Union[ReportIndex, None]:
+    """
+    Return a saved index.
+
+    :param report_dir_path: directory containing script results;
+    :return: a report index. None if it is absent, invalid or has another
+    version.
+    """
+    index_path = get_index_path(report_dir_path)
+    try:
+        with open(index_path, 'r') as index_file:
+            index = json.load(index_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logging.exception(f'Can not read the report index {index_path}')
+        return None
+    if index.get('version') != REPORT_INDEX_VERSION:
+        return None
+    return index
+
+
+def save_report_index(report_dir_path: str, index: ReportIndex):
+    """
+    Save an index.
+
+    The index is written to a temporary file and then renamed, so a reader
+    never sees a partial index.
+
+    :param report_dir_path: directory containing script results;
+    :param index: a report index.
+    """
+    index_path = get_index_path(report_dir_path)
+    temp_index_path = f'{index_path}.tmp'
+    with open(temp_index_path, 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(temp_index_path, index_path)
+
+
+@contextmanager
+def update_report_index(
+        report_dir_path: str,
+        log_dir_path: str,
+        log_name_prefix: str,
+        multi_source: bool,
+        rebuild: bool = False
+) -> Iterator[ReportIndex]:
+    """
+    Lock the index, yield it for changes and save it.
+
+    Processes rendering reports at the same time update the index one by
+    one, so no update is lost. A missing index is built from listings.
+
+    :param report_dir_path: directory containing script results;
+    :param log_dir_path: a directory containing log files;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if logs of several sources are merged;
+    :param rebuild: True if a saved index should be replaced by an index
+    built from listings;
+    :return: a report index.
+    """
+    lock_path = f'{get_index_path(report_dir_path)}.lock'
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            index = None if rebuild else load_report_index(report_dir_path)
+            if index is None:
+                index = build_report_index(
+                    report_dir_path,
+                    log_dir_path,
+                    log_name_prefix,
+                    multi_source
+                )
+            yield index
+            save_report_index(report_dir_path, index)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_report_index(
+        report_dir_path: str,
+        log_dir_path: str,
+        log_name_prefix: str,
+        multi_source: bool
+) -> ReportIndex:
+    """
+    Return the index, build and save it if it is missing.
+
+    :param report_dir_path: directory containing script results;
+    :param log_dir_path: a directory containing log files;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if logs of several sources are merged;
+    :return: a report index. It is empty if the report directory does not
+    exist.
+    """
+    index = load_report_index(report_dir_path)
+    if index is not None:
+        return index
+    if not os.path.isdir(report_dir_path):
+        return new_report_index()
+    logging.info(f'Build the report index of {report_dir_path}')
+    with update_report_index(
+            report_dir_path,
+            log_dir_path,
+            log_name_prefix,
+            multi_source
+    ) as index:
+        return index
+
+
+def is_log_unchanged(
+        log_path: str,
+        log_properties: Union[Mapping[str, Any], None]
+) -> bool:
+    """
+    Return True if a processed log was not changed since its report.
+
+    A log which was removed, for example by rotation, is not changed.
+    The head of a log is read only if its size is the same, but its mtime
+    differs, for example after a copy.
+
+    :param log_path: a path of log file;
+    :param log_properties: properties returned by get_log_properties.
+    None if they were not recorded;
+    :return: False if the log has another size or checksum.
+    """
+    if log_properties is None:
+        return True
+    try:
+        log_stat = os.stat(log_path)
+    except FileNotFoundError:
+        return True
+    if log_stat.st_size != log_properties['size']:
+        return False
+    if log_stat.st_mtime == log_properties['mtime']:
+        return True
+    checksum = get_head_digest(log_path, HEAD_DIGEST_SIZE)
+    return checksum == log_properties['checksum']
+
+
+def is_indexed_report_valid(
+        index: ReportIndex,
+        report: Mapping[str, Any]
+) -> bool:
+    """
+    Return True if an indexed report exists and its logs were not changed.
+
+    :param index: a report index;
+    :param report: a report of the index;
+    :return: False if the report should be rendered again.
+    """
+    if not os.path.exists(report['report_path']):
+        return False
+    return all(
+        is_log_unchanged(log_path, index['logs'].get(log_path))
+        for log_path in report['log_paths']
+    )
+
+
+def is_report_indexed(index: ReportIndex, log_date: date) -> bool:
+    """
+    Return True if a valid daily report of a date is in the index.
+
+    :param index: a report index;
+    :param log_date: a report date;
+    :return: True if the report was rendered.
+    """
+    report = index['reports'].get(str(log_date))
+    return report is not None and is_indexed_report_valid(index, report)
+
+
+def get_unindexed_logs(
+        index: ReportIndex,
+        report_dir_path: str,
+        log_dir_path: str,
+        log_name_prefix: str,
+        multi_source: bool
+) -> List[Tuple[str, date]]:
+    """
+    Return logs which have no valid reports in the index.
+
+    Only dates of listed logs are looked up, so the work does not grow with
+    the history of the index, and the report directory is not listed.
+
+    :param index: a report index;
+    :param report_dir_path: directory containing script results;
+    :param log_dir_path: a directory containing log files;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if logs of several sources are merged;
+    :return: a list [(log_path, log_date), ...] sorted by log date.
+    """
+    return [
+        (log_path, log_date)
+        for log_path, log_date in get_unprocessed_logs(
+            log_dir_path,
+            report_dir_path,
+            log_name_prefix,
+            multi_source,
+            report_names=set()
+        )
+        if not is_report_indexed(index, log_date)
+    ]
+
+
+def find_newest_log(
+        index: ReportIndex,
+        report_dir_path: str,
+        log_dir_path: str,
+        log_name_prefix: str,
+        multi_source: bool
+) -> Tuple[str, date] or Tuple[None, None]:
+    """
+    Return the newest log path and date using a cached directory listing.
+
+    The log directory is listed only if its mtime differs from the mtime of
+    the cached listing, otherwise only the directory is stat'ed.
+
+    :param index: a report index;
+    :param report_dir_path: directory containing script results;
+    :param log_dir_path: a directory containing log files;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if logs of several sources are merged;
+    :return: log path and log date. (None, None) if there are no logs.
+    """
+    listing_key = get_listing_key(log_dir_path, log_name_prefix, multi_source)
+    directory_mtime_ns = os.stat(log_dir_path).st_mtime_ns
+    listing = index['log_listings'].get(listing_key)
+    if listing is not None and listing['mtime_ns'] == directory_mtime_ns:
+        if listing['newest_log'] is None:
+            return None, None
+        log_path, log_date = listing['newest_log']
+        return log_path, date.fromisoformat(log_date)
+
+    log_path, log_date = get_new_log_path_and_date(
+        log_dir_path,
+        log_name_prefix,
+        multi_source
+    )
+    listing_settled = (
+        time.time() - directory_mtime_ns / 1e9 >= LISTING_SETTLE_TIME
+    )
+    if listing_settled and os.path.isdir(report_dir_path):
+        with update_report_index(
+                report_dir_path,
+                log_dir_path,
+                log_name_prefix,
+                multi_source
+        ) as saved_index:
+            saved_index['log_listings'][listing_key] = {
+                'mtime_ns': directory_mtime_ns,
+                'newest_log': (
+                    None if log_path is None else [log_path, str(log_date)]
+                ),
+            }
+    return log_path, log_date
+
+
+def record_report(
+        report_dir_path: str,
+        log_dir_path: str,
+        log_name_prefix: str,
+        multi_source: bool,
+        log_paths: Sequence[str],
+        log_date: date,
+        report_path: str,
+        seconds: float
+):
+    """
+    Add a rendered daily report and its logs to the index.
+
+    :param report_dir_path: directory containing script results;
+    :param log_dir_path: a directory containing log files;
+    :param log_name_prefix: a log name part before the date YYYYMMDD;
+    :param multi_source: True if logs of several sources are merged;
+    :param log_paths: paths of processed logs;
+    :param log_date: a report date;
+    :param report_path: a path of the rendered report;
+    :param seconds: a time of the log processing and the report rendering.
+    """
+    with update_report_index(
+            report_dir_path,
+            log_dir_path,
+            log_name_prefix,
+            multi_source
+    ) as index:
+        for log_path in log_paths:
+            index['logs'][log_path] = get_log_properties(log_path, log_date)
+        index['reports'][str(log_date)] = {
+            'report_path': report_path,
+            'log_paths': list(log_paths),
+            'rendered_at': time.time(),
+            'seconds': seconds,
+        }
@@ -0,0 +1,137 @@
+"""Functions to write reports without building them in memory."""
+
+import csv
+from functools import lru_cache
+import gzip
+import html
+import json
+import logging
+import os
+from typing import IO, Iterable, Mapping, Tuple, Union
+
+TABLE_PLACEHOLDER = '$table_json'
+NOTE_ANCHOR = '<body>'
+NOTE_TEMPLATE = '<body>\n  <p class="alert">{}</p>'
+TABLE_FORMATS = ('json', 'csv')
+GZIP_SUFFIX = '.gz'
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+REPORT_TEMPLATE_PATH = os.path.join(script_dir, 'data', 'report.html')
+
+
+@lru_cache(maxsize=None)
+def get_report_template(template_path: str) -> Tuple[str, str]:
+    """
+    Return parts of a report template before and after the table.
+
+    A template is read once per process.
+
+    :param template_path: a path of HTML template containing $table_json;
+    :return: a template head and tail.
+    """
+    with open(template_path, 'r') as template_file:
+        template = template_file.read()
+    head, _, tail = template.partition(TABLE_PLACEHOLDER)
+    return head, tail
+
+
+def open_report_file(report_path: str, compress: bool) -> IO[str]:
+    """
+    Open a report file to write text.
+
+    :param report_path: a path of report file;
+    :param compress: True if the file should be compressed by gzip;
+    :return: a text file object.
+    """
+    if compress:
+        return gzip.open(report_path, 'wt', encoding='utf_8')
+    return open(report_path, 'w', encoding='utf_8', newline='')
+
+
+def get_row_json(row: Mapping[str, Union[str, float]]) -> str:
+    """
+    Return a report row as JSON which is safe inside a script tag.
+
+    :param row: a dict containing URL statistics;
+    :return: a JSON object string.
+    """
+    return json.dumps(row).replace('</', '<\\/')
+
+
+def write_json_table(
+        report_file: IO[str],
+        statistics: Iterable[Mapping[str, Union[str, float]]]
+):
+    """
+    Write rows as a JSON array one by one.
+
+    :param report_file: a text file object;
+    :param statistics: dicts containing URL statistics.
+    """
+    report_file.write('[')
+    separator = ''
+    for row in statistics:
+        report_file.write(separator)
+        report_file.write(get_row_json(row))
+        separator = ', '
+    report_file.write(']')
+
+
+def write_csv_table(
+        report_file: IO[str],
+        statistics: Iterable[Mapping[str, Union[str, float]]]
+):
+    """
+    Write rows as CSV with a header taken from the first row.
+
+    :param report_file: a text file object;
+    :param statistics: dicts containing URL statistics.
+    """
+    csv_writer = None
+    for row in statistics:
+        if csv_writer is None:
+            csv_writer = csv.DictWriter(report_file, fieldnames=list(row))
+            csv_writer.writeheader()
+        csv_writer.writerow(row)
+
+
+def write_report_file(
+        report_path: str,
+        statistics: Iterable[Mapping[str, Union[str, float]]],
+        table_format: str = 'html',
+        report_note: Union[str, None] = None
+):
+    """
+    Stream a report to a file.
+
+    The report is written to a temporary file and then renamed, so a broken
+    run does not leave a report which marks a log as processed.
+
+    :param report_path: a path of report file. A *.gz file is compressed;
+    :param statistics: dicts containing URL statistics;
+    :param table_format: 'html', 'json' or 'csv';
+    :param report_note: a text shown above the table of an HTML report,
+    e.g. a description of a sample. None if there is no note.
+    """
+    temp_report_path = f'{report_path}.tmp'
+    compress = report_path.endswith(GZIP_SUFFIX)
+    with open_report_file(temp_report_path, compress) as report_file:
+        if table_format == 'html':
+            head, tail = get_report_template(REPORT_TEMPLATE_PATH)
+            if report_note:
+                head = head.replace(
+                    NOTE_ANCHOR,
+                    NOTE_TEMPLATE.format(html.escape(report_note)),
+                    1
+                )
+            report_file.write(head)
+            write_json_table(report_file, statistics)
+            report_file.write(tail)
+        elif table_format == 'json':
+            write_json_table(report_file, statistics)
+        elif table_format == 'csv':
+            write_csv_table(report_file, statistics)
+        else:
+            raise ValueError(f'Unsupported report format {table_format}')
+    os.replace(temp_report_path, report_path)
+    logging.info(f'Successfully render the report: {report_path}')
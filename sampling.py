@@ -0,0 +1,295 @@
+"""Sampling of log requests for approximate reports."""
+
+from array import array
+from collections import namedtuple
+import math
+import random
+from typing import Generator, Iterable, List, Mapping, Sequence, Tuple
+from typing import Union
+import zlib
+
+from aggregate_store import AggregateStore
+
+SAMPLE_MODES = ('request', 'url', 'block')
+SAMPLE_MODE_DESCRIPTIONS = {
+    'request': 'requests selected by a hash of their position in the log',
+    'url': 'URLs selected by a hash of the URL',
+    'block': 'log blocks selected at random',
+}
+SAMPLE_SEED = 0
+# A z-score of the two-sided 95% confidence interval.
+CONFIDENCE_Z = 1.96
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+HASH_MASK = (1 << 64) - 1
+
+SampleOptions = namedtuple('SampleOptions', ['rate', 'mode', 'block_size'])
+# rate is a sampled share of requests, URLs or log bytes, errors are
+# relative half-widths of 95% confidence intervals of estimated totals.
+# An error is None if it can not be estimated.
+SampleSummary = namedtuple(
+    'SampleSummary',
+    ['mode', 'rate', 'scale', 'count_error', 'time_error', 'read_size']
+)
+
+
+def get_hash_threshold(rate: float) -> int:
+    """
+    Return a hash value below which an item is sampled.
+
+    :param rate: a sampled share in the range (0, 1];
+    :return: a threshold of 64-bit hash values.
+    """
+    return int(rate * (1 << 64))
+
+
+class NoteSampler:
+    """
+    Select log notes by a deterministic hash of a request or its URL.
+
+    A request is identified by its position in the log, so the same log
+    gives the same sample on every run. Positions and URL checksums are
+    spread by Fibonacci hashing, so consecutive requests are sampled
+    independently of each other. Invalid notes are sampled by position
+    in both modes, so the share of parsing errors is kept.
+    """
+    def __init__(self, rate: float, by_url: bool = False):
+        self.threshold = get_hash_threshold(rate)
+        self.by_url = by_url
+        self.url_samples = {}
+        self.time_square_sum = 0.0
+
+    def sample(
+            self,
+            log_reader: Iterable[Tuple]
+    ) -> Generator[Tuple, None, None]:
+        """
+        Yield sampled notes of a reader.
+
+        Squares of sampled request times are summed for error estimation.
+
+        :param log_reader: an iterable of log notes;
+        :return: sampled log notes.
+        """
+        threshold = self.threshold
+        by_url = self.by_url
+        url_samples = self.url_samples
+        time_square_sum = 0.0
+        try:
+            for position, log_note in enumerate(log_reader, SAMPLE_SEED):
+                url = log_note[0]
+                if by_url and url is not None:
+                    sampled = url_samples.get(url)
+                    if sampled is None:
+                        url_hash = zlib.crc32(
+                            url.encode('utf_8', errors='ignore')
+                        )
+                        sampled = url_samples[url] = (
+                            url_hash * HASH_MULTIPLIER & HASH_MASK
+                        ) < threshold
+                else:
+                    sampled = (
+                        position * HASH_MULTIPLIER & HASH_MASK
+                    ) < threshold
+                if not sampled:
+                    continue
+                if log_note[1] is not None:
+                    time_square_sum += log_note[1] * log_note[1]
+                yield log_note
+        finally:
+            self.time_square_sum += time_square_sum
+
+
+def select_sample_blocks(
+        block_offsets: Sequence[Tuple[int, int]],
+        rate: float
+) -> List[Tuple[int, int]]:
+    """
+    Return a random share of log blocks in the order of offsets.
+
+    The generator is seeded, so the same log gives the same blocks.
+
+    :param block_offsets: a list [(block_start, block_end), ...];
+    :param rate: a share of blocks to select;
+    :return: at least one block if there are blocks.
+    """
+    if not block_offsets:
+        return []
+    block_number = max(round(len(block_offsets) * rate), 1)
+    return sorted(
+        random.Random(SAMPLE_SEED).sample(list(block_offsets), block_number)
+    )
+
+
+def get_request_error(
+        rate: float,
+        value_sum: float,
+        square_sum: float
+) -> Union[float, None]:
+    """
+    Return a relative error of a total estimated by sampled requests.
+
+    Every request is sampled independently with the probability rate,
+    so the variance of the estimated total is (1 - rate) / rate times
+    the sum of squared values of all requests, which is estimated by
+    the sampled sum divided by rate.
+
+    :param rate: a sampling rate;
+    :param value_sum: a sum of values of sampled requests;
+    :param square_sum: a sum of squared values of sampled requests;
+    :return: a relative half-width of the 95% confidence interval.
+    """
+    if not value_sum:
+        return None
+    return CONFIDENCE_Z * math.sqrt((1 - rate) * square_sum) / value_sum
+
+
+def get_cluster_error(
+        rate: float,
+        cluster_values: Iterable[float]
+) -> Union[float, None]:
+    """
+    Return a relative error of a total estimated by sampled clusters.
+
+    A cluster, e.g. all requests of a URL, is sampled as a whole with
+    the probability rate.
+
+    :param rate: a sampling rate;
+    :param cluster_values: totals of sampled clusters;
+    :return: a relative half-width of the 95% confidence interval.
+    """
+    value_sum, square_sum = 0, 0
+    for value in cluster_values:
+        value_sum += value
+        square_sum += value * value
+    return get_request_error(rate, value_sum, square_sum)
+
+
+def get_block_error(
+        block_number: int,
+        sampled_blocks: Sequence[Tuple[int, float]]
+) -> Union[float, None]:
+    """
+    Return a relative error of a total estimated by a ratio to block sizes.
+
+    A total is estimated as a sampled total per sampled byte times the log
+    size, its variance depends on the spread of block totals around this
+    ratio.
+
+    :param block_number: a number of all log blocks;
+    :param sampled_blocks: pairs (block_size, block_total) of sampled
+    blocks;
+    :return: a relative half-width of the 95% confidence interval. None if
+    less than two blocks are sampled.
+    """
+    sampled_number = len(sampled_blocks)
+    value_sum = sum(value for _, value in sampled_blocks)
+    if sampled_number < 2 or not value_sum:
+        return None
+    ratio = value_sum / sum(size for size, _ in sampled_blocks)
+    residual_variance = sum(
+        (value - ratio * size) ** 2 for size, value in sampled_blocks
+    ) / (sampled_number - 1)
+    sampled_share = sampled_number / block_number
+    value_mean = value_sum / sampled_number
+    return CONFIDENCE_Z * math.sqrt(
+        (1 - sampled_share) * residual_variance / sampled_number
+    ) / value_mean
+
+
+def scale_aggregates(
+        aggregates: AggregateStore,
+        scale: float,
+        scale_urls: bool = True
+):
+    """
+    Multiply counts and sums of sampled aggregates to estimate full ones.
+
+    Maximums and request time histograms are kept: quantiles do not depend
+    on the number of requests.
+
+    :param aggregates: a store of sampled requests;
+    :param scale: a reciprocal of the sampling rate;
+    :param scale_urls: False if per-URL values are complete, e.g. all
+    requests of sampled URLs are aggregated. Only totals and time series
+    are scaled then.
+    """
+    def scale_values(values: array) -> array:
+        return array(
+            values.typecode,
+            [round(value * scale) for value in values]
+        )
+
+    aggregates.total_request_number = round(
+        aggregates.total_request_number * scale
+    )
+    aggregates.total_request_time = round(
+        aggregates.total_request_time * scale
+    )
+    if aggregates.dimensions:
+        aggregates.minute_counts = scale_values(aggregates.minute_counts)
+        aggregates.minute_time_sums = scale_values(
+            aggregates.minute_time_sums
+        )
+    if not scale_urls:
+        return
+    aggregates.counts = scale_values(aggregates.counts)
+    aggregates.time_sums = scale_values(aggregates.time_sums)
+    if aggregates.dimensions:
+        aggregates.bytes_sums = scale_values(aggregates.bytes_sums)
+        aggregates.status_counts = scale_values(aggregates.status_counts)
+
+
+def add_count_errors(
+        report_list: Iterable[Mapping[str, Union[str, float]]],
+        summary: SampleSummary
+):
+    """
+    Add a relative 95% error of a URL count to rows of a request sample.
+
+    Requests are sampled independently, so a sampled URL count is binomial.
+    Rows of a URL sample are complete. Requests of a block sample are
+    sampled together with their neighbours, so the binomial error does not
+    apply and per-URL errors are not estimated.
+
+    :param report_list: dicts containing URL statistics;
+    :param summary: a summary of the sample.
+    """
+    if summary.mode != 'request':
+        return
+    for row in report_list:
+        sampled_count = max(round(row['count'] / summary.scale), 1)
+        row['count_error'] = (
+            CONFIDENCE_Z * math.sqrt((1 - summary.rate) / sampled_count)
+        )
+
+
+def get_sample_note(summary: SampleSummary) -> str:
+    """
+    Return a report annotation describing a sample and its errors.
+
+    :param summary: a summary of the sample;
+    :return: a plain text note.
+    """
+    note = (
+        f'Approximate report: {summary.rate:.2%} of '
+        f'{SAMPLE_MODE_DESCRIPTIONS[summary.mode]}.'
+    )
+    if summary.mode == 'url':
+        note += (
+            ' Values of listed URLs are exact, totals are scaled by '
+            f'{summary.scale:.4g}.'
+        )
+    elif summary.mode == 'request':
+        note += (
+            f' Counts and time sums are scaled by {summary.scale:.4g}, '
+            'count_error is a relative 95% error of a URL count.'
+        )
+    else:
+        note += f' Counts and time sums are scaled by {summary.scale:.4g}.'
+    if summary.count_error is None or summary.time_error is None:
+        return f'{note} Errors of totals can not be estimated.'
+    return (
+        f'{note} Total requests are within ±{summary.count_error:.1%} '
+        f'and total request time within ±{summary.time_error:.1%} '
+        'with 95% confidence.'
+    )
@@ -0,0 +1,128 @@
+"""Concurrent reading of same-day logs of several sources."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Generator, List, Sequence, Tuple
+
+from constants import DEFAULT_SOURCE_CONCURRENCY, DEFAULT_SOURCE_QUEUE_SIZE
+
+LogReader = Generator[Tuple, None, None]
+
+NOTE_BATCH_SIZE = 10000
+
+
+async def read_source(
+        log_reader: LogReader,
+        note_queue: asyncio.Queue,
+        executor: ThreadPoolExecutor,
+        semaphore: asyncio.Semaphore
+):
+    """
+    Put batches of log notes of a source to a queue.
+
+    Blocking reading and parsing runs in executor threads. The coroutine
+    waits while the queue is full, so a slow aggregation stops the reading.
+
+    :param log_reader: an iterator of log notes of the source;
+    :param note_queue: a queue of note batches. The source puts its
+    exception or None at the end;
+    :param executor: a pool of reading threads;
+    :param semaphore: a limit of sources read at the same time.
+    """
+    loop = asyncio.get_running_loop()
+    async with semaphore:
+        try:
+            while True:
+                note_batch = await loop.run_in_executor(
+                    executor,
+                    list,
+                    islice(log_reader, NOTE_BATCH_SIZE)
+                )
+                if not note_batch:
+                    break
+                await note_queue.put(note_batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            await note_queue.put(error)
+            return
+    await note_queue.put(None)
+
+
+async def consume_sources(
+        log_readers: Sequence[LogReader],
+        aggregate_batch: Callable[[List[Tuple]], None],
+        source_concurrency: int,
+        queue_size: int
+):
+    """
+    Read sources concurrently and pass note batches to an aggregation.
+
+    :param log_readers: iterators of log notes, one per source;
+    :param aggregate_batch: a function adding a batch of notes to a shared
+    aggregation. It runs in the event loop thread;
+    :param source_concurrency: a number of sources read at the same time;
+    :param queue_size: a maximum number of batches waiting for
+    the aggregation.
+    """
+    note_queue = asyncio.Queue(maxsize=queue_size)
+    semaphore = asyncio.Semaphore(source_concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=source_concurrency) as executor:
+            readers = [
+                asyncio.create_task(
+                    read_source(log_reader, note_queue, executor, semaphore)
+                )
+                for log_reader in log_readers
+            ]
+            try:
+                finished_reader_number = 0
+                while finished_reader_number < len(readers):
+                    note_batch = await note_queue.get()
+                    if note_batch is None:
+                        finished_reader_number += 1
+                    elif isinstance(note_batch, Exception):
+                        raise note_batch
+                    else:
+                        aggregate_batch(note_batch)
+            finally:
+                for reader in readers:
+                    reader.cancel()
+                await asyncio.gather(*readers, return_exceptions=True)
+    finally:
+        # Threads are joined, so no reader is running and all can be closed.
+        for log_reader in log_readers:
+            log_reader.close()
+
+
+def ingest_sources(
+        log_readers: Sequence[LogReader],
+        aggregate_batch: Callable[[List[Tuple]], None],
+        source_concurrency: int = DEFAULT_SOURCE_CONCURRENCY,
+        queue_size: int = DEFAULT_SOURCE_QUEUE_SIZE
+):
+    """
+    Aggregate log notes of several sources read concurrently.
+
+    At most source_concurrency sources are open and at most queue_size
+    batches of NOTE_BATCH_SIZE notes wait in the queue besides batches
+    being read, so memory does not depend on the number of sources.
+    Reading threads are joined before the function returns or raises
+    an exception of a source or the aggregation.
+
+    :param log_readers: iterators of log notes, one per source;
+    :param aggregate_batch: a function adding a batch of notes to a shared
+    aggregation;
+    :param source_concurrency: a number of sources read at the same time;
+    :param queue_size: a maximum number of batches waiting for
+    the aggregation.
+    """
+    asyncio.run(
+        consume_sources(
+            log_readers,
+            aggregate_batch,
+            source_concurrency,
+            queue_size
+        )
+    )
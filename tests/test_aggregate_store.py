@@ -0,0 +1,232 @@
+from inspect import getsourcefile
+import os
+import random
+import sys
+import unittest
+
+test_module_path = os.path.abspath(getsourcefile(lambda: 0))
+script_dir_path = os.path.dirname(os.path.dirname(test_module_path))
+sys.path.insert(0, script_dir_path)
+
+from aggregate_store import AggregateStore  # noqa: E402
+from batch_aggregation import RequestBlock, numpy_available  # noqa: E402
+from constants import MINUTES_PER_DAY, OTHER_URL  # noqa: E402
+from url_normalization import UrlRules, check_custom_rules  # noqa: E402
+from url_normalization import get_url_normalizer  # noqa: E402
+from url_normalization import get_url_rules_digest  # noqa: E402
+
+
+class MergeStores(unittest.TestCase):
+    """Check if merged stores equal a store filled sequentially."""
+    def test_merge(self):
+        random_generator = random.Random(0)
+        requests = [
+            (f'/api/v2/banner/{random_generator.randrange(50)}',
+             round(random_generator.expovariate(3), 3))
+            for _ in range(2000)
+        ]
+        store = AggregateStore()
+        parts = [AggregateStore() for _ in range(3)]
+        for request_number, (url, request_time) in enumerate(requests):
+            store.add(url, request_time)
+            parts[request_number % 3].add(url, request_time)
+
+        merged_store = parts[0]
+        merged_store.merge(parts[1])
+        merged_store.merge(parts[2])
+        self.assertEqual(len(merged_store), len(store))
+        self.assertEqual(
+            merged_store.total_request_time,
+            store.total_request_time
+        )
+        for url_id, url in enumerate(store.urls):
+            merged_id = merged_store.url_ids[url]
+            self.assertEqual(
+                merged_store.counts[merged_id],
+                store.counts[url_id]
+            )
+            self.assertEqual(
+                merged_store.time_sums[merged_id],
+                store.time_sums[url_id]
+            )
+            self.assertEqual(
+                merged_store.time_maxs[merged_id],
+                store.time_maxs[url_id]
+            )
+            self.assertEqual(
+                merged_store.get_quantile(merged_id, 0.5),
+                store.get_quantile(url_id, 0.5)
+            )
+
+    def test_merged_store_is_unchanged(self):
+        source_store = AggregateStore()
+        for request_time in (0.1, 0.2, 0.3):
+            source_store.add('/api/1', request_time)
+        median = source_store.get_quantile(0, 0.5)
+
+        merged_store = AggregateStore()
+        merged_store.merge(source_store)
+        other_store = AggregateStore()
+        for request_time in (5, 6, 7):
+            other_store.add('/api/1', request_time)
+        merged_store.merge(other_store)
+        merged_store.add('/api/1', 8)
+        self.assertEqual(source_store.get_quantile(0, 0.5), median)
+        self.assertEqual(source_store.histograms[0].count, 3)
+        self.assertEqual(merged_store.histograms[0].count, 7)
+
+
+class UrlCardinality(unittest.TestCase):
+    """Check URL normalization and the URL number limit."""
+    def test_normalize_url(self):
+        normalize_url = get_url_normalizer(
+            UrlRules(True, True, [['^/export/[^/]+', '/export/{file}']], 10)
+        )
+        test_urls = {
+            '/api/v2/banner/25019354?page=2': '/api/v2/banner/{id}',
+            '/api/1/photo/4e2b5f0f-8b4a-4c6e-9d1a-0f3c2e7b9a11/':
+                '/api/{id}/photo/{uuid}/',
+            '/static/d41d8cd98f00b204e9800998ecf8427e/app.js':
+                '/static/{hash}/app.js',
+            '/export/report.csv': '/export/{file}',
+            '/api/v2/banner/v25': '/api/v2/banner/v25',
+        }
+        for url, expected_url in test_urls.items():
+            self.assertEqual(normalize_url(url), expected_url)
+
+    def test_custom_rules(self):
+        check_custom_rules([['^/export/[^/]+', '/export/{file}']])
+        invalid_rules = (
+            [['^/export/[^/+', '/export/{file}']],
+            [['^/export/([^/]+)', r'/export/\2']],
+            [['^/export/']],
+            ['^/export/'],
+        )
+        for custom_rules in invalid_rules:
+            with self.assertRaises(ValueError):
+                check_custom_rules(custom_rules)
+
+    def test_url_rules_digest(self):
+        url_rules = UrlRules(True, True, [['^/export/[^/]+', '/export/']], 10)
+        self.assertEqual(
+            get_url_rules_digest(url_rules),
+            get_url_rules_digest(url_rules._replace(cache_size=100))
+        )
+        self.assertNotEqual(
+            get_url_rules_digest(url_rules),
+            get_url_rules_digest(url_rules._replace(custom_rules=[]))
+        )
+        self.assertNotEqual(
+            get_url_rules_digest(url_rules),
+            get_url_rules_digest(None)
+        )
+
+    def test_max_url_number(self):
+        store = AggregateStore(max_url_number=3)
+        for url_number in range(10):
+            store.add(f'/api/{url_number}', 1.0)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.urls[-1], OTHER_URL)
+        self.assertEqual(store.counts[store.url_ids[OTHER_URL]], 7)
+
+        other_store = AggregateStore()
+        for url_number in range(5):
+            other_store.add(f'/api/{url_number + 20}', 1.0)
+        store.merge(other_store)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.counts[store.url_ids[OTHER_URL]], 12)
+        self.assertEqual(store.total_request_number, 15)
+
+
+class RequestDimensions(unittest.TestCase):
+    """Check status classes, body bytes and per-minute series."""
+    def test_merge_dimensions(self):
+        random_generator = random.Random(0)
+        requests = [
+            (f'/api/v2/banner/{random_generator.randrange(20)}',
+             round(random_generator.expovariate(3), 3),
+             random_generator.choice((200, 302, 404, 499, 502)),
+             random_generator.randrange(10000),
+             random_generator.randrange(MINUTES_PER_DAY))
+            for _ in range(1000)
+        ]
+        store = AggregateStore(dimensions=True)
+        parts = [AggregateStore(dimensions=True) for _ in range(3)]
+        for request_number, request in enumerate(requests):
+            store.add_request(*request)
+            parts[request_number % 3].add_request(*request)
+
+        merged_store = AggregateStore(dimensions=True)
+        for part in parts:
+            merged_store.merge(AggregateStore.from_state(part.to_state()))
+
+        for url, url_id in store.url_ids.items():
+            merged_id = merged_store.url_ids[url]
+            self.assertEqual(
+                merged_store.bytes_sums[merged_id],
+                store.bytes_sums[url_id]
+            )
+            self.assertEqual(
+                merged_store.get_status_counts(merged_id),
+                store.get_status_counts(url_id)
+            )
+        self.assertEqual(merged_store.minute_counts, store.minute_counts)
+        self.assertEqual(
+            merged_store.minute_time_sums,
+            store.minute_time_sums
+        )
+        self.assertEqual(
+            merged_store.minute_time_maxs,
+            store.minute_time_maxs
+        )
+        self.assertEqual(sum(store.status_counts), len(requests))
+        self.assertEqual(
+            sum(store.bytes_sums),
+            sum(request[3] for request in requests)
+        )
+
+
+@unittest.skipUnless(numpy_available(), 'NumPy is not installed')
+class BatchAggregation(unittest.TestCase):
+    """Check if stores filled by request blocks equal sequential stores."""
+    def get_requests(self, request_number):
+        random_generator = random.Random(0)
+        return [
+            (f'/api/v2/banner/{random_generator.randrange(300)}',
+             random_generator.choice((
+                 0.0,
+                 round(random_generator.expovariate(3), 3),
+                 round(random_generator.paretovariate(1), 3),
+             )),
+             random_generator.choice((101, 200, 302, 404, 502, 600)),
+             random_generator.randrange(10000),
+             random_generator.randrange(MINUTES_PER_DAY))
+            for _ in range(request_number)
+        ]
+
+    def test_blocks(self):
+        requests = self.get_requests(5000)
+        for max_url_number in (None, 100):
+            store = AggregateStore(max_url_number)
+            block_store = AggregateStore(max_url_number)
+            request_block = RequestBlock(block_store, block_size=777)
+            for url, request_time, *_ in requests:
+                store.add(url, request_time)
+                request_block.add(url, request_time)
+            request_block.flush()
+            self.assertEqual(block_store.to_state(), store.to_state())
+
+    def test_block_dimensions(self):
+        requests = self.get_requests(3000)
+        store = AggregateStore(dimensions=True)
+        block_store = AggregateStore(dimensions=True)
+        request_block = RequestBlock(block_store, block_size=1000)
+        for request in requests:
+            store.add_request(*request)
+            request_block.add_request(*request)
+        request_block.flush()
+        self.assertEqual(block_store.to_state(), store.to_state())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+from datetime import date
+from inspect import getsourcefile
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+test_module_path = os.path.abspath(getsourcefile(lambda: 0))
+script_dir_path = os.path.dirname(os.path.dirname(test_module_path))
+sys.path.insert(0, script_dir_path)
+
+from constants import REPORT_NAME_TEMPLATE  # noqa: E402
+from daemon import run_daemon  # noqa: E402
+from log_analyzer import default_config  # noqa: E402
+
+CRASHING_LOG_DATE = date(2000, 1, 1)
+
+
+def process_log_or_crash(log_path, log_date, configuration):
+    """Kill a worker on the crashing log and render an empty report else."""
+    if log_date == CRASHING_LOG_DATE:
+        os._exit(1)
+    report_name = REPORT_NAME_TEMPLATE.format(
+        str(log_date).replace("-", ".")
+    )
+    with open(os.path.join(configuration['REPORT_DIR'], report_name), 'w'):
+        pass
+
+
+class BrokenWorkerPool(unittest.TestCase):
+    """Keep the daemon running if a worker process dies."""
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.temp_dir, 'logs')
+        os.mkdir(self.log_dir)
+        for log_name in (
+                'nginx-access-ui.log-20000101',
+                'nginx-access-ui.log-20170101'
+        ):
+            with open(os.path.join(self.log_dir, log_name), 'w'):
+                pass
+        self.status_path = os.path.join(self.temp_dir, 'status.json')
+        self.configuration = {
+            **default_config,
+            'LOG_DIR': self.log_dir,
+            'REPORT_DIR': self.temp_dir,
+            'BATCH_WORKER_NUMBER': 1,
+            'DAEMON_SETTLE_TIME': 0,
+            'DAEMON_USE_INOTIFY': False,
+            'DAEMON_POLL_INTERVAL': 0.1,
+            'DAEMON_STATUS_PATH': self.status_path,
+            'REPORT_INDEX': False,
+        }
+        self.signal_handlers = {
+            signal_number: signal.getsignal(signal_number)
+            for signal_number in (signal.SIGTERM, signal.SIGINT)
+        }
+
+    def stop_daemon(self):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                with open(self.status_path, 'r') as status_file:
+                    status = json.load(status_file)
+            except (OSError, ValueError):
+                status = {}
+            if status.get('processed') and status.get('failed'):
+                break
+            if self.daemon_stopped.wait(0.1):
+                return
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def test_broken_pool(self):
+        self.daemon_stopped = threading.Event()
+        stop_thread = threading.Thread(target=self.stop_daemon, daemon=True)
+        stop_thread.start()
+        try:
+            run_daemon(self.configuration, process_log_or_crash)
+        finally:
+            self.daemon_stopped.set()
+        stop_thread.join()
+
+        with open(self.status_path, 'r') as status_file:
+            status = json.load(status_file)
+        self.assertEqual(status['state'], 'stopped')
+        self.assertEqual(status['failed'], 1)
+        self.assertEqual(status['processed'], 1)
+        report_path = os.path.join(self.temp_dir, 'report-2017.01.01.html')
+        self.assertTrue(os.path.exists(report_path))
+
+    def tearDown(self) -> None:
+        for signal_number, handler in self.signal_handlers.items():
+            signal.signal(signal_number, handler)
+        shutil.rmtree(self.temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+from datetime import date
+from inspect import getsourcefile
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+test_module_path = os.path.abspath(getsourcefile(lambda: 0))
+script_dir_path = os.path.dirname(os.path.dirname(test_module_path))
+sys.path.insert(0, script_dir_path)
+
+from aggregate_store import AggregateStore  # noqa: E402
+from daily_cache import evict_daily_aggregates, get_cache_path  # noqa: E402
+from daily_cache import load_daily_aggregates  # noqa: E402
+from daily_cache import save_daily_aggregates  # noqa: E402
+
+
+class DailyCache(unittest.TestCase):
+    """Check invalidation and eviction of cached daily aggregates."""
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.temp_dir, 'log')
+        with open(self.log_path, 'w') as log_file:
+            log_file.write('log')
+        self.aggregates = AggregateStore()
+        self.aggregates.add('/api/v2/banner/1', 0.5)
+
+    def test_changed_log(self):
+        cache_path = get_cache_path(self.temp_dir, date(2019, 9, 30))
+        save_daily_aggregates(cache_path, self.log_path, self.aggregates)
+        self.assertEqual(len(load_daily_aggregates(cache_path)), 1)
+
+        with open(self.log_path, 'a') as log_file:
+            log_file.write('new line')
+        self.assertIsNone(load_daily_aggregates(cache_path))
+        self.assertFalse(os.path.exists(cache_path))
+
+    def test_changed_url_rules(self):
+        cache_path = get_cache_path(self.temp_dir, date(2019, 9, 30))
+        save_daily_aggregates(
+            cache_path,
+            self.log_path,
+            self.aggregates,
+            'old rules'
+        )
+        self.assertIsNone(load_daily_aggregates(cache_path, 'new rules'))
+        self.assertFalse(os.path.exists(cache_path))
+
+    def test_eviction(self):
+        cache_paths = []
+        for day in range(1, 4):
+            cache_path = get_cache_path(self.temp_dir, date(2019, 9, day))
+            save_daily_aggregates(cache_path, self.log_path, self.aggregates)
+            os.utime(cache_path, (day, day))
+            cache_paths.append(cache_path)
+
+        cache_size = os.path.getsize(cache_paths[0])
+        evict_daily_aggregates(self.temp_dir, 2 * cache_size)
+        self.assertEqual(
+            [os.path.exists(cache_path) for cache_path in cache_paths],
+            [False, True, True],
+            msg='The least recently used cache is not evicted.'
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
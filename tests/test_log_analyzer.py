@@ -1,9 +1,14 @@
+import csv
+import gzip
 import json
 from inspect import getsourcefile
 import os
 import re
 import shutil
+import signal
 import subprocess
+import sys
+import time
 import unittest
 
 test_module_path = os.path.abspath(getsourcefile(lambda: 0))
@@ -33,7 +38,7 @@ EXPECTED_REPORT_PATH = os.path.join(TEST_REPORTS_DIR, EXPECTED_REPORT_NAME)
 SHELL_ARGS = ['python', SCRIPT_PATH, '--config']
 
 
-def create_test_dirs(*log_names):
+def create_test_dirs(*log_names, **config_params):
     """Create test directories."""
     os.mkdir(TEST_REPORTS_DIR)
     os.mkdir(TEST_INPUT_LOGS_DIR)
@@ -46,7 +51,8 @@ def create_test_dirs(*log_names):
         config = {
             'REPORT_SIZE': 10,
             'REPORT_DIR': TEST_REPORTS_DIR,
-            'LOG_DIR': TEST_INPUT_LOGS_DIR
+            'LOG_DIR': TEST_INPUT_LOGS_DIR,
+            **config_params
         }
         json.dump(config, config_file)
 
@@ -117,6 +123,619 @@ class GzipLog(unittest.TestCase):
         shutil.rmtree(TEST_INPUT_LOGS_DIR)
 
 
+def get_report_table(report_path):
+    """Return a table inserted into a report."""
+    open_report = gzip.open if report_path.endswith('.gz') else open
+    with open_report(report_path, 'rt') as report_file:
+        report = report_file.read()
+
+    table_str = re.search(r'var table = (.*);', report).group(1)
+    return json.loads(table_str)
+
+
+class ParallelParsing(unittest.TestCase):
+    """Parse the log in several processes."""
+    def setUp(self) -> None:
+        create_test_dirs(
+            LATEST_LOG_NAME,
+            WORKER_NUMBER=3,
+            CHUNK_SIZE=4096,
+            USE_MMAP=True
+        )
+
+    def test_parallel_parsing(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        report_table = get_report_table(EXPECTED_REPORT_PATH)
+        expected_table = get_report_table(CORRECT_REPORT_PATH)
+        self.assertEqual(report_table, expected_table, msg='Invalid report.')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class RegexParser(unittest.TestCase):
+    """Parse the log with regular expressions instead of the fast parser."""
+    def setUp(self) -> None:
+        create_test_dirs(LATEST_LOG_NAME, LOG_PARSER='regex')
+
+    def test_regex_parser(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        with open(EXPECTED_REPORT_PATH, 'r') as report_file:
+            report = report_file.read()
+
+        with open(CORRECT_REPORT_PATH, 'r') as expected_report_file:
+            expected_report = expected_report_file.read()
+
+        self.assertEqual(report, expected_report, msg='Invalid report.')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class NumpyAggregation(unittest.TestCase):
+    """Aggregate requests by NumPy blocks or in Python without NumPy."""
+    def setUp(self) -> None:
+        create_test_dirs(LATEST_LOG_NAME, NUMPY_AGGREGATION=True)
+
+    def test_numpy_aggregation(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        with open(EXPECTED_REPORT_PATH, 'r') as report_file:
+            report = report_file.read()
+
+        with open(CORRECT_REPORT_PATH, 'r') as expected_report_file:
+            expected_report = expected_report_file.read()
+
+        self.assertEqual(report, expected_report, msg='Invalid report.')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class IncrementalProcessing(unittest.TestCase):
+    """Parse new lines of a growing live log."""
+    def setUp(self) -> None:
+        create_test_dirs(INCREMENTAL=True)
+        self.live_log_path = os.path.join(
+            TEST_INPUT_LOGS_DIR,
+            'nginx-access-ui.log'
+        )
+        self.live_report_path = os.path.join(
+            TEST_REPORTS_DIR,
+            'report-live.html'
+        )
+        with open(os.path.join(TEST_DATA_DIR, LATEST_LOG_NAME), 'rb') as log:
+            self.log_lines = log.readlines()
+        if not self.log_lines[-1].endswith(b'\n'):
+            self.log_lines[-1] += b'\n'
+
+    def write_live_log(self, lines, mode='wb'):
+        with open(self.live_log_path, mode) as live_log:
+            live_log.writelines(lines)
+
+    def test_growing_log(self):
+        self.write_live_log(self.log_lines[:500])
+        self.write_live_log([self.log_lines[500][:50]], 'ab')
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        self.write_live_log(
+            [self.log_lines[500][50:], *self.log_lines[501:]],
+            'ab'
+        )
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+        self.assertEqual(
+            get_report_table(self.live_report_path),
+            get_report_table(CORRECT_REPORT_PATH),
+            msg='Invalid report.'
+        )
+
+    def test_rotated_log(self):
+        self.write_live_log(self.log_lines[300:])
+        subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+
+        # A new file replaces the live log, so it has another inode.
+        rotated_log_path = f'{self.live_log_path}.new'
+        with open(rotated_log_path, 'wb') as rotated_log:
+            rotated_log.writelines(self.log_lines[:300])
+        os.replace(rotated_log_path, self.live_log_path)
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+        top_row = get_report_table(self.live_report_path)[0]
+        self.assertEqual(
+            round(top_row['count'] / top_row['count_perc']),
+            300,
+            msg='Counts are not reset after the rotation.'
+        )
+
+    def test_empty_log(self):
+        self.write_live_log([])
+        res = subprocess.run(
+            [*SHELL_ARGS, CUSTOM_CONFIG_PATH],
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+        self.assertNotIn('Traceback', res.stderr)
+        self.assertFalse(os.path.exists(self.live_report_path))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class BatchMode(unittest.TestCase):
+    """Process all unprocessed logs and continue past failed ones."""
+    def setUp(self) -> None:
+        create_test_dirs(
+            FIRST_LOG_NAME,
+            LATEST_LOG_NAME,
+            INVALID_LOG_NAME,
+            OTHER_SERVICE_LOG_NAME
+        )
+
+    def test_batch_mode(self):
+        res = subprocess.run(
+            [*SHELL_ARGS, CUSTOM_CONFIG_PATH, '--batch'],
+            stderr=subprocess.PIPE
+        )
+        self.assertEqual(
+            res.returncode,
+            1,
+            msg='The script has not reported the invalid log.'
+        )
+        self.assertIn(INVALID_LOG_NAME, str(res.stderr))
+        report_names = [
+            file_name for file_name in os.listdir(TEST_REPORTS_DIR)
+            if file_name.endswith('.html')
+        ]
+        self.assertEqual(
+            sorted(report_names),
+            ['report-2017.01.01.html', EXPECTED_REPORT_NAME],
+            msg='The script has not processed all valid logs.'
+        )
+        self.assertEqual(
+            get_report_table(EXPECTED_REPORT_PATH),
+            get_report_table(CORRECT_REPORT_PATH),
+            msg='Invalid report.'
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class RollupReport(unittest.TestCase):
+    """Render a report for a date range from cached daily aggregates."""
+    def setUp(self) -> None:
+        create_test_dirs(FIRST_LOG_NAME, LATEST_LOG_NAME)
+
+    def test_rollup_from_cache(self):
+        subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertTrue(os.path.exists(
+            os.path.join(TEST_REPORTS_DIR, '.aggregates-2019.09.30.json.gz')
+        ))
+        os.remove(os.path.join(TEST_INPUT_LOGS_DIR, LATEST_LOG_NAME))
+
+        res = subprocess.run([
+            *SHELL_ARGS,
+            CUSTOM_CONFIG_PATH,
+            '--rollup',
+            '2019-09-24',
+            '2019-09-30'
+        ])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+        rollup_report_path = os.path.join(
+            TEST_REPORTS_DIR,
+            'report-rollup-2019.09.24-2019.09.30.html'
+        )
+        self.assertEqual(
+            get_report_table(rollup_report_path),
+            get_report_table(CORRECT_REPORT_PATH),
+            msg='Invalid rollup report.'
+        )
+
+    def test_rollup_from_logs(self):
+        res = subprocess.run([
+            *SHELL_ARGS,
+            CUSTOM_CONFIG_PATH,
+            '--rollup',
+            '2017-01-01',
+            '2019-09-30'
+        ])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+        rollup_report_path = os.path.join(
+            TEST_REPORTS_DIR,
+            'report-rollup-2017.01.01-2019.09.30.html'
+        )
+        report_table = get_report_table(rollup_report_path)
+        self.assertEqual(len(report_table), 10)
+        self.assertEqual(
+            {name for name in os.listdir(TEST_REPORTS_DIR) if '.json' in name},
+            {
+                '.aggregates-2017.01.01.json.gz',
+                '.aggregates-2019.09.30.json.gz',
+            },
+            msg='Parsed daily aggregates are not cached.'
+        )
+
+    def test_rollup_skips_invalid_day(self):
+        shutil.copy2(
+            os.path.join(TEST_DATA_DIR, INVALID_LOG_NAME),
+            os.path.join(TEST_INPUT_LOGS_DIR, INVALID_LOG_NAME)
+        )
+        os.remove(os.path.join(TEST_INPUT_LOGS_DIR, FIRST_LOG_NAME))
+        res = subprocess.run([
+            *SHELL_ARGS,
+            CUSTOM_CONFIG_PATH,
+            '--rollup',
+            '2000-01-01',
+            '2019-09-30'
+        ])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+        rollup_report_path = os.path.join(
+            TEST_REPORTS_DIR,
+            'report-rollup-2000.01.01-2019.09.30.html'
+        )
+        self.assertEqual(
+            get_report_table(rollup_report_path),
+            get_report_table(CORRECT_REPORT_PATH),
+            msg='A day with too many parsing errors is merged.'
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class ReportSortKey(unittest.TestCase):
+    """Select top URLs by a configured column."""
+    def setUp(self) -> None:
+        create_test_dirs(LATEST_LOG_NAME, REPORT_SORT_KEY='count')
+
+    def test_sort_by_count(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        report_table = get_report_table(EXPECTED_REPORT_PATH)
+        counts = [row['count'] for row in report_table]
+        self.assertEqual(len(report_table), 10)
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertEqual(counts[0], 119, msg='Invalid top URL.')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class ReportFormats(unittest.TestCase):
+    """Render a compressed report and table files."""
+    def setUp(self) -> None:
+        create_test_dirs(
+            LATEST_LOG_NAME,
+            REPORT_GZIP=True,
+            REPORT_TABLE_FORMATS=['json', 'csv']
+        )
+
+    def test_report_formats(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        correct_table = get_report_table(CORRECT_REPORT_PATH)
+        self.assertEqual(
+            get_report_table(f'{EXPECTED_REPORT_PATH}.gz'),
+            correct_table,
+            msg='Invalid compressed report.'
+        )
+        table_path_base = os.path.join(TEST_REPORTS_DIR, 'report-2019.09.30')
+        with open(f'{table_path_base}.json', 'r') as table_file:
+            json_rows = json.load(table_file)
+        self.assertEqual(len(json_rows), 934, msg='The table is truncated.')
+        self.assertEqual(json_rows[:len(correct_table)], correct_table)
+        with open(f'{table_path_base}.csv', 'r') as table_file:
+            csv_rows = list(csv.DictReader(table_file))
+        self.assertEqual(
+            [row['url'] for row in csv_rows],
+            [row['url'] for row in json_rows]
+        )
+
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(
+            res.returncode,
+            1,
+            msg='The script has repeated the work.'
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class RunMetrics(unittest.TestCase):
+    """Export metrics of the script stages."""
+    def setUp(self) -> None:
+        self.json_path = os.path.join(TEST_REPORTS_DIR, 'metrics.json')
+        self.prometheus_path = os.path.join(TEST_REPORTS_DIR, 'metrics.prom')
+        create_test_dirs(
+            LATEST_LOG_NAME,
+            METRICS_JSON_PATH=self.json_path,
+            METRICS_PROMETHEUS_PATH=self.prometheus_path
+        )
+
+    def test_metrics_export(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        with open(self.json_path, 'r') as metrics_file:
+            metrics = json.load(metrics_file)
+        stage_names = {'aggregate', 'report', 'render', 'total'}
+        self.assertTrue(stage_names <= set(metrics['stages']))
+        self.assertEqual(metrics['counters']['lines_total'], 1247)
+        self.assertEqual(metrics['gauges']['unique_urls'], 934)
+        self.assertEqual(metrics['counters']['parse_errors_total'], 0)
+
+        with open(self.prometheus_path, 'r') as metrics_file:
+            prometheus_metrics = metrics_file.read()
+        self.assertIn(
+            'log_analyzer_stage_wall_seconds{stage="aggregate"}',
+            prometheus_metrics
+        )
+        self.assertIn('log_analyzer_lines_total 1247\n', prometheus_metrics)
+        self.assertIn(
+            '# TYPE log_analyzer_lines_total counter\n',
+            prometheus_metrics
+        )
+        self.assertIn(
+            '# TYPE log_analyzer_unique_urls gauge\n',
+            prometheus_metrics
+        )
+
+    def test_batch_metrics(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH, '--batch'])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        with open(self.json_path, 'r') as metrics_file:
+            metrics = json.load(metrics_file)
+        self.assertEqual(metrics['stages']['aggregate']['calls'], 1)
+        self.assertEqual(metrics['counters']['lines_total'], 1247)
+        self.assertEqual(metrics['gauges']['unique_urls'], 934)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class ReportDimensions(unittest.TestCase):
+    """Add status classes, body bytes and a request time series."""
+    def setUp(self) -> None:
+        create_test_dirs(LATEST_LOG_NAME, REPORT_DIMENSIONS=True)
+
+    def test_report_dimensions(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        report_table = get_report_table(EXPECTED_REPORT_PATH)
+        correct_table = get_report_table(CORRECT_REPORT_PATH)
+        self.assertEqual(
+            [row['url'] for row in report_table],
+            [row['url'] for row in correct_table]
+        )
+        for row in report_table:
+            status_count = sum(
+                row[f'status_{status_class}']
+                for status_class in ('1xx', '2xx', '3xx', '4xx', '5xx')
+            )
+            self.assertEqual(status_count, row['count'])
+            self.assertIn('bytes_sum', row)
+
+        timeline_path = os.path.join(
+            TEST_REPORTS_DIR,
+            'timeline-2019.09.30.json'
+        )
+        with open(timeline_path, 'r') as timeline_file:
+            timeline = json.load(timeline_file)
+        self.assertEqual(
+            [(row['minute'], row['count']) for row in timeline],
+            [('03:50', 104), ('03:52', 21), ('03:53', 1122)]
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class MultiSourceLogs(unittest.TestCase):
+    """Merge same-day logs of several hosts into one report."""
+    def setUp(self) -> None:
+        create_test_dirs(MULTI_SOURCE_LOGS=True, SOURCE_CONCURRENCY=2)
+        for log_name, source_log_name in (
+                (LATEST_LOG_NAME, 'nginx-access-ui.log-20190930-web01'),
+                (LATEST_PACKED_LOG_NAME,
+                 'nginx-access-ui.log-20190930-web02.gz'),
+                (FIRST_LOG_NAME, 'nginx-access-ui.log-20170101-web01'),
+        ):
+            shutil.copy2(
+                os.path.join(TEST_DATA_DIR, log_name),
+                os.path.join(TEST_INPUT_LOGS_DIR, source_log_name)
+            )
+
+    def test_multi_source_logs(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        report_table = get_report_table(EXPECTED_REPORT_PATH)
+        correct_table = get_report_table(CORRECT_REPORT_PATH)
+        self.assertEqual(
+            [(row['url'], row['count']) for row in report_table],
+            [(row['url'], 2 * row['count']) for row in correct_table]
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class LogFormat(unittest.TestCase):
+    """Process logs of another service by a configured log format."""
+    def setUp(self) -> None:
+        create_test_dirs(
+            LATEST_LOG_NAME,
+            OTHER_SERVICE_LOG_NAME,
+            LOG_NAME_PREFIX='other_service.log-',
+            LOG_FORMAT='ui_short'
+        )
+
+    def test_log_format(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+
+        report_path = os.path.join(TEST_REPORTS_DIR, 'report-2030.01.01.html')
+        report_table = get_report_table(report_path)
+        self.assertEqual(len(report_table), 10)
+        self.assertFalse(os.path.exists(EXPECTED_REPORT_PATH))
+
+    def test_invalid_log_format(self):
+        with open(CUSTOM_CONFIG_PATH, 'r') as config_file:
+            config = json.load(config_file)
+        with open(CUSTOM_CONFIG_PATH, 'w') as config_file:
+            json.dump({**config, 'LOG_FORMAT': '$status'}, config_file)
+        res = subprocess.run(
+            [*SHELL_ARGS, CUSTOM_CONFIG_PATH],
+            stderr=subprocess.PIPE
+        )
+        self.assertEqual(res.returncode, 1)
+        self.assertIn('Invalid log format', str(res.stderr))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class InvalidUrlRules(unittest.TestCase):
+    """Exit before processing if a URL rule can not be compiled."""
+    def setUp(self) -> None:
+        create_test_dirs(
+            LATEST_LOG_NAME,
+            URL_RULES=[['^/export/[^/+', '/export/{file}']]
+        )
+
+    def test_invalid_url_rules(self):
+        res = subprocess.run(
+            [*SHELL_ARGS, CUSTOM_CONFIG_PATH],
+            stderr=subprocess.PIPE
+        )
+        self.assertEqual(res.returncode, 1)
+        self.assertIn('Invalid URL rule', str(res.stderr))
+        self.assertNotIn('Traceback', str(res.stderr))
+        self.assertFalse(os.path.exists(EXPECTED_REPORT_PATH))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+def inotify_available():
+    """Return True if the daemon can watch a directory by inotify."""
+    sys.path.insert(0, script_dir_path)
+    from daemon import InotifyWatcher
+
+    try:
+        InotifyWatcher(test_dir_path).close()
+    except (AttributeError, OSError, TypeError):
+        return False
+    return True
+
+
+def wait_for_file(file_path, timeout=30):
+    """Wait until a file exists and return True if it appeared."""
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(file_path):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+class DaemonMode(unittest.TestCase):
+    """Process new logs by a resident process until SIGTERM."""
+    def setUp(self) -> None:
+        create_test_dirs(
+            LATEST_LOG_NAME,
+            BATCH_WORKER_NUMBER=2,
+            DAEMON_POLL_INTERVAL=0.2,
+            DAEMON_SETTLE_TIME=0
+        )
+        self.status_path = os.path.join(TEST_REPORTS_DIR, 'daemon-status.json')
+
+    def run_daemon(self):
+        daemon = subprocess.Popen(
+            [*SHELL_ARGS, CUSTOM_CONFIG_PATH, '--daemon']
+        )
+        try:
+            self.assertTrue(wait_for_file(EXPECTED_REPORT_PATH))
+            shutil.copy2(
+                os.path.join(TEST_DATA_DIR, FIRST_LOG_NAME),
+                os.path.join(TEST_INPUT_LOGS_DIR, FIRST_LOG_NAME)
+            )
+            first_report_path = os.path.join(
+                TEST_REPORTS_DIR,
+                'report-2017.01.01.html'
+            )
+            self.assertTrue(wait_for_file(first_report_path))
+        finally:
+            daemon.send_signal(signal.SIGTERM)
+            returncode = daemon.wait(timeout=30)
+        self.assertEqual(returncode, 0, msg='The daemon suddenly failed.')
+
+        with open(self.status_path, 'r') as status_file:
+            status = json.load(status_file)
+        self.assertEqual(status['state'], 'stopped')
+        self.assertEqual(status['processed'], 2)
+        self.assertEqual(status['backlog'], 0)
+        self.assertIsNotNone(status['last_latency_seconds'])
+        return status
+
+    @unittest.skipUnless(inotify_available(), 'inotify is not available')
+    def test_inotify_watcher(self):
+        status = self.run_daemon()
+        self.assertEqual(status['watcher'], 'InotifyWatcher')
+
+    def test_polling_watcher(self):
+        with open(CUSTOM_CONFIG_PATH, 'r') as config_file:
+            config = json.load(config_file)
+        with open(CUSTOM_CONFIG_PATH, 'w') as config_file:
+            json.dump({**config, 'DAEMON_USE_INOTIFY': False}, config_file)
+        status = self.run_daemon()
+        self.assertEqual(status['watcher'], 'PollingWatcher')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
 class RepeatedStart(unittest.TestCase):
     """Check if the script repeats a work."""
     def setUp(self) -> None:
@@ -137,6 +756,146 @@ class RepeatedStart(unittest.TestCase):
         shutil.rmtree(TEST_INPUT_LOGS_DIR)
 
 
+class IdleRun(unittest.TestCase):
+    """Exit without heavy imports if the newest log has a report."""
+    def setUp(self) -> None:
+        create_test_dirs(LATEST_LOG_NAME)
+
+    def test_idle_run(self):
+        subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        idle_run_code = (
+            'import sys\n'
+            f'sys.argv = ["log_analyzer.py", "--config", '
+            f'{CUSTOM_CONFIG_PATH!r}]\n'
+            'import log_analyzer\n'
+            'try:\n'
+            '    log_analyzer.main()\n'
+            'finally:\n'
+            '    print(" ".join(sorted(sys.modules)))\n'
+        )
+        res = subprocess.run(
+            ['python', '-c', idle_run_code],
+            cwd=script_dir_path,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        self.assertEqual(res.returncode, 1)
+        self.assertIn('Do not find an unprocessed log file', res.stderr)
+        loaded_modules = set(res.stdout.split())
+        for heavy_module in (
+                'asyncio',
+                'concurrent.futures.process',
+                'cProfile',
+                'daemon',
+                'inspect',
+                'numpy',
+        ):
+            self.assertNotIn(heavy_module, loaded_modules)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class ReportIndex(unittest.TestCase):
+    """Look up reports in the index and rebuild it after a drift."""
+    def setUp(self) -> None:
+        create_test_dirs(LATEST_LOG_NAME)
+
+    def test_rebuild_index(self):
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+        with open(os.path.join(TEST_REPORTS_DIR, '.report-index.json')) as f:
+            report_index = json.load(f)
+        report = report_index['reports']['2019-09-30']
+        self.assertEqual(report['report_path'], EXPECTED_REPORT_PATH)
+        self.assertIsNotNone(report['seconds'])
+        log_path = os.path.join(TEST_INPUT_LOGS_DIR, LATEST_LOG_NAME)
+        self.assertEqual(report['log_paths'], [log_path])
+        self.assertIn('checksum', report_index['logs'][log_path])
+
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 1, msg='The index is not used.')
+
+        os.remove(EXPECTED_REPORT_PATH)
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 0, msg='The report is not rendered.')
+        self.assertTrue(os.path.exists(EXPECTED_REPORT_PATH))
+
+        os.remove(EXPECTED_REPORT_PATH)
+        res = subprocess.run(
+            [*SHELL_ARGS, CUSTOM_CONFIG_PATH, '--rebuild-index']
+        )
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+        with open(os.path.join(TEST_REPORTS_DIR, '.report-index.json')) as f:
+            report_index = json.load(f)
+        self.assertEqual(report_index['reports'], {})
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
+class SampleReport(unittest.TestCase):
+    """Render an approximate report of a log sample."""
+    def setUp(self) -> None:
+        create_test_dirs(
+            LATEST_LOG_NAME,
+            REPORT_SORT_KEY='count',
+            SAMPLE_BLOCK_SIZE=16 * 1024
+        )
+
+    def check_sample_report(self, sample_mode):
+        res = subprocess.run([
+            *SHELL_ARGS,
+            CUSTOM_CONFIG_PATH,
+            '--sample',
+            '0.5',
+            '--sample-mode',
+            sample_mode,
+        ])
+        self.assertEqual(res.returncode, 0, msg='The script suddenly failed.')
+        self.assertFalse(
+            os.path.exists(EXPECTED_REPORT_PATH),
+            msg='A sample marks the log as processed.'
+        )
+        sample_report_path = os.path.join(
+            TEST_REPORTS_DIR,
+            'report-2019.09.30.sample.html'
+        )
+        with open(sample_report_path, 'r') as report_file:
+            self.assertIn('Approximate report: ', report_file.read())
+        top_row = get_report_table(sample_report_path)[0]
+        self.assertEqual(top_row['url'], '/export/appinstall_raw/2017-06-29/')
+        self.assertLess(abs(top_row['count'] / 119 - 1), 0.3)
+        return top_row
+
+    def test_request_sample(self):
+        top_row = self.check_sample_report('request')
+        self.assertLess(top_row['count_error'], 0.3)
+
+    def test_block_sample(self):
+        top_row = self.check_sample_report('block')
+        self.assertNotIn('count_error', top_row)
+
+    def test_invalid_rate(self):
+        res = subprocess.run(
+            [*SHELL_ARGS, CUSTOM_CONFIG_PATH, '--sample', '2'],
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        self.assertEqual(res.returncode, 1)
+        self.assertIn('range (0, 1]', res.stderr)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_REPORTS_DIR)
+        os.remove(CUSTOM_CONFIG_PATH)
+        shutil.rmtree(TEST_INPUT_LOGS_DIR)
+
+
 class ParseErrors(unittest.TestCase):
     """Check if the script processes a log containing too many errors."""
     def setUp(self) -> None:
@@ -160,6 +919,28 @@ class ParseErrors(unittest.TestCase):
             msg=template.format(script_error_msg, expected_error_message)
         )
 
+    def test_no_timeline(self):
+        with open(os.path.join(TEST_DATA_DIR, LATEST_LOG_NAME), 'r') as file:
+            valid_line = file.readline()
+        log_path = os.path.join(TEST_INPUT_LOGS_DIR, LATEST_LOG_NAME)
+        with open(log_path, 'w') as log_file:
+            log_file.write(f'{valid_line}invalid line\ninvalid line\n')
+        with open(CUSTOM_CONFIG_PATH, 'r') as config_file:
+            config = json.load(config_file)
+        config.update(REPORT_DIMENSIONS=True, PREFLIGHT_SAMPLE=False)
+        with open(CUSTOM_CONFIG_PATH, 'w') as config_file:
+            json.dump(config, config_file)
+        res = subprocess.run([*SHELL_ARGS, CUSTOM_CONFIG_PATH])
+        self.assertEqual(res.returncode, 1)
+        timeline_path = os.path.join(
+            TEST_REPORTS_DIR,
+            'timeline-2019.09.30.json'
+        )
+        self.assertFalse(
+            os.path.exists(timeline_path),
+            msg='The script has saved a timeline of the rejected log.'
+        )
+
     def tearDown(self) -> None:
         shutil.rmtree(TEST_REPORTS_DIR)
         os.remove(CUSTOM_CONFIG_PATH)
@@ -0,0 +1,264 @@
+from datetime import date
+from inspect import getsourcefile
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+test_module_path = os.path.abspath(getsourcefile(lambda: 0))
+test_dir_path = os.path.dirname(test_module_path)
+script_dir_path = os.path.dirname(test_dir_path)
+sys.path.insert(0, script_dir_path)
+
+from calculations import TooManyParseErrors  # noqa: E402
+from calculations import aggregate_log_notes  # noqa: E402
+from calculations import get_log_aggregates  # noqa: E402
+from calculations import get_sample_error_ratio  # noqa: E402
+from calculations import get_source_aggregates  # noqa: E402
+from gzip_pipeline import gzip_pipeline_reader_generator  # noqa: E402
+from log_formats import compile_span_parser  # noqa: E402
+from log_processing import get_chunk_offsets  # noqa: E402
+from log_processing import get_new_log_path_and_date  # noqa: E402
+from log_processing import get_source_log_paths  # noqa: E402
+from log_processing import get_unprocessed_logs  # noqa: E402
+from log_processing import log_reader_generator  # noqa: E402
+from log_processing import MAX_LOGGED_PARSE_ERRORS  # noqa: E402
+from log_processing import mmap_log_reader_generator  # noqa: E402
+
+TEST_DATA_DIR = os.path.join(test_dir_path, 'test_data')
+PACKED_LOG_PATH = os.path.join(
+    TEST_DATA_DIR,
+    'nginx-access-ui.log-20190930.gz'
+)
+LOG_PATHS = [
+    os.path.join(TEST_DATA_DIR, 'nginx-access-ui.log-20190930'),
+    os.path.join(TEST_DATA_DIR, 'nginx-access-ui.log-20000101'),
+]
+OTHER_SERVICE_LOG_PATH = os.path.join(
+    TEST_DATA_DIR,
+    'other_service.log-20300101'
+)
+
+
+class MmapReader(unittest.TestCase):
+    """Compare the memory-mapped reader with the regex reader."""
+    def test_whole_log(self):
+        for log_path in LOG_PATHS:
+            expected_notes = list(log_reader_generator(log_path, '', 'regex'))
+            self.assertEqual(
+                list(mmap_log_reader_generator(log_path)),
+                expected_notes,
+                msg=f'Invalid notes of {log_path}.'
+            )
+
+    def test_chunks(self):
+        for log_path in LOG_PATHS:
+            expected_notes = list(log_reader_generator(log_path, '', 'regex'))
+            notes = []
+            for chunk_start, chunk_end in get_chunk_offsets(log_path, 1000):
+                notes.extend(
+                    mmap_log_reader_generator(log_path, chunk_start, chunk_end)
+                )
+            self.assertEqual(
+                notes,
+                expected_notes,
+                msg=f'Invalid notes of {log_path} chunks.'
+            )
+
+
+class GzipPipeline(unittest.TestCase):
+    """Compare the pipelined gzip reader with the gzip.open reader."""
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.mkdtemp()
+
+    def test_gzip_log(self):
+        expected_notes = list(log_reader_generator(PACKED_LOG_PATH, '.gz'))
+        self.assertEqual(
+            list(gzip_pipeline_reader_generator(PACKED_LOG_PATH)),
+            expected_notes
+        )
+
+    def test_multi_member_log(self):
+        log_path = os.path.join(self.temp_dir, 'log.gz')
+        with open(PACKED_LOG_PATH, 'rb') as packed_log:
+            packed_data = packed_log.read()
+        with open(log_path, 'wb') as multi_member_log:
+            multi_member_log.write(packed_data + packed_data)
+
+        expected_notes = list(log_reader_generator(log_path, '.gz'))
+        self.assertEqual(
+            list(gzip_pipeline_reader_generator(log_path)),
+            expected_notes
+        )
+
+    def test_truncated_log(self):
+        log_path = os.path.join(self.temp_dir, 'log.gz')
+        with open(PACKED_LOG_PATH, 'rb') as packed_log:
+            packed_data = packed_log.read()
+        with open(log_path, 'wb') as truncated_log:
+            truncated_log.write(packed_data[:-100])
+
+        with self.assertRaises(EOFError):
+            list(gzip_pipeline_reader_generator(log_path))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.temp_dir)
+
+
+class LogFormatParser(unittest.TestCase):
+    """Compare parsers compiled from log formats with the fast parser."""
+    def test_ui_short_format(self):
+        parse_span = compile_span_parser('ui_short')
+        for log_path in [*LOG_PATHS, OTHER_SERVICE_LOG_PATH]:
+            self.assertEqual(
+                list(mmap_log_reader_generator(log_path, 0, None, parse_span)),
+                list(mmap_log_reader_generator(log_path)),
+                msg=f'Invalid notes of {log_path}.'
+            )
+
+    def test_custom_format(self):
+        parse_span = compile_span_parser(
+            '$request_time $status [$time_local] $uri "$http_user_agent"'
+        )
+        lines = [
+            b'0.250 200 [29/Jun/2017:03:50:23 +0300] /api/1 "Mozilla 5.0"\n',
+            b'1.5 404 [29/Jun/2017:03:50:24 +0300] /a b "-"',
+            b'- 200 [29/Jun/2017:03:50:24 +0300] /api/1 "-"\n',
+            b'0.1 200 /api/1\n',
+        ]
+        self.assertEqual(
+            [parse_span(line, 0, len(line)) for line in lines],
+            [('/api/1', 0.25), ('/a b', 1.5), (None, None), (None, None)]
+        )
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            compile_span_parser('$remote_addr $status')
+        with self.assertRaises(ValueError):
+            compile_span_parser('$request$request_time')
+
+
+class SourceIngestion(unittest.TestCase):
+    """Read logs of several sources concurrently into one store."""
+    def test_merged_sources(self):
+        log_paths = [LOG_PATHS[0], PACKED_LOG_PATH, OTHER_SERVICE_LOG_PATH]
+        expected_aggregates = get_log_aggregates(LOG_PATHS[0], '')
+        for log_path in log_paths[1:]:
+            _, file_extension = os.path.splitext(log_path)
+            expected_aggregates.merge(
+                get_log_aggregates(log_path, file_extension)
+            )
+
+        aggregates = get_source_aggregates(
+            log_paths,
+            source_concurrency=2,
+            source_queue_size=1,
+            use_mmap=True
+        )
+        self.assertEqual(
+            aggregates.line_number,
+            expected_aggregates.line_number
+        )
+        self.assertEqual(
+            dict(zip(aggregates.urls, aggregates.counts)),
+            dict(zip(expected_aggregates.urls, expected_aggregates.counts))
+        )
+        self.assertEqual(
+            aggregates.total_request_time,
+            expected_aggregates.total_request_time
+        )
+
+    def test_invalid_source(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            log_path = os.path.join(temp_dir, 'nginx-access-ui.log-20000101')
+            with open(log_path, 'w') as log_file:
+                log_file.write('error\n' * 100000)
+            with self.assertRaises(TooManyParseErrors):
+                get_source_aggregates(
+                    [LOG_PATHS[0], log_path],
+                    source_queue_size=1,
+                    parse_error_threshold=0.2
+                )
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class LogSearch(unittest.TestCase):
+    """Choose one of a plain log and its packed copy."""
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.temp_dir, 'log')
+        self.report_dir = os.path.join(self.temp_dir, 'reports')
+        os.mkdir(self.log_dir)
+        os.mkdir(self.report_dir)
+
+    def add_logs(self, log_name):
+        log_path = os.path.join(self.log_dir, log_name)
+        shutil.copy2(LOG_PATHS[0], log_path)
+        shutil.copy2(PACKED_LOG_PATH, f'{log_path}.gz')
+        return log_path
+
+    def test_plain_log_is_preferred(self):
+        log_path = self.add_logs('nginx-access-ui.log-20190930')
+        self.assertEqual(
+            get_new_log_path_and_date(self.log_dir)[0],
+            log_path
+        )
+        unprocessed_logs = get_unprocessed_logs(self.log_dir, self.report_dir)
+        self.assertEqual(
+            [log_path for log_path, _ in unprocessed_logs],
+            [log_path]
+        )
+
+    def test_plain_source_log_is_preferred(self):
+        log_path = self.add_logs('nginx-access-ui.log-20190930-web1')
+        log_paths = get_source_log_paths(
+            self.log_dir,
+            date(2019, 9, 30)
+        )
+        self.assertEqual(log_paths, [log_path])
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.temp_dir)
+
+
+class ParseErrorAccounting(unittest.TestCase):
+    """Check early abort and logging of invalid lines."""
+    def test_running_ratio_abort(self):
+        read_line_number = 0
+
+        def read_invalid_lines():
+            nonlocal read_line_number
+            for _ in range(100000):
+                read_line_number += 1
+                yield None, None
+
+        with self.assertRaises(TooManyParseErrors):
+            aggregate_log_notes(read_invalid_lines(), None, None, 0.5)
+        self.assertLess(read_line_number, 2000, msg='Reading is not aborted.')
+
+    def test_error_logging_limit(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            log_path = os.path.join(temp_dir, 'nginx-access-ui.log-20000101')
+            with open(log_path, 'w') as log_file:
+                log_file.write('error\n' * 1000)
+            with self.assertLogs(level='ERROR') as logs:
+                aggregates = aggregate_log_notes(
+                    mmap_log_reader_generator(log_path)
+                )
+            self.assertEqual(aggregates.error_number, 1000)
+            self.assertLessEqual(
+                len(logs.records),
+                MAX_LOGGED_PARSE_ERRORS + 2
+            )
+            self.assertEqual(get_sample_error_ratio(log_path, ''), 1.0)
+            self.assertEqual(get_sample_error_ratio(LOG_PATHS[0], ''), 0.0)
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
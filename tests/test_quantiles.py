@@ -0,0 +1,58 @@
+from inspect import getsourcefile
+import os
+import random
+import sys
+import unittest
+
+test_module_path = os.path.abspath(getsourcefile(lambda: 0))
+script_dir_path = os.path.dirname(os.path.dirname(test_module_path))
+sys.path.insert(0, script_dir_path)
+
+from quantiles import QuantileHistogram, RELATIVE_ACCURACY  # noqa: E402
+
+
+class HistogramQuantiles(unittest.TestCase):
+    """Check quantile estimations of the request time histogram."""
+    def setUp(self) -> None:
+        random_generator = random.Random(0)
+        self.values = [
+            random_generator.lognormvariate(-2, 1.5) for _ in range(10000)
+        ]
+
+    def test_relative_error(self):
+        histogram = QuantileHistogram()
+        for value in self.values:
+            histogram.add(value)
+
+        sorted_values = sorted(self.values)
+        for quantile in (0, 0.5, 0.9, 0.95, 0.99, 1):
+            exact_value = sorted_values[int(quantile * (len(self.values) - 1))]
+            estimation = histogram.get_quantile(quantile)
+            self.assertLessEqual(
+                abs(estimation - exact_value) / exact_value,
+                RELATIVE_ACCURACY,
+                msg=f'Inaccurate estimation of the quantile {quantile}.'
+            )
+
+    def test_merge(self):
+        histogram = QuantileHistogram()
+        first_part, second_part = QuantileHistogram(), QuantileHistogram()
+        for value_number, value in enumerate(self.values):
+            histogram.add(value)
+            part = first_part if value_number % 3 else second_part
+            part.add(value)
+
+        first_part.merge(second_part)
+        for quantile in (0.5, 0.9, 0.99):
+            self.assertEqual(
+                first_part.get_quantile(quantile),
+                histogram.get_quantile(quantile),
+                msg='Merged histogram differs from the sequential one.'
+            )
+
+    def test_empty_histogram(self):
+        self.assertIsNone(QuantileHistogram().get_quantile(0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
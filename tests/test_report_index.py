@@ -0,0 +1,155 @@
+from datetime import date
+from inspect import getsourcefile
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+test_module_path = os.path.abspath(getsourcefile(lambda: 0))
+test_dir_path = os.path.dirname(test_module_path)
+script_dir_path = os.path.dirname(test_dir_path)
+sys.path.insert(0, script_dir_path)
+
+from report_index import find_newest_log  # noqa: E402
+from report_index import get_unindexed_logs  # noqa: E402
+from report_index import is_report_indexed, read_report_index  # noqa: E402
+from report_index import record_report  # noqa: E402
+
+LOG_PATH = os.path.join(
+    test_dir_path,
+    'test_data',
+    'nginx-access-ui.log-20190930'
+)
+
+
+class ReportIndex(unittest.TestCase):
+    """Check report lookups and cached listings of the report index."""
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.temp_dir, 'log')
+        self.report_dir = os.path.join(self.temp_dir, 'reports')
+        os.mkdir(self.log_dir)
+        os.mkdir(self.report_dir)
+        self.index_arguments = (
+            self.report_dir,
+            self.log_dir,
+            'nginx-access-ui.log-',
+            False,
+        )
+
+    def add_log(self, log_name):
+        log_path = os.path.join(self.log_dir, log_name)
+        shutil.copy2(LOG_PATH, log_path)
+        # Listings of a directory modified long ago are cached.
+        old_time = os.stat(self.log_dir).st_mtime - 60
+        os.utime(self.log_dir, (old_time, old_time))
+        return log_path
+
+    def test_report_index(self):
+        open(
+            os.path.join(self.report_dir, 'report-2019.09.29.html'),
+            'w'
+        ).close()
+        old_log_path = self.add_log('nginx-access-ui.log-20190929')
+        report_index = read_report_index(*self.index_arguments)
+        self.assertEqual(list(report_index['reports']), ['2019-09-29'])
+        self.assertIn(old_log_path, report_index['logs'])
+
+        log_path = self.add_log('nginx-access-ui.log-20190930')
+        newest_log = find_newest_log(report_index, *self.index_arguments)
+        self.assertEqual(newest_log[0], log_path)
+
+        report_index = read_report_index(*self.index_arguments)
+        listing, = report_index['log_listings'].values()
+        self.assertEqual(listing['newest_log'], [log_path, '2019-09-30'])
+        self.assertEqual(
+            find_newest_log(report_index, *self.index_arguments),
+            newest_log
+        )
+
+        record_report(
+            *self.index_arguments,
+            [log_path],
+            newest_log[1],
+            os.path.join(self.report_dir, 'report-2019.09.30.html'),
+            0.5
+        )
+        report_index = read_report_index(*self.index_arguments)
+        self.assertEqual(report_index['reports']['2019-09-30']['seconds'], 0.5)
+        self.assertEqual(
+            report_index['logs'][log_path]['size'],
+            os.path.getsize(log_path)
+        )
+
+        new_log_path = self.add_log('nginx-access-ui.log-20191001')
+        self.assertEqual(
+            find_newest_log(report_index, *self.index_arguments)[0],
+            new_log_path
+        )
+
+    def test_removed_report(self):
+        log_path = self.add_log('nginx-access-ui.log-20190930')
+        report_path = os.path.join(self.report_dir, 'report-2019.09.30.html')
+        open(report_path, 'w').close()
+        record_report(
+            *self.index_arguments,
+            [log_path],
+            date(2019, 9, 30),
+            report_path,
+            0.5
+        )
+        report_index = read_report_index(*self.index_arguments)
+        self.assertTrue(is_report_indexed(report_index, date(2019, 9, 30)))
+        self.assertEqual(
+            get_unindexed_logs(report_index, *self.index_arguments),
+            []
+        )
+
+        os.remove(report_path)
+        self.assertFalse(is_report_indexed(report_index, date(2019, 9, 30)))
+        self.assertEqual(
+            get_unindexed_logs(report_index, *self.index_arguments),
+            [(log_path, date(2019, 9, 30))]
+        )
+
+    def test_changed_log(self):
+        log_path = self.add_log('nginx-access-ui.log-20190930')
+        report_path = os.path.join(self.report_dir, 'report-2019.09.30.html')
+        open(report_path, 'w').close()
+        record_report(
+            *self.index_arguments,
+            [log_path],
+            date(2019, 9, 30),
+            report_path,
+            0.5
+        )
+        report_index = read_report_index(*self.index_arguments)
+
+        new_time = os.stat(log_path).st_mtime + 60
+        os.utime(log_path, (new_time, new_time))
+        self.assertTrue(
+            is_report_indexed(report_index, date(2019, 9, 30)),
+            msg='A copy of a log with another mtime is not valid.'
+        )
+
+        with open(log_path, 'r+b') as log_file:
+            log_file.write(b'0')
+        os.utime(log_path, (new_time, new_time))
+        self.assertFalse(
+            is_report_indexed(report_index, date(2019, 9, 30)),
+            msg='A log rewritten with the same size is not found.'
+        )
+
+        os.remove(log_path)
+        self.assertTrue(
+            is_report_indexed(report_index, date(2019, 9, 30)),
+            msg='A report of a rotated log is not valid.'
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+from inspect import getsourcefile
+import math
+import os
+import sys
+import unittest
+
+test_module_path = os.path.abspath(getsourcefile(lambda: 0))
+test_dir_path = os.path.dirname(test_module_path)
+script_dir_path = os.path.dirname(test_dir_path)
+sys.path.insert(0, script_dir_path)
+
+from aggregate_store import AggregateStore  # noqa: E402
+from calculations import get_log_aggregates  # noqa: E402
+from calculations import get_sample_aggregates  # noqa: E402
+from sampling import CONFIDENCE_Z, NoteSampler, SampleOptions  # noqa: E402
+from sampling import SampleSummary, add_count_errors  # noqa: E402
+from sampling import get_block_error, get_cluster_error  # noqa: E402
+from sampling import get_request_error, scale_aggregates  # noqa: E402
+
+LOG_PATH = os.path.join(
+    test_dir_path,
+    'test_data',
+    'nginx-access-ui.log-20190930'
+)
+
+
+class SampleErrors(unittest.TestCase):
+    """Check relative 95% errors of estimated totals."""
+    def test_request_error(self):
+        self.assertAlmostEqual(
+            get_request_error(0.5, 10, 20),
+            CONFIDENCE_Z * math.sqrt(10) / 10
+        )
+        self.assertEqual(get_request_error(1, 10, 20), 0)
+        self.assertIsNone(get_request_error(0.5, 0, 0))
+
+    def test_cluster_error(self):
+        self.assertAlmostEqual(
+            get_cluster_error(0.25, [1, 2, 3]),
+            CONFIDENCE_Z * math.sqrt(0.75 * 14) / 6
+        )
+        self.assertIsNone(get_cluster_error(0.25, []))
+
+    def test_block_error(self):
+        self.assertEqual(get_block_error(4, [(10, 20), (10, 20)]), 0)
+        self.assertAlmostEqual(
+            get_block_error(4, [(10, 10), (10, 30)]),
+            CONFIDENCE_Z * math.sqrt(0.5 * 200 / 2) / 20
+        )
+        self.assertIsNone(get_block_error(4, [(10, 20)]))
+        self.assertIsNone(get_block_error(4, [(10, 0), (10, 0)]))
+
+    def test_count_errors(self):
+        report_list = [{'url': '/api/1', 'count': 200}]
+        request_summary = SampleSummary('request', 0.5, 2, 0, 0, 0)
+        add_count_errors(report_list, request_summary)
+        self.assertAlmostEqual(
+            report_list[0]['count_error'],
+            CONFIDENCE_Z * math.sqrt(0.5 / 100)
+        )
+
+        for sample_mode in ('url', 'block'):
+            report_list = [{'url': '/api/1', 'count': 200}]
+            add_count_errors(
+                report_list,
+                request_summary._replace(mode=sample_mode)
+            )
+            self.assertNotIn('count_error', report_list[0])
+
+
+class SampleScaling(unittest.TestCase):
+    """Scale sampled aggregates to the whole log."""
+    def setUp(self) -> None:
+        self.aggregates = AggregateStore()
+        for request_time in (0.1, 0.2, 0.3):
+            self.aggregates.add('/api/1', request_time)
+        self.aggregates.add('/api/2', 0.5)
+
+    def test_scale_urls(self):
+        median = self.aggregates.get_quantile(0, 0.5)
+        time_max = self.aggregates.time_maxs[0]
+        scale_aggregates(self.aggregates, 2.5)
+        self.assertEqual(list(self.aggregates.counts), [8, 2])
+        self.assertEqual(self.aggregates.total_request_number, 10)
+        self.assertEqual(self.aggregates.get_quantile(0, 0.5), median)
+        self.assertEqual(self.aggregates.time_maxs[0], time_max)
+
+    def test_keep_urls(self):
+        time_sums = list(self.aggregates.time_sums)
+        total_request_time = self.aggregates.total_request_time
+        scale_aggregates(self.aggregates, 2, scale_urls=False)
+        self.assertEqual(list(self.aggregates.counts), [3, 1])
+        self.assertEqual(list(self.aggregates.time_sums), time_sums)
+        self.assertEqual(self.aggregates.total_request_number, 8)
+        self.assertEqual(
+            self.aggregates.total_request_time,
+            2 * total_request_time
+        )
+
+
+class RequestSampling(unittest.TestCase):
+    """Select log notes by a deterministic hash."""
+    def setUp(self) -> None:
+        self.log_notes = [
+            (f'/api/{position % 50}', position / 1000)
+            for position in range(10000)
+        ]
+        self.log_notes[10] = (None, None)
+
+    def test_request_sample(self):
+        note_sampler = NoteSampler(0.25)
+        sampled_notes = list(note_sampler.sample(self.log_notes))
+        self.assertEqual(
+            sampled_notes,
+            list(NoteSampler(0.25).sample(self.log_notes)),
+            msg='The sample is not deterministic.'
+        )
+        self.assertLess(abs(len(sampled_notes) / 2500 - 1), 0.05)
+        self.assertAlmostEqual(
+            note_sampler.time_square_sum,
+            sum(
+                request_time ** 2 for url, request_time in sampled_notes
+                if url is not None
+            )
+        )
+        self.assertEqual(
+            len(list(NoteSampler(1).sample(self.log_notes))),
+            len(self.log_notes)
+        )
+
+    def test_url_sample(self):
+        sampled_notes = list(
+            NoteSampler(0.5, by_url=True).sample(self.log_notes)
+        )
+        sampled_urls = [url for url, _ in sampled_notes]
+        log_urls = [url for url, _ in self.log_notes]
+        distinct_urls = set(sampled_urls) - {None}
+        self.assertTrue(0 < len(distinct_urls) < 50)
+        for url in distinct_urls:
+            self.assertEqual(
+                sampled_urls.count(url),
+                log_urls.count(url),
+                msg='Requests of a sampled URL are missing.'
+            )
+
+
+class UrlSample(unittest.TestCase):
+    """Aggregate all requests of sampled URLs of a log."""
+    def test_url_sample(self):
+        aggregates = get_log_aggregates(LOG_PATH, '')
+        sample_aggregates, summary = get_sample_aggregates(
+            LOG_PATH,
+            '',
+            SampleOptions(0.5, 'url', 0)
+        )
+        self.assertEqual(summary.mode, 'url')
+        self.assertEqual(summary.scale, 2)
+        self.assertTrue(0 < len(sample_aggregates) < len(aggregates))
+        for url_id, url in enumerate(sample_aggregates.urls):
+            exact_url_id = aggregates.url_ids[url]
+            self.assertEqual(
+                sample_aggregates.counts[url_id],
+                aggregates.counts[exact_url_id]
+            )
+            self.assertEqual(
+                sample_aggregates.time_sums[url_id],
+                aggregates.time_sums[exact_url_id]
+            )
+        self.assertEqual(
+            sample_aggregates.total_request_number,
+            2 * sum(sample_aggregates.counts)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
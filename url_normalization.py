@@ -0,0 +1,117 @@
+"""Functions to normalize URLs of log notes before aggregation."""
+
+from collections import namedtuple
+from functools import lru_cache
+import hashlib
+import json
+import re
+from typing import Callable, Generator, Iterable, Sequence, Tuple, Union
+
+NUMBER_SEGMENT_PATTERN = re.compile(r'(?<=/)\d+(?=/|$)')
+UUID_SEGMENT_PATTERN = re.compile(
+    r'(?<=/)[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}'
+    r'-[0-9a-fA-F]{12}(?=/|$)'
+)
+HASH_SEGMENT_PATTERN = re.compile(r'(?<=/)[0-9a-fA-F]{16,}(?=/|$)')
+NUMBER_PLACEHOLDER = '{id}'
+UUID_PLACEHOLDER = '{uuid}'
+HASH_PLACEHOLDER = '{hash}'
+
+UrlRules = namedtuple(
+    'UrlRules',
+    ['strip_query', 'collapse_ids', 'custom_rules', 'cache_size']
+)
+
+
+def check_custom_rules(custom_rules: Sequence[Sequence[str]]):
+    """
+    Check that custom rules are pairs of a valid regex and a replacement.
+
+    :param custom_rules: a list of pairs [regex, replacement];
+    :raise ValueError: if a rule is invalid.
+    """
+    for rule in custom_rules:
+        if (
+                not isinstance(rule, (list, tuple))
+                or len(rule) != 2
+                or not all(isinstance(item, str) for item in rule)
+        ):
+            raise ValueError(f'{rule} is not a pair [regex, replacement]')
+        pattern, replacement = rule
+        try:
+            re.compile(pattern).sub(replacement, '')
+        except re.error as error:
+            raise ValueError(f'{pattern}: {error}') from None
+
+
+def get_url_rules_digest(url_rules: Union[UrlRules, None]) -> str:
+    """
+    Return a digest of rules which change normalized URLs.
+
+    It is saved with cached aggregates, so aggregates of URLs normalized
+    by other rules are not reused. The cache size does not change URLs,
+    so it is not included.
+
+    :param url_rules: normalization rules. None if URLs are kept as is;
+    :return: a hex digest of the rules.
+    """
+    rules = None
+    if url_rules:
+        rules = [
+            bool(url_rules.strip_query),
+            bool(url_rules.collapse_ids),
+            [list(rule) for rule in url_rules.custom_rules],
+        ]
+    return hashlib.sha1(json.dumps(rules).encode('utf_8')).hexdigest()
+
+
+def get_url_normalizer(url_rules: UrlRules) -> Callable[[str], str]:
+    """
+    Return a function normalizing a URL by rules.
+
+    Results are memoized per raw URL in a bounded LRU cache, so frequent
+    URLs are not matched against the rules again.
+
+    :param url_rules: normalization rules. custom_rules is a list of pairs
+    [regex, replacement] applied after built-in rules;
+    :return: a function which returns a normalized URL.
+    """
+    custom_rules = [
+        (re.compile(pattern), replacement)
+        for pattern, replacement in url_rules.custom_rules
+    ]
+
+    @lru_cache(maxsize=url_rules.cache_size)
+    def normalize_url(url: str) -> str:
+        path, query_separator, query = url.partition('?')
+        if url_rules.collapse_ids:
+            path = UUID_SEGMENT_PATTERN.sub(UUID_PLACEHOLDER, path)
+            path = NUMBER_SEGMENT_PATTERN.sub(NUMBER_PLACEHOLDER, path)
+            path = HASH_SEGMENT_PATTERN.sub(HASH_PLACEHOLDER, path)
+        if not url_rules.strip_query:
+            path = f'{path}{query_separator}{query}'
+
+        for pattern, replacement in custom_rules:
+            path = pattern.sub(replacement, path)
+        return path
+
+    return normalize_url
+
+
+def normalize_log_notes(
+        log_reader: Iterable[Tuple[str, float]],
+        url_rules: UrlRules
+) -> Generator[Tuple[str, float], None, None]:
+    """
+    Yield log notes with normalized URLs.
+
+    :param log_reader: an iterable yielding log notes starting with url;
+    :param url_rules: normalization rules;
+    :return: a log note with a normalized url.
+    """
+    normalize_url = get_url_normalizer(url_rules)
+    for log_note in log_reader:
+        url = log_note[0]
+        if url is not None:
+            log_note = (normalize_url(url), *log_note[1:])
+        yield log_note